@@ -0,0 +1,101 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+
+class MicroBatcher:
+    """
+    Collects single-item requests from many threads into small batches.
+
+    A background thread waits for the first request, then keeps collecting
+    until it has `max_batch_size` items or `max_wait_ms` has passed since the
+    first one arrived. The whole batch goes through `process_batch` in one
+    call, and each caller gets back the result at its own index. A result
+    that is an exception (e.g. a cancelled row) is raised to its caller only.
+
+    Both limits are plain attributes, so they can be tuned at runtime.
+    """
+
+    def __init__(self, name: str, process_batch: Callable[[list], list], max_batch_size: int = 8, max_wait_ms: float = 50):
+        self.name = name
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_ms = max(0.0, float(max_wait_ms))
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # --- Metrics ---
+        self.batches = 0
+        self.items = 0
+        self.total_queue_delay_ms = 0.0
+        self.max_queue_delay_ms = 0.0
+
+    def submit(self, item: Any, timeout: Optional[float] = None) -> Any:
+        """Queues one item and blocks until its batch has been processed."""
+        future = Future()
+        self._ensure_started()
+        self._queue.put((item, future, time.perf_counter()))
+        return future.result(timeout)
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name=f"batcher-{self.name}", daemon=True)
+                self._thread.start()
+
+    def _loop(self) -> None:
+        while True:
+            first = self._queue.get()
+            batch = [first]
+            deadline = first[2] + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    if remaining > 0:
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        # Window closed, but take whatever is already waiting
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._run(batch)
+
+    def _run(self, batch: list) -> None:
+        started = time.perf_counter()
+        delays_ms = [(started - enqueued) * 1000 for _, _, enqueued in batch]
+        with self._lock:
+            self.batches += 1
+            self.items += len(batch)
+            self.total_queue_delay_ms += sum(delays_ms)
+            self.max_queue_delay_ms = max(self.max_queue_delay_ms, max(delays_ms))
+
+        items = [item for item, _, _ in batch]
+        try:
+            results = self.process_batch(items)
+            if len(results) != len(items):
+                raise RuntimeError(f"{self.name}: batch returned {len(results)} results for {len(items)} items.")
+        except Exception as e:
+            print(f"Error in {self.name} batch of {len(items)}: {e}")
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for (_, future, _), result in zip(batch, results):
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        """Returns batch count, mean batch fill ratio and queueing delay."""
+        with self._lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+                "batches": self.batches,
+                "items": self.items,
+                "fill_ratio": self.items / (self.batches * self.max_batch_size) if self.batches else 0.0,
+                "mean_queue_delay_ms": self.total_queue_delay_ms / self.items if self.items else 0.0,
+                "max_queue_delay_ms": self.max_queue_delay_ms,
+            }
@@ -0,0 +1,163 @@
+import contextvars
+import gc
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+try:
+    import ctypes
+    _LIBC = ctypes.CDLL("libc.so.6")  # glibc only, for malloc_trim
+except (ImportError, OSError):
+    _LIBC = None
+
+
+class OperationCancelled(Exception):
+    """Raised inside a model call when its cancel token fires (the job was cancelled or abandoned)."""
+
+
+class StageTimeoutError(OperationCancelled):
+    """Raised when a stage runs past its time budget."""
+
+
+class CancelToken:
+    """
+    A cooperative cancellation flag, optionally with a deadline.
+
+    Long model loops check it once per step (a diffusion step, a decoded
+    token) and stop with OperationCancelled, so abandoned work gives its CPU
+    back within one step. A child token (`child`) fires when its parent does,
+    and can add its own, shorter time budget, e.g. per pipeline stage.
+    """
+
+    def __init__(self, timeout: Optional[float] = None, name: Optional[str] = None, parent: Optional["CancelToken"] = None):
+        self.name = name
+        self.timeout = timeout or None
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.parent = parent
+        self.reason: Optional[str] = None
+        self.timed_out = False
+        self._event = threading.Event()
+        self._callbacks: list[Callable[[], None]] = []
+        # Weak, so the many short-lived per-stage children don't pile up here
+        self._children: weakref.WeakSet = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def cancel(self, reason: str = "Cancelled.", timed_out: bool = False) -> None:
+        """Fires the token (idempotent) and calls its `on_cancel` callbacks."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self.timed_out = timed_out
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+            children = list(self._children)
+        for child in children:
+            child.cancel(reason, timed_out)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Cancel callback failed: {e}")
+
+    @property
+    def cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+        if self.parent is not None and self.parent.cancelled:
+            self.cancel(self.parent.reason, self.parent.timed_out)
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel(f"'{self.name or 'operation'}' ran past its {self.timeout:g}s time budget.", timed_out=True)
+            return True
+        return False
+
+    def check(self) -> None:
+        """Raises OperationCancelled (StageTimeoutError for a deadline) if the token has fired."""
+        if self.cancelled:
+            raise (StageTimeoutError if self.timed_out else OperationCancelled)(self.reason)
+
+    def remaining(self) -> Optional[float]:
+        """Seconds until the nearest deadline of this token and its ancestors (None without one)."""
+        deadlines = []
+        token = self
+        while token is not None:
+            if token.deadline is not None:
+                deadlines.append(token.deadline)
+            token = token.parent
+        return max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+
+    def child(self, timeout: Optional[float] = None, name: Optional[str] = None) -> "CancelToken":
+        """A token that fires with this one, or on its own after `timeout` seconds."""
+        child = CancelToken(timeout, name, parent=self)
+        with self._lock:
+            self._children.add(child)
+        if self.cancelled:
+            child.cancel(self.reason, self.timed_out)
+        return child
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        Calls `callback()` when the token is cancelled (right away if it
+        already was). Deadlines fire lazily, when the token is next checked.
+        Returns a function that unregisters the callback.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+def check(token: Optional[CancelToken]) -> None:
+    """`token.check()` for an optional token."""
+    if token is not None:
+        token.check()
+
+def release_memory() -> None:
+    """Frees what an aborted model call left behind and hands freed heap pages back to the OS."""
+    gc.collect()
+    if _LIBC is not None and hasattr(_LIBC, "malloc_trim"):
+        _LIBC.malloc_trim(0)
+
+
+# --- Current Token ---
+# The token of the pipeline stage running in this context. The stage graph
+# sets it per stage, and stages pass it on to the model calls they make.
+_CURRENT_TOKEN: contextvars.ContextVar = contextvars.ContextVar("adgen_cancel_token", default=None)
+
+def current_token() -> Optional[CancelToken]:
+    return _CURRENT_TOKEN.get()
+
+@contextmanager
+def cancel_scope(token: Optional[CancelToken]):
+    """Makes `token` the current token inside the block."""
+    reset = _CURRENT_TOKEN.set(token)
+    try:
+        yield token
+    finally:
+        _CURRENT_TOKEN.reset(reset)
+
+
+class CancelledRows:
+    """
+    Stopping criterion for a batched `generate`: rows whose token fired are
+    finished early, and decoding stops once every row is finished or
+    cancelled. Rows without a token (None) are never cancelled.
+    """
+
+    def __init__(self, tokens: list[Optional[CancelToken]]):
+        self.tokens = tokens
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+        cancelled = [token is not None and token.cancelled for token in self.tokens]
+        return torch.tensor(cancelled, dtype=torch.bool, device=input_ids.device)
@@ -0,0 +1,436 @@
+"""
+Bulk catalog mode: generates ad packages for a whole folder or CSV manifest of
+products in one run.
+
+Items are processed in chunks, and each chunk goes through the pipeline one
+stage at a time (all captions, then all cut-outs, then all ad copy, then all
+scenes). Every model is therefore used for a whole chunk in a row instead of
+being swapped in and out per product, and BLIP and Gemma see full batches.
+
+Results are appended to `results.jsonl` in the output directory as each chunk
+finishes, and the generated images are written next to it. Re-running the same
+command skips every item that already succeeded, so a crashed run resumes where
+it stopped.
+
+Usage:
+    python -m adgen_studio.catalog products/ --output catalog_out --prompt "on a marble table"
+    python -m adgen_studio.catalog manifest.csv --output catalog_out --variants 2
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from adgen_studio.config import CATALOG_CHUNK_SIZE, CAPTION_BATCH_SIZE, TEXT_GEN_BATCH_SIZE, OUTPUT_SIZE, STAGE_TIMEOUTS
+from adgen_studio.cancellation import CancelToken, OperationCancelled, StageTimeoutError
+from adgen_studio.metrics import span
+from adgen_studio.ingest import ingest_image, working_side
+from adgen_studio.workers import run_on_model
+from adgen_studio.vision_core.main import caption_image, segment_image
+from adgen_studio.gen_core.image_generation import generate_new_images
+from adgen_studio.gen_core.speed_profiles import get_speed_profile
+from adgen_studio.gen_core.compositing import composite_batch, upscale_with_product
+from adgen_studio.gen_core.text_generation import generate_ad_copy
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+RESULTS_FILENAME = "results.jsonl"
+
+
+class CatalogError(Exception):
+    """Raised when a catalog source can't be read."""
+
+
+# --- Paths ---
+def resolve_under_root(path: str, root: str) -> str:
+    """
+    `path` (relative to `root`, or absolute) with symlinks resolved.
+
+    Raises:
+        CatalogError: If the resolved path isn't inside `root`.
+    """
+    root = os.path.realpath(root)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise CatalogError(f"Catalog path is outside the catalog root: {path}")
+    return resolved
+
+def _manifest_image_path(base_dir: str, value: str) -> str:
+    """A manifest's image path joined to the manifest's folder; absolute paths and ".." are rejected."""
+    parts = value.replace("\\", "/").split("/")
+    if not value or os.path.isabs(value) or os.path.splitdrive(value)[0] or ".." in parts:
+        raise CatalogError(f"Manifest image paths must be relative and stay in the manifest's folder: {value!r}")
+    return os.path.join(base_dir, value)
+
+
+# --- Manifest Loading ---
+def _item_id(image_path: str) -> str:
+    return os.path.splitext(os.path.basename(image_path))[0]
+
+def slugify_id(item_id: str) -> str:
+    """
+    An item id that is safe in an image file name: runs of anything but
+    letters, digits, "-", "_" and "." become "-", and leading and trailing
+    dashes and dots go, so an id can't name another folder (e.g. "../../x"
+    becomes "x").
+    """
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "-", item_id).strip("-.")
+    if not slug:
+        raise CatalogError(f"Catalog item id has no usable characters: {item_id!r}")
+    return slug
+
+def load_manifest(source: str, default_prompt: Optional[str] = None, root: Optional[str] = None) -> list[dict]:
+    """
+    Lists the products of a catalog as `{"id", "image", "prompt"}` dicts.
+
+    Args:
+        source: Either a folder of product images, or a CSV file with an
+            `image` column (paths relative to the CSV) and optional `prompt`
+            and `id` columns. In a folder, a `<name>.txt` file next to
+            `<name>.jpg` holds that product's scene prompt.
+        default_prompt: The scene prompt for items that don't have their own.
+        root: When set, every image must resolve (symlinks included) to a
+            file inside this folder.
+
+    Returns:
+        The items in a stable order. Ids default to the image file name
+        without its extension, are slugified (see `slugify_id`) and must be
+        unique.
+    """
+    items = []
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            image_path = os.path.join(source, name)
+            prompt = default_prompt
+            prompt_path = os.path.splitext(image_path)[0] + ".txt"
+            if os.path.exists(prompt_path):
+                with open(prompt_path, encoding="utf-8") as f:
+                    prompt = f.read().strip() or default_prompt
+            items.append({"id": _item_id(image_path), "image": image_path, "prompt": prompt})
+    elif os.path.isfile(source) and source.lower().endswith(".csv"):
+        base_dir = os.path.dirname(os.path.abspath(source))
+        with open(source, newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            if "image" not in (reader.fieldnames or []):
+                raise CatalogError(f"Manifest {source} has no 'image' column.")
+            for row in reader:
+                image_path = _manifest_image_path(base_dir, (row["image"] or "").strip())
+                items.append({
+                    "id": (row.get("id") or "").strip() or _item_id(image_path),
+                    "image": image_path,
+                    "prompt": (row.get("prompt") or "").strip() or default_prompt,
+                })
+    else:
+        raise CatalogError(f"Catalog source must be a folder or a .csv manifest: {source}")
+
+    if root:
+        for item in items:
+            resolve_under_root(item["image"], root)
+
+    seen = set()
+    for item in items:
+        item["id"] = slugify_id(item["id"])
+        if item["id"] in seen:
+            raise CatalogError(f"Duplicate item id in catalog: {item['id']}")
+        seen.add(item["id"])
+    return items
+
+def load_finished_ids(results_path: str) -> set:
+    """Ids whose latest record in the results file succeeded; failed items are retried."""
+    status = {}
+    if not os.path.exists(results_path):
+        return set()
+    with open(results_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # A line cut short by a crash
+            status[record.get("id")] = record.get("status")
+    return {item_id for item_id, item_status in status.items() if item_status == "succeeded"}
+
+def _ends_mid_line(path: str) -> bool:
+    """Whether the results file ends in a line cut short by a crash."""
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return False
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b"\n"
+
+
+# --- Stage-by-Stage Processing ---
+def _run_stage(
+    name: str, states: list[dict], fn: Callable[[dict, CancelToken], None], workers: int, cancel_token: CancelToken,
+) -> None:
+    """
+    Applies `fn(state, item_token)` to every item that hasn't failed yet.
+
+    With `workers` > 1 the items are submitted concurrently, so the model's
+    micro-batcher groups them into batched forward passes. An exception marks
+    only that item as failed; so does running past the stage's time budget
+    (STAGE_TIMEOUTS), which each item's token carries. A cancelled run stops
+    the stage.
+    """
+    live = [state for state in states if state.get("error") is None]
+    if not live:
+        return
+    print(f"Catalog stage '{name}' for {len(live)} item(s)...")
+
+    def apply(state):
+        item_token = cancel_token.child(STAGE_TIMEOUTS.get(name), name)
+        try:
+            item_token.check()
+            fn(state, item_token)
+        except StageTimeoutError as e:
+            print(f"Catalog item '{state['id']}' failed in stage '{name}': {e}")
+            state["error"] = f"{name}: {e}"
+        except OperationCancelled:
+            raise
+        except Exception as e:
+            print(f"Catalog item '{state['id']}' failed in stage '{name}': {e}")
+            state["error"] = f"{name}: {e}"
+
+    with span(f"catalog_{name}"):
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"adgen-catalog-{name}") as pool:
+                list(pool.map(apply, live))
+        else:
+            for state in live:
+                apply(state)
+
+def _run_batch_stage(
+    name: str, states: list[dict], fn: Callable[[list[dict], CancelToken], None], cancel_token: CancelToken,
+) -> None:
+    """Applies `fn(states, cancel_token)` once to all items that haven't failed; an exception fails all of them."""
+    live = [state for state in states if state.get("error") is None]
+    if not live:
+        return
+    print(f"Catalog stage '{name}' for {len(live)} item(s)...")
+    with span(f"catalog_{name}"):
+        try:
+            cancel_token.check()
+            fn(live, cancel_token)
+        except OperationCancelled:
+            raise
+        except Exception as e:
+            print(f"Catalog stage '{name}' failed for the chunk: {e}")
+            for state in live:
+                state["error"] = f"{name}: {e}"
+
+def _make_load(output_size: int) -> Callable[[dict, CancelToken], None]:
+    def load(state: dict, cancel_token: CancelToken) -> None:
+        if not state["prompt"]:
+            raise ValueError("no scene prompt")
+        with open(state["image"], "rb") as f:
+            image_bytes = f.read()
+        ingested = ingest_image(image_bytes, working_side(output_size))
+        state["image_obj"] = ingested["image"]
+        state["hash"] = ingested["hash"]
+    return load
+
+def _caption(state: dict, cancel_token: CancelToken) -> None:
+    # Failures raise, so the item is recorded as failed and retried on the next run
+    state["caption"] = run_on_model(
+        "caption", caption_image, state["image_obj"], state["hash"], cancel_token=cancel_token, raise_errors=True,
+    )
+
+def _segmentation(state: dict, cancel_token: CancelToken) -> None:
+    # Per item, so each one gets its own segmentation time budget
+    state["segmented"] = run_on_model(
+        "segmentation", segment_image, state["image_obj"], state["hash"], cancel_token=cancel_token,
+    )
+    del state["image_obj"]  # Only the cut-out is needed from here on
+
+def _ad_copy(state: dict, cancel_token: CancelToken) -> None:
+    state["ad_copy"] = run_on_model(
+        "ad_copy", generate_ad_copy, state["caption"], cancel_token=cancel_token, raise_errors=True,
+    )
+
+def _compositing(states: list[dict], cancel_token: CancelToken) -> None:
+    # Inpainting inputs for the whole chunk in one vectorized call
+    masked = composite_batch([state["segmented"] for state in states])
+    for state, (base_image, mask_image) in zip(states, masked):
+        state["base_image"], state["mask_image"] = base_image, mask_image
+
+def _make_inpainting(num_variants: int, profile: Optional[str], output_size: int) -> Callable[[dict, CancelToken], None]:
+    def inpainting(state: dict, cancel_token: CancelToken) -> None:
+        images, state["seeds"] = run_on_model(
+            "inpainting", generate_new_images,
+            state.pop("base_image"), state.pop("mask_image"), state["prompt"],
+            num_variants=num_variants, profile=profile, cancel_token=cancel_token,
+        )
+        segmented = state.pop("segmented")
+        if output_size:
+            images = [upscale_with_product(image, segmented, output_size) for image in images]
+        state["images"] = images
+    return inpainting
+
+def _write_results(states: list[dict], output_dir: str, results_file) -> None:
+    """Saves the chunk's images and appends one JSON line per item."""
+    image_dir = os.path.join(output_dir, "images")
+    os.makedirs(image_dir, exist_ok=True)
+    for state in states:
+        record = {"id": state["id"], "image": state["image"], "prompt": state["prompt"]}
+        if state.get("error") is None:
+            image_paths = []
+            for index, image in enumerate(state["images"]):
+                path = os.path.join(image_dir, f"{state['id']}_v{index}.png")
+                image.save(path, format="PNG")
+                image_paths.append(os.path.relpath(path, output_dir))
+            record.update({
+                "status": "succeeded",
+                "caption": state["caption"],
+                "ad_copy": state["ad_copy"],
+                "generated_images": image_paths,
+                "seeds": state["seeds"],
+            })
+        else:
+            record.update({"status": "failed", "error": state["error"]})
+        results_file.write(json.dumps(record) + "\n")
+    # Durable before the next chunk starts, so a crash loses at most one chunk
+    results_file.flush()
+    os.fsync(results_file.fileno())
+
+def run_catalog(
+    source: str,
+    output_dir: str,
+    prompt: Optional[str] = None,
+    num_variants: int = 1,
+    profile: Optional[str] = None,
+    chunk_size: int = CATALOG_CHUNK_SIZE,
+    progress: Optional[Callable[..., None]] = None,
+    output_size: Optional[int] = None,
+    cancel_token: Optional[CancelToken] = None,
+    root: Optional[str] = None,
+) -> dict:
+    """
+    Generates ad packages for every product in a catalog.
+
+    Args:
+        source: A folder of product images or a CSV manifest (see `load_manifest`).
+        output_dir: Where `results.jsonl` and the generated images are written.
+        prompt: The default scene prompt.
+        num_variants: Scene variants per product.
+        profile: The inpainting speed profile (a key of `SPEED_PROFILES`),
+            checked before any item runs.
+        chunk_size: Items that go through the stages together. Larger chunks
+            mean fuller batches and fewer model switches, but more images in RAM.
+        progress: Optional `progress(event, data)` callback. It receives a
+            "catalog_item" event with the item's status and the running count
+            for every item written.
+        output_size: Long side of the saved images (ADGEN_OUTPUT_SIZE when
+            None); 0 keeps the diffusion canvas size.
+        cancel_token: Stops the run at the next model step when it fires.
+            Chunks already written stay in `results.jsonl`, so re-running
+            resumes from there.
+        root: When set, `source`, `output_dir` and every image must be
+            inside this folder (see `resolve_under_root`); relative paths
+            are taken from it.
+
+    Returns:
+        A summary with the item counts, the time taken and the results path.
+    """
+    emit = progress or (lambda event, data=None: None)
+    output_size = OUTPUT_SIZE if output_size is None else output_size
+    cancel_token = cancel_token or CancelToken()
+    # Checked before any item runs, so a typo doesn't fail after the first chunk's captions and copy
+    try:
+        get_speed_profile(profile)
+    except ValueError as e:
+        raise CatalogError(str(e))
+    if root:
+        source, output_dir = resolve_under_root(source, root), resolve_under_root(output_dir, root)
+    items = load_manifest(source, prompt, root)
+    os.makedirs(output_dir, exist_ok=True)
+    results_path = os.path.join(output_dir, RESULTS_FILENAME)
+
+    finished = load_finished_ids(results_path)
+    pending = [item for item in items if item["id"] not in finished]
+    print(f"--- Catalog Started: {len(items)} item(s), {len(items) - len(pending)} already done ---")
+
+    # (name, fn, workers); workers=None means fn takes the whole chunk at once
+    stages = [
+        ("load", _make_load(output_size), 1),
+        ("caption", _caption, CAPTION_BATCH_SIZE),
+        ("segmentation", _segmentation, 1),
+        ("ad_copy", _ad_copy, TEXT_GEN_BATCH_SIZE),
+        ("compositing", _compositing, None),
+        ("inpainting", _make_inpainting(num_variants, profile, output_size), 1),
+    ]
+
+    start = time.perf_counter()
+    succeeded = failed = 0
+    cut_short = _ends_mid_line(results_path)
+    with open(results_path, "a", encoding="utf-8") as results_file:
+        if cut_short:
+            # End the partial line, so the first new record isn't glued onto it
+            results_file.write("\n")
+        for offset in range(0, len(pending), max(1, chunk_size)):
+            states = [dict(item) for item in pending[offset:offset + chunk_size]]
+            for name, fn, workers in stages:
+                if workers is None:
+                    _run_batch_stage(name, states, fn, cancel_token)
+                else:
+                    _run_stage(name, states, fn, workers, cancel_token)
+            _write_results(states, output_dir, results_file)
+
+            for state in states:
+                if state.get("error") is None:
+                    succeeded += 1
+                else:
+                    failed += 1
+                emit("catalog_item", {
+                    "id": state["id"],
+                    "status": "failed" if state.get("error") else "succeeded",
+                    "error": state.get("error"),
+                    "done": succeeded + failed,
+                    "total": len(pending),
+                })
+
+    summary = {
+        "total": len(items),
+        "skipped": len(items) - len(pending),
+        "succeeded": succeeded,
+        "failed": failed,
+        "seconds": round(time.perf_counter() - start, 3),
+        "results_path": results_path,
+    }
+    print(f"--- Catalog Finished: {succeeded} succeeded, {failed} failed in {summary['seconds']:.1f}s ---")
+    return summary
+
+
+# --- Command Line ---
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate ad packages for a folder or CSV manifest of products.")
+    parser.add_argument("source", help="Folder of product images, or a CSV with image[,prompt][,id] columns.")
+    parser.add_argument("--output", required=True, help="Output folder for results.jsonl and images.")
+    parser.add_argument("--prompt", default=None, help="Default scene prompt for items without their own.")
+    parser.add_argument("--variants", type=int, default=1, help="Scene variants per product.")
+    parser.add_argument("--profile", default=None, help="Inpainting speed profile: baseline, preview, standard or final.")
+    parser.add_argument("--chunk-size", type=int, default=CATALOG_CHUNK_SIZE, help="Items per stage-by-stage chunk.")
+    parser.add_argument("--output-size", type=int, default=None, help="Long side of the saved images, e.g. 2048 (0: canvas size).")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    try:
+        summary = run_catalog(
+            args.source, args.output, prompt=args.prompt,
+            num_variants=args.variants, profile=args.profile, chunk_size=args.chunk_size,
+            output_size=args.output_size,
+        )
+    except CatalogError as e:
+        print(f"Error: {e}")
+        return 2
+    print(json.dumps(summary, indent=2))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
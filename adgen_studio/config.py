@@ -0,0 +1,198 @@
+import os
+import tempfile
+
+# --- Runtime Configuration ---
+# Every setting can be overridden with an environment variable so the same
+# code runs on a laptop and on a large server without edits.
+
+GB = 1024 ** 3
+
+# Total RAM (in GB) the shared model registry may use for resident models.
+# When loading a new model would go over this budget, the least-recently-used
+# models are evicted first.
+MODEL_RAM_BUDGET_GB = float(os.environ.get("ADGEN_MODEL_RAM_BUDGET_GB", "20"))
+
+# Number of worker threads that run ad-package jobs off the event loop.
+JOB_WORKERS = int(os.environ.get("ADGEN_JOB_WORKERS", "1"))
+
+# How many jobs may wait in the queue before new submissions get a 429.
+JOB_QUEUE_SIZE = int(os.environ.get("ADGEN_JOB_QUEUE_SIZE", "16"))
+
+# How long finished job results are kept for clients to fetch, and how many
+# finished jobs (per queue) at most; past that the oldest are dropped early.
+JOB_RESULT_TTL_SECONDS = float(os.environ.get("ADGEN_JOB_RESULT_TTL_SECONDS", "3600"))
+JOB_MAX_FINISHED = int(os.environ.get("ADGEN_JOB_MAX_FINISHED", "100"))
+
+# Cross-request micro-batching: a batch runs once it has BATCH_SIZE items or
+# once WAIT_MS has passed since its first item arrived.
+CAPTION_BATCH_SIZE = int(os.environ.get("ADGEN_CAPTION_BATCH_SIZE", "8"))
+CAPTION_BATCH_WAIT_MS = float(os.environ.get("ADGEN_CAPTION_BATCH_WAIT_MS", "50"))
+TEXT_GEN_BATCH_SIZE = int(os.environ.get("ADGEN_TEXT_GEN_BATCH_SIZE", "4"))
+TEXT_GEN_BATCH_WAIT_MS = float(os.environ.get("ADGEN_TEXT_GEN_BATCH_WAIT_MS", "100"))
+
+# How many ad copy variations Gemma writes per product. Decoding stops as
+# soon as this many are complete.
+AD_COPY_VARIATIONS = int(os.environ.get("ADGEN_AD_COPY_VARIATIONS", "3"))
+
+# Copywriter prompt template (tone/language) used when a request doesn't
+# name one, and whether the template's static prefix is prefilled once and
+# its KV cache reused by every request instead of being recomputed.
+AD_COPY_TEMPLATE = os.environ.get("ADGEN_AD_COPY_TEMPLATE", "default")
+TEXT_GEN_PREFIX_CACHE = os.environ.get("ADGEN_TEXT_GEN_PREFIX_CACHE", "1") != "0"
+
+# Content-addressed cache for captions, segmentation output and ad copy.
+# Set ADGEN_RESULT_CACHE_DIR to an empty string to keep it memory-only.
+# The memory tier is bounded both by entry count and by size (segmented
+# images dominate: a 2048 px RGBA cut-out is 16 MB).
+RESULT_CACHE_ENABLED = os.environ.get("ADGEN_RESULT_CACHE", "1") != "0"
+RESULT_CACHE_MEMORY_ITEMS = int(os.environ.get("ADGEN_RESULT_CACHE_MEMORY_ITEMS", "256"))
+RESULT_CACHE_MEMORY_MB = float(os.environ.get("ADGEN_RESULT_CACHE_MEMORY_MB", "512"))
+RESULT_CACHE_DIR = os.environ.get("ADGEN_RESULT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "adgen_result_cache"))
+RESULT_CACHE_DISK_MB = float(os.environ.get("ADGEN_RESULT_CACHE_DISK_MB", "1024"))
+
+# The pipeline runs independent stages (captioning vs. segmentation, ad copy
+# vs. inpainting) in parallel, up to this many at once, as long as the models
+# of the running stages fit in the pipeline memory budget.
+PIPELINE_MAX_PARALLEL_STAGES = int(os.environ.get("ADGEN_PIPELINE_MAX_PARALLEL_STAGES", "2"))
+PIPELINE_MEMORY_BUDGET_GB = float(os.environ.get("ADGEN_PIPELINE_MEMORY_BUDGET_GB", str(MODEL_RAM_BUDGET_GB)))
+
+# Per-stage time budgets in seconds (0 = no limit). A stage that runs past
+# its budget is stopped at its next diffusion step or decoded token, and
+# the job fails with a timeout instead of holding the worker.
+STAGE_TIMEOUTS = {
+    "caption": float(os.environ.get("ADGEN_CAPTION_TIMEOUT_SECONDS", "0")),
+    "segmentation": float(os.environ.get("ADGEN_SEGMENTATION_TIMEOUT_SECONDS", "0")),
+    "ad_copy": float(os.environ.get("ADGEN_AD_COPY_TIMEOUT_SECONDS", "0")),
+    "inpainting": float(os.environ.get("ADGEN_INPAINTING_TIMEOUT_SECONDS", "0")),
+}
+
+# Always add a Server-Timing header with per-stage timings to result
+# responses (clients can also ask for it per request with `?timing=true`).
+TIMING_HEADER = os.environ.get("ADGEN_TIMING_HEADER", "0") == "1"
+
+# Multi-variant image generation: at most MAX_VARIANTS images per request,
+# generated in UNet batches of at most DIFFUSION_MAX_BATCH images to bound
+# activation memory.
+MAX_VARIANTS = int(os.environ.get("ADGEN_MAX_VARIANTS", "8"))
+DIFFUSION_MAX_BATCH = int(os.environ.get("ADGEN_DIFFUSION_MAX_BATCH", "4"))
+
+# Bulk catalog mode: products that go through the pipeline stages together.
+CATALOG_CHUNK_SIZE = int(os.environ.get("ADGEN_CATALOG_CHUNK_SIZE", "32"))
+
+# `POST /catalog/` only reads catalogs from, and writes results to, folders
+# under this root (checked after resolving symlinks). Empty disables the
+# endpoint; the command-line catalog tool isn't restricted.
+CATALOG_ROOT = os.environ.get("ADGEN_CATALOG_ROOT", "")
+
+# Catalog runs queued through the API go on their own queue, drained by
+# CATALOG_JOB_WORKERS threads, so a long run never holds the interactive
+# job workers. At most CATALOG_QUEUE_SIZE runs may wait.
+CATALOG_JOB_WORKERS = int(os.environ.get("ADGEN_CATALOG_JOB_WORKERS", "1"))
+CATALOG_QUEUE_SIZE = int(os.environ.get("ADGEN_CATALOG_QUEUE_SIZE", "4"))
+
+# Inference precision per model: "fp32", "bf16" or "int8" (dynamic
+# quantization of Linear layers). Lower precisions need less RAM and run
+# faster on most CPUs, at some cost in output quality.
+CAPTION_PRECISION = os.environ.get("ADGEN_CAPTION_PRECISION", "fp32").lower()
+TEXT_GEN_PRECISION = os.environ.get("ADGEN_TEXT_GEN_PRECISION", "fp32").lower()
+INPAINTING_PRECISION = os.environ.get("ADGEN_INPAINTING_PRECISION", "fp32").lower()
+
+# Inpainting speed profile used when a request doesn't name one:
+# "baseline" (the checkpoint's PNDM scheduler at 25 steps), "preview",
+# "standard" or "final".
+DEFAULT_SPEED_PROFILE = os.environ.get("ADGEN_SPEED_PROFILE", "baseline")
+
+# How many scene-prompt embeddings (CLIP text-encoder outputs) to keep.
+PROMPT_EMBED_CACHE_ITEMS = int(os.environ.get("ADGEN_PROMPT_EMBED_CACHE_ITEMS", "256"))
+
+# Background removal: the rembg model ("u2net", "u2netp", "isnet" or
+# "silueta"), ONNX Runtime threads per inference (0 = ORT default) and how
+# many images may be segmented at once across all requests.
+SEGMENTATION_MODEL = os.environ.get("ADGEN_SEGMENTATION_MODEL", "u2net")
+SEGMENTATION_INTRA_OP_THREADS = int(os.environ.get("ADGEN_SEGMENTATION_INTRA_OP_THREADS", "0"))
+SEGMENTATION_INTER_OP_THREADS = int(os.environ.get("ADGEN_SEGMENTATION_INTER_OP_THREADS", "1"))
+SEGMENTATION_MAX_CONCURRENCY = int(os.environ.get("ADGEN_SEGMENTATION_MAX_CONCURRENCY", "1"))
+
+# rembg imports pymatting, which loads numba-parallel code at import time.
+# Segmentation is first imported off the main thread (by the warm-up or a
+# job worker), and numba's TBB threading layer then hangs interpreter
+# shutdown, so prefer OpenMP. Set here, before anything imports rembg.
+os.environ.setdefault("NUMBA_THREADING_LAYER_PRIORITY", "omp tbb workqueue")
+
+# Inpainting canvas: long side in pixels (rounded down to a multiple of 8),
+# whether it keeps the cut-out's aspect ratio instead of being square, and
+# optional mask dilation/feathering in pixels.
+COMPOSITE_MAX_SIDE = int(os.environ.get("ADGEN_COMPOSITE_MAX_SIDE", "512"))
+COMPOSITE_KEEP_ASPECT = os.environ.get("ADGEN_COMPOSITE_KEEP_ASPECT", "0") == "1"
+MASK_DILATE_PX = int(os.environ.get("ADGEN_MASK_DILATE_PX", "0"))
+MASK_FEATHER_PX = int(os.environ.get("ADGEN_MASK_FEATHER_PX", "0"))
+# Canvas buffers kept for reuse between calls, least recently used shape
+# dropped first once they add up to more than this.
+COMPOSITE_SCRATCH_MB = float(os.environ.get("ADGEN_COMPOSITE_SCRATCH_MB", "64"))
+
+# High-resolution output: with OUTPUT_SIZE set, the generated scene is
+# upscaled to that long side (in UPSCALE_TILE_PX tiles, so memory stays
+# bounded) and the full-resolution product cut-out is composited back on
+# top. 0 returns images at the canvas size. Requests may ask for up to
+# MAX_OUTPUT_SIZE.
+OUTPUT_SIZE = int(os.environ.get("ADGEN_OUTPUT_SIZE", "0"))
+MAX_OUTPUT_SIZE = int(os.environ.get("ADGEN_MAX_OUTPUT_SIZE", "2048"))
+UPSCALE_TILE_PX = int(os.environ.get("ADGEN_UPSCALE_TILE_PX", "512"))
+
+# Image format and quality for binary (raw / multipart) result responses.
+# The JSON base64 response stays PNG unless a format is requested.
+RESULT_IMAGE_FORMAT = os.environ.get("ADGEN_RESULT_IMAGE_FORMAT", "webp").lower()
+RESULT_IMAGE_QUALITY = int(os.environ.get("ADGEN_RESULT_IMAGE_QUALITY", "90"))
+
+# Model warm-up when the API server starts: "background" (serve right away and
+# load models on a background thread), "eager" (load before accepting
+# requests) or "off" (load on first use). ADGEN_WARMUP_MODELS picks which of
+# caption, segmentation, ad_copy and inpainting to load;
+# ADGEN_WARMUP_FORWARD=0 skips the dummy forward pass after each load.
+WARMUP_MODE = os.environ.get("ADGEN_WARMUP", "background").lower()
+WARMUP_MODELS = [
+    name.strip() for name in os.environ.get("ADGEN_WARMUP_MODELS", "caption,segmentation,ad_copy,inpainting").split(",")
+    if name.strip()
+]
+WARMUP_FORWARD = os.environ.get("ADGEN_WARMUP_FORWARD", "1") != "0"
+
+# Worker processes for the model stages (off when empty): semicolon-separated
+# workers, each the comma-separated models it hosts (caption, segmentation,
+# ad_copy, inpainting), optionally "@" and the CPU cores to pin it to, e.g.
+# "inpainting@0-15;caption,ad_copy@16-23;caption,ad_copy@24-31". Workers
+# without cores split the unclaimed cores. Stages whose model no worker hosts
+# run in the API process. Each worker runs up to ADGEN_WORKER_THREADS tasks
+# at once, so micro-batches can still fill.
+WORKER_PROCESSES = os.environ.get("ADGEN_WORKER_PROCESSES", "")
+WORKER_THREADS = int(os.environ.get("ADGEN_WORKER_THREADS", "4"))
+
+# How long a caller waits for a worker to stop a task after cancelling it
+# (or after its deadline passed) before giving up on the task.
+WORKER_CANCEL_GRACE_SECONDS = float(os.environ.get("ADGEN_WORKER_CANCEL_GRACE_SECONDS", "30"))
+
+# Upload ingestion: the largest request body accepted (counted while it
+# streams in), the largest image in pixels (decompression-bomb guard) and the
+# long side uploads are downscaled to when decoded (0 keeps full resolution).
+# BLIP works at 384 px and the inpainting canvas at 512 px, so decoding a
+# 40-megapixel photo at full size only costs time and memory.
+MAX_UPLOAD_MB = float(os.environ.get("ADGEN_MAX_UPLOAD_MB", "25"))
+MAX_IMAGE_PIXELS = int(os.environ.get("ADGEN_MAX_IMAGE_PIXELS", "120000000"))
+WORKING_MAX_SIDE = int(os.environ.get("ADGEN_WORKING_MAX_SIDE", "1024"))
+
+# Model weights: checkpoints are read from ADGEN_MODEL_DIR when it holds them
+# (one folder per model id, e.g. "$ADGEN_MODEL_DIR/google/gemma-2b-it"), and
+# ADGEN_OFFLINE=1 forbids any Hugging Face Hub calls (models then come from
+# the model dir or the local HF cache). With ADGEN_MMAP_WEIGHTS, weights
+# that are used exactly as stored but were copied by their loader are
+# swapped for views memory-mapped from their safetensors files, so worker
+# processes on one host share them through the page cache.
+MODEL_DIR = os.environ.get("ADGEN_MODEL_DIR", "")
+OFFLINE = os.environ.get("ADGEN_OFFLINE", "0") == "1"
+MMAP_WEIGHTS = os.environ.get("ADGEN_MMAP_WEIGHTS", "1") != "0"
+
+if OFFLINE:
+    # For libraries that check these themselves when they are imported, so
+    # this must run before any Hugging Face import; the loaders also pass
+    # local_files_only
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
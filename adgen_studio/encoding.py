@@ -0,0 +1,133 @@
+import io
+import uuid
+from typing import Optional
+
+from PIL import Image
+
+from .metrics import span
+
+# --- Image Formats ---
+# format name -> (Pillow format, MIME type)
+IMAGE_FORMATS = {
+    "png": ("PNG", "image/png"),
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+}
+FORMAT_ALIASES = {"jpg": "jpeg"}
+MIME_TO_FORMAT = {mime: name for name, (_, mime) in IMAGE_FORMATS.items()}
+
+# How a result can be returned
+RESPONSE_KINDS = ("json", "multipart", "raw")
+
+
+def resolve_format(name: str) -> str:
+    name = FORMAT_ALIASES.get(name.lower(), name.lower())
+    if name not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown image format '{name}'; expected one of {sorted(IMAGE_FORMATS)}.")
+    return name
+
+
+def encode_image(
+    image: Image.Image,
+    image_format: str = "png",
+    quality: Optional[int] = None,
+    compression: Optional[int] = None,
+) -> bytes:
+    """
+    Encodes a PIL image.
+
+    Args:
+        image: The image to encode.
+        image_format: "png", "webp" or "jpeg".
+        quality: 1-100 for WebP and JPEG (Pillow's default when None).
+        compression: PNG zlib level 0-9, or WebP effort 0-6 (`method`).
+            Lower is faster and larger.
+    """
+    image_format = resolve_format(image_format)
+    pil_format, _ = IMAGE_FORMATS[image_format]
+    options = {}
+    if image_format == "png":
+        if compression is not None:
+            options["compress_level"] = compression
+    else:
+        if quality is not None:
+            options["quality"] = quality
+        if image_format == "webp" and compression is not None:
+            options["method"] = compression
+        if image_format == "jpeg" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+    buffer = io.BytesIO()
+    with span(f"{image_format}_encode"):
+        image.save(buffer, format=pil_format, **options)
+    return buffer.getvalue()
+
+
+def make_thumbnail(image: Image.Image, max_side: int) -> Image.Image:
+    """A copy of `image` scaled down so its long side is at most `max_side`."""
+    thumbnail = image.copy()
+    thumbnail.thumbnail((max_side, max_side))
+    return thumbnail
+
+
+# --- Content Negotiation ---
+def _parse_media_range(media_range: str) -> tuple[str, float]:
+    """Splits one Accept media range into its MIME type and quality value (q, default 1)."""
+    mime, *params = media_range.split(";")
+    quality = 1.0
+    for param in params:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                quality = min(max(float(value), 0.0), 1.0)
+            except ValueError:
+                quality = 0.0  # A malformed q can't be trusted, so the range is skipped
+    return mime.strip().lower(), quality
+
+
+def negotiate(accept: Optional[str], default_format: str) -> tuple[str, str]:
+    """
+    Picks the response kind and image format from an Accept header.
+
+    Media ranges are tried by quality value (`q`, highest first; equal ones in
+    the order given, and `q=0` means "not acceptable"):
+    `application/json` -> JSON with base64 images, `multipart/*` -> multipart,
+    `image/png|webp|jpeg` -> that raw image, `image/*` -> raw `default_format`.
+    No match (or `*/*`) keeps the JSON response.
+
+    Returns:
+        A (response kind, image format or "") tuple.
+    """
+    media_ranges = [_parse_media_range(media_range) for media_range in (accept or "").split(",")]
+    # sorted() is stable, so ranges with the same q keep the client's order
+    for mime, quality in sorted(media_ranges, key=lambda media_range: -media_range[1]):
+        if quality <= 0:
+            break
+        if mime == "application/json":
+            return "json", ""
+        if mime.startswith("multipart/"):
+            return "multipart", ""
+        if mime in MIME_TO_FORMAT:
+            return "raw", MIME_TO_FORMAT[mime]
+        if mime == "image/*":
+            return "raw", default_format
+    return "json", ""
+
+
+def build_multipart(parts: list[tuple[dict, bytes]]) -> tuple[bytes, str]:
+    """
+    Builds a `multipart/mixed` body from (headers, body) parts.
+
+    Returns:
+        The body and the Content-Type header value (with its boundary).
+    """
+    boundary = uuid.uuid4().hex
+    chunks = []
+    for headers, body in parts:
+        chunks.append(f"--{boundary}\r\n".encode("ascii"))
+        for name, value in headers.items():
+            chunks.append(f"{name}: {value}\r\n".encode("utf-8"))
+        chunks.append(b"\r\n")
+        chunks.append(body)
+        chunks.append(b"\r\n")
+    chunks.append(f"--{boundary}--\r\n".encode("ascii"))
+    return b"".join(chunks), f"multipart/mixed; boundary={boundary}"
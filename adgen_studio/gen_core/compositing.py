@@ -0,0 +1,325 @@
+import math
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from adgen_studio.config import (
+    COMPOSITE_MAX_SIDE, COMPOSITE_KEEP_ASPECT, COMPOSITE_SCRATCH_MB, MASK_DILATE_PX, MASK_FEATHER_PX,
+    UPSCALE_TILE_PX,
+)
+from adgen_studio.metrics import traced
+
+# Stable Diffusion's VAE downsamples by 8, so both sides must be multiples of 8
+SIZE_MULTIPLE = 8
+# Alpha above this is "product" (kept); at or below it is repainted
+ALPHA_THRESHOLD = 128
+
+# --- Scratch Buffers ---
+class ScratchPool:
+    """
+    Reusable NumPy buffers, so batch canvases aren't allocated (and page
+    faulted in) on every call.
+
+    A buffer is checked out with `take` and handed back with `give`, so
+    concurrent calls never share one. Free buffers are kept per
+    (shape, dtype) in least recently used order; once they add up to more
+    than `max_bytes`, the least recently used are dropped, so a stream of
+    new canvas sizes can't grow the pool without bound.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._free: "OrderedDict[tuple, list[np.ndarray]]" = OrderedDict()
+        self._free_bytes = 0
+        self._lock = threading.Lock()
+
+    def take(self, shape: tuple, dtype) -> np.ndarray:
+        """A buffer of this shape and dtype, with undefined contents."""
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            buffers = self._free.get(key)
+            if buffers:
+                buffer = buffers.pop()
+                self._free_bytes -= buffer.nbytes
+                if not buffers:
+                    del self._free[key]
+                return buffer
+        return np.empty(shape, dtype=dtype)
+
+    def give(self, buffer: np.ndarray) -> None:
+        """Returns a buffer from `take` for reuse; the caller must not touch it afterwards."""
+        if buffer.nbytes > self.max_bytes:
+            return
+        key = (buffer.shape, buffer.dtype.str)
+        with self._lock:
+            self._free.setdefault(key, []).append(buffer)
+            self._free.move_to_end(key)
+            self._free_bytes += buffer.nbytes
+            while self._free_bytes > self.max_bytes:
+                _, buffers = self._free.popitem(last=False)
+                self._free_bytes -= sum(evicted.nbytes for evicted in buffers)
+
+SCRATCH = ScratchPool(int(COMPOSITE_SCRATCH_MB * 1024 * 1024))
+
+# --- Sizes ---
+def target_size(
+    width: int, height: int,
+    max_side: int = COMPOSITE_MAX_SIDE, keep_aspect: bool = COMPOSITE_KEEP_ASPECT,
+) -> tuple[int, int]:
+    """
+    The canvas size for a cut-out of `width` x `height`.
+
+    A square `max_side` canvas by default; with `keep_aspect`, the canvas has
+    the cut-out's aspect ratio with its long side at `max_side`. Both sides
+    are rounded down to multiples of 8.
+    """
+    if not keep_aspect:
+        side = max(SIZE_MULTIPLE, max_side - max_side % SIZE_MULTIPLE)
+        return side, side
+    scale = max_side / max(width, height)
+    return tuple(
+        max(SIZE_MULTIPLE, int(round(side * scale)) // SIZE_MULTIPLE * SIZE_MULTIPLE)
+        for side in (width, height)
+    )
+
+# Output pixels resampled around the product's bounding box, beyond the
+# bicubic filter's reach, so cropping doesn't change the product's pixels
+FIT_MARGIN = 8
+
+def _fit(image: Image.Image, size: tuple[int, int]) -> tuple[Optional[Image.Image], tuple[int, int]]:
+    """
+    Resizes `image` to fit inside `size` keeping its aspect ratio, centred the
+    way `ImageOps.pad` does it.
+
+    Cut-outs are mostly transparent, so only the region around the product
+    (its alpha bounding box) is resampled. Returns that region and its
+    offset on the canvas, or (None, (0, 0)) for a fully transparent image.
+    """
+    width, height = size
+    if image.width / image.height > width / height:
+        fitted = (width, max(1, round(image.height / image.width * width)))
+    else:
+        fitted = (max(1, round(image.width / image.height * height)), height)
+    offset = (round((width - fitted[0]) / 2), round((height - fitted[1]) / 2))
+
+    bbox = image.getchannel("A").getbbox()
+    if bbox is None:
+        return None, (0, 0)
+    scale_x, scale_y = image.width / fitted[0], image.height / fitted[1]
+    left = max(0, int(bbox[0] / scale_x) - FIT_MARGIN)
+    top = max(0, int(bbox[1] / scale_y) - FIT_MARGIN)
+    right = min(fitted[0], math.ceil(bbox[2] / scale_x) + FIT_MARGIN)
+    bottom = min(fitted[1], math.ceil(bbox[3] / scale_y) + FIT_MARGIN)
+    if (left, top, right, bottom) == (0, 0) + fitted:
+        region = image if fitted == image.size else image.resize(fitted, resample=Image.Resampling.BICUBIC)
+    else:
+        region = image.resize(
+            (right - left, bottom - top), resample=Image.Resampling.BICUBIC,
+            box=(left * scale_x, top * scale_y, right * scale_x, bottom * scale_y),
+        )
+    return region, (offset[0] + left, offset[1] + top)
+
+
+# --- Mask Post-Processing ---
+def dilate_mask(mask: np.ndarray, radius: int) -> np.ndarray:
+    """Grows the white (repaint) region of a uint8 mask by `radius` pixels, in place."""
+    for axis in (0, 1):
+        source = mask.copy()
+        for shift in range(1, radius + 1):
+            ahead = [slice(None)] * 2
+            behind = [slice(None)] * 2
+            ahead[axis], behind[axis] = slice(shift, None), slice(None, -shift)
+            np.maximum(mask[tuple(ahead)], source[tuple(behind)], out=mask[tuple(ahead)])
+            np.maximum(mask[tuple(behind)], source[tuple(ahead)], out=mask[tuple(behind)])
+    return mask
+
+def feather_mask(mask: np.ndarray, radius: int) -> np.ndarray:
+    """Softens the edges of a uint8 mask with a separable box blur of `radius` pixels, in place."""
+    size = 2 * radius + 1
+    blurred = mask.astype(np.float32)
+    for axis in (0, 1):
+        padded = np.pad(blurred, [(radius + 1, radius) if a == axis else (0, 0) for a in (0, 1)], mode="edge")
+        summed = np.cumsum(padded, axis=axis)
+        upper = [slice(None)] * 2
+        lower = [slice(None)] * 2
+        upper[axis], lower[axis] = slice(size, None), slice(None, -size)
+        blurred = (summed[tuple(upper)] - summed[tuple(lower)]) / size
+    np.rint(blurred, out=blurred)
+    mask[...] = blurred
+    return mask
+
+
+# --- Compositing ---
+def _composite_into(
+    rgba: np.ndarray, base: np.ndarray, mask: np.ndarray, offset: tuple[int, int],
+) -> None:
+    """
+    Writes the cut-out composited over white into `base` and its inpainting
+    mask into `mask`, in one pass over the cut-out's pixels.
+
+    `base` must already be white and `mask` all 255 (repaint everywhere).
+    """
+    h, w = rgba.shape[:2]
+    x, y = offset
+    rgb, alpha = rgba[..., :3], rgba[..., 3:]
+    base_region, mask_region = base[y:y + h, x:x + w], mask[y:y + h, x:x + w]
+
+    # Opaque pixels are copied as-is and transparent ones stay white; only
+    # the soft edge (0 < a < 255) needs the blend
+    np.copyto(base_region, rgb, where=alpha == 255)
+    edge_y, edge_x = np.nonzero((alpha[..., 0] > 0) & (alpha[..., 0] < 255))
+    if len(edge_y):
+        # base = (rgb * a + 255 * (255 - a)) / 255, rounded
+        edge_rgb = rgb[edge_y, edge_x].astype(np.uint16)
+        edge_alpha = alpha[edge_y, edge_x].astype(np.uint16)
+        blended = (edge_rgb * edge_alpha + 255 * (255 - edge_alpha) + 127) // 255
+        base_region[edge_y, edge_x] = blended
+
+    # mask = 0 where the product is, 255 where the scene is painted
+    np.multiply(alpha[..., 0] <= ALPHA_THRESHOLD, 255, out=mask_region, casting="unsafe")
+
+def composite_batch(
+    segmented_images: list[Image.Image],
+    max_side: int = COMPOSITE_MAX_SIDE,
+    keep_aspect: bool = COMPOSITE_KEEP_ASPECT,
+    dilate_px: int = MASK_DILATE_PX,
+    feather_px: int = MASK_FEATHER_PX,
+    size: Optional[tuple[int, int]] = None,
+) -> list[tuple[Image.Image, Image.Image]]:
+    """
+    Builds the inpainting inputs for several cut-outs at once.
+
+    Each cut-out is fitted (aspect preserved, centred) onto its canvas,
+    composited over white and thresholded into a mask, touching only the
+    pixels around the product. Cut-outs that share a canvas size are
+    written into one (N, H, W) base/mask array pair per size. The bases come
+    from the `SCRATCH` pool; the masks can't, since `Image.fromarray` keeps
+    a view of an L array instead of copying it.
+
+    Args:
+        segmented_images: RGBA cut-outs from background removal.
+        max_side: Long side of the canvas (see `target_size`).
+        keep_aspect: Use the cut-out's aspect ratio instead of a square canvas.
+        dilate_px: Grow the repaint region into the product edge, so the
+            halo left by background removal is painted over.
+        feather_px: Soften the mask edge. The SD pipeline binarizes masks,
+            so this only matters where the mask is used for compositing.
+        size: An explicit (width, height) canvas, overriding the above.
+
+    Returns:
+        A list of (RGB base image, L mask image) pairs, in input order. In the
+        mask, 255 marks the background to repaint and 0 the product to keep.
+    """
+    rgbas = [image if image.mode == "RGBA" else image.convert("RGBA") for image in segmented_images]
+    sizes = [size or target_size(image.width, image.height, max_side, keep_aspect) for image in rgbas]
+
+    results: list = [None] * len(rgbas)
+    for canvas in dict.fromkeys(sizes):
+        indices = [i for i, s in enumerate(sizes) if s == canvas]
+        width, height = canvas
+        bases = SCRATCH.take((len(indices), height, width, 3), np.uint8)
+        bases.fill(255)
+        masks = np.full((len(indices), height, width), 255, dtype=np.uint8)
+        try:
+            for slot, index in enumerate(indices):
+                region, offset = _fit(rgbas[index], canvas)
+                if region is not None:
+                    _composite_into(np.asarray(region), bases[slot], masks[slot], offset)
+                if dilate_px:
+                    dilate_mask(masks[slot], dilate_px)
+                if feather_px:
+                    feather_mask(masks[slot], feather_px)
+                # An RGB image is copied out of the array, so the base buffer can go back to the pool
+                results[index] = (Image.fromarray(bases[slot]), Image.fromarray(masks[slot]))
+        finally:
+            SCRATCH.give(bases)
+    return results
+
+def composite(segmented_image: Image.Image, **kwargs) -> tuple[Image.Image, Image.Image]:
+    """Single-image form of `composite_batch`; returns (base image, mask image)."""
+    return composite_batch([segmented_image], **kwargs)[0]
+
+
+# --- High-Resolution Output ---
+def upscale_tiled(image: Image.Image, size: tuple[int, int], tile: int = UPSCALE_TILE_PX) -> np.ndarray:
+    """
+    Resizes `image` to `size` (Lanczos) one output tile at a time.
+
+    Each tile is resampled from its own box of the source, which includes
+    the filter's reach past the box edges, so the tiles join seamlessly while
+    only one tile of temporaries exists at a time.
+
+    Returns:
+        The (H, W, 3) uint8 result.
+    """
+    image = image if image.mode == "RGB" else image.convert("RGB")
+    width, height = size
+    scale_x, scale_y = image.width / width, image.height / height
+    output = np.empty((height, width, 3), dtype=np.uint8)
+    for top in range(0, height, tile):
+        bottom = min(height, top + tile)
+        for left in range(0, width, tile):
+            right = min(width, left + tile)
+            piece = image.resize(
+                (right - left, bottom - top), resample=Image.Resampling.LANCZOS,
+                box=(left * scale_x, top * scale_y, right * scale_x, bottom * scale_y),
+            )
+            output[top:bottom, left:right] = np.asarray(piece)
+    return output
+
+@traced("upscale")
+def upscale_with_product(
+    generated: Image.Image,
+    segmented_image: Image.Image,
+    output_side: int,
+    dilate_px: int = MASK_DILATE_PX,
+    feather_px: int = MASK_FEATHER_PX,
+    tile: int = UPSCALE_TILE_PX,
+) -> Image.Image:
+    """
+    Brings a generated scene up to `output_side` without re-running diffusion.
+
+    The scene is upscaled tile by tile, then the cut-out is fitted onto the
+    larger canvas exactly where `composite_batch` placed it and
+    alpha-composited on top, so the product keeps the full resolution of
+    the cut-out instead of being a blown-up 512 px copy.
+
+    Args:
+        generated: The inpainted image, at canvas size.
+        segmented_image: The RGBA cut-out the canvas was built from.
+        output_side: Long side of the result. Images already that large are
+            returned unchanged.
+        dilate_px: The canvas-scale mask dilation used for inpainting; the
+            product's alpha shrinks by the same (scaled) amount, so the edge
+            the scene painted over stays painted.
+        feather_px: Canvas-scale feathering of the product edge (scaled).
+        tile: Side of the upscaling tiles.
+    """
+    scale = output_side / max(generated.size)
+    if scale <= 1:
+        return generated
+    size = (max(1, round(generated.width * scale)), max(1, round(generated.height * scale)))
+    output = upscale_tiled(generated, size, tile)
+
+    rgba = segmented_image if segmented_image.mode == "RGBA" else segmented_image.convert("RGBA")
+    region, (x, y) = _fit(rgba, size)
+    if region is not None:
+        pixels = np.asarray(region)
+        alpha = pixels[..., 3].copy()
+        if dilate_px:
+            # Shrink the product by growing its complement
+            np.subtract(255, alpha, out=alpha)
+            dilate_mask(alpha, round(dilate_px * scale))
+            np.subtract(255, alpha, out=alpha)
+        if feather_px:
+            feather_mask(alpha, round(feather_px * scale))
+        h, w = alpha.shape
+        target = output[y:y + h, x:x + w]
+        # target = (product * a + scene * (255 - a)) / 255, rounded
+        weight = alpha[..., None].astype(np.uint16)
+        blended = pixels[..., :3] * weight + target * (255 - weight) + 127
+        target[...] = blended // 255
+    return Image.fromarray(output)
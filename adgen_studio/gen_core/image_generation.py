@@ -1,59 +1,253 @@
+import inspect
+import time
+# Imported before diffusers: config sets the Hugging Face offline flags (see config.py)
+from adgen_studio.config import GB, DIFFUSION_MAX_BATCH, INPAINTING_PRECISION, DEFAULT_SPEED_PROFILE
 import torch
-from diffusers import AutoPipelineForInpainting
-from PIL import Image, ImageOps
-import numpy as np
-import gc # <-- ADD THIS
+from diffusers import AutoPipelineForInpainting, DPMSolverMultistepScheduler
+from PIL import Image
+from typing import Callable, Optional
 
-# --- Model Loading (Lazy) ---
-PIPE = None
+from adgen_studio.model_registry import REGISTRY
+from adgen_studio.metrics import traced
+from adgen_studio.cancellation import CancelToken, OperationCancelled, check, release_memory
+from .prompt_embeddings import PROMPT_EMBEDDINGS
+from .compositing import composite
+from .speed_profiles import get_speed_profile
+from adgen_studio.precision import apply_precision, check_precision, load_dtype, scaled_size_hint
+from adgen_studio.weights import model_source, pretrained_kwargs, share_weights
+
+# --- Model Loading (Shared Registry) ---
+INPAINTING_MODEL_ID = "runwayml/stable-diffusion-inpainting"
+INPAINTING_PRECISION = check_precision(INPAINTING_PRECISION)
+INPAINTING_MODEL_SIZE_HINT = scaled_size_hint(int(4.3 * GB), INPAINTING_PRECISION)  # UNet + VAE + CLIP text encoder in fp32
+
+def _load_sd_inpainting():
+    print("Loading BETTER QUALITY Stable Diffusion 1.5 Inpainting model...")
+    return AutoPipelineForInpainting.from_pretrained(
+        model_source(INPAINTING_MODEL_ID),
+        torch_dtype=load_dtype(INPAINTING_PRECISION),
+        **pretrained_kwargs(INPAINTING_MODEL_ID),
+    ).to("cpu")
+
+NEGATIVE_PROMPT = "low quality, blurry, deformed, disfigured, poor, repetitive, bad, ugly, lowres"
+
+def encode_text(pipe, text: str) -> torch.Tensor:
+    """Runs one prompt through the CLIP text encoder."""
+    with torch.inference_mode():
+        embeds, _ = pipe.encode_prompt(text, pipe.device, num_images_per_prompt=1, do_classifier_free_guidance=False)
+    return embeds
+
+def _load_sd_inpainting_at_precision():
+    start = time.perf_counter()
+    pipe = _load_sd_inpainting()
+    share_weights(
+        INPAINTING_MODEL_ID, {"unet": pipe.unet, "text_encoder": pipe.text_encoder, "vae": pipe.vae},
+        time.perf_counter() - start,
+    )
+    # int8 covers the UNet and text encoder; the conv-heavy VAE stays fp32
+    apply_precision(
+        [pipe.unet, pipe.text_encoder, pipe.vae], INPAINTING_PRECISION,
+        quantize=[pipe.unet, pipe.text_encoder],
+    )
+    # The negative prompt never changes, so it is encoded once per load
+    PROMPT_EMBEDDINGS.pin(INPAINTING_MODEL_ID, NEGATIVE_PROMPT, encode_text(pipe, NEGATIVE_PROMPT))
+    return pipe
 
 def load_inpainting_model():
-    """Loads the Stable Diffusion 1.5 model into memory."""
-    global PIPE
-    if PIPE is None:
-        try:
-            print("LAZY LOADING: Loading BETTER QUALITY Stable Diffusion 1.5 Inpainting model...")
-            PIPE = AutoPipelineForInpainting.from_pretrained(
-                "runwayml/stable-diffusion-inpainting",
-                torch_dtype=torch.float32
-            ).to("cpu")
-            print("Stable Diffusion 1.5 model loaded successfully.")
-        except Exception as e:
-            print(f"Error loading Stable Diffusion model: {e}")
-            raise
-
-# --- (create_mask_and_image function stays the same) ---
-def create_mask_and_image(segmented_image: Image.Image, size=(512, 512)) -> tuple:
-    if segmented_image.mode != "RGBA":
-        segmented_image = segmented_image.convert("RGBA")
-    resized_image = ImageOps.pad(segmented_image, size, color=(0, 0, 0, 0))
-    mask = resized_image.getchannel("A")
-    mask = Image.fromarray(np.uint8(np.array(mask) > 128) * 255, 'L')
-    base_image = Image.new("RGB", size, (255, 255, 255))
-    base_image.paste(resized_image, (0, 0), resized_image)
-    inverted_mask = ImageOps.invert(mask)
-    return base_image, inverted_mask
-
-# --- (generate_new_image function stays the same) ---
-def generate_new_image(base_image: Image.Image, mask_image: Image.Image, prompt: str) -> Image.Image:
-    load_inpainting_model()
-    if PIPE is None:
-        raise RuntimeError("Stable Diffusion model is not loaded.")
-    print(f"Generating image for prompt: '{prompt}'")
-    negative_prompt = "low quality, blurry, deformed, disfigured, poor, repetitive, bad, ugly, lowres"
-    generated_image = PIPE(
-        prompt=prompt, image=base_image, mask_image=mask_image,
-        negative_prompt=negative_prompt, num_inference_steps=25,
-        strength=1.0, guidance_scale=7.5,
-    ).images[0]
-    return generated_image
-
-# --- ADD THIS NEW FUNCTION ---
+    """Returns the Stable Diffusion 1.5 pipeline, loading it into the registry on a miss."""
+    try:
+        return REGISTRY.get(INPAINTING_MODEL_ID, _load_sd_inpainting_at_precision, INPAINTING_MODEL_SIZE_HINT)
+    except Exception as e:
+        print(f"Error loading Stable Diffusion model: {e}")
+        raise
+
+# --- Schedulers ---
+# The speed profiles (gen_core/speed_profiles.py) pick one of these by name
+def _dpm_solver(config):
+    return DPMSolverMultistepScheduler.from_config(config, algorithm_type="dpmsolver++", use_karras_sigmas=True)
+
+SCHEDULERS = {
+    "default": lambda config: None,  # The checkpoint's own scheduler
+    "dpmsolver++": _dpm_solver,
+}
+
+def request_pipeline(pipe, scheduler: str = "default"):
+    """
+    Returns a per-call view of the shared pipeline. It shares the weights, but
+    has its own scheduler (`scheduler` names one of SCHEDULERS) and call
+    state, so concurrent requests can't corrupt each other's denoising loop.
+    """
+    components = dict(pipe.components)
+    components["scheduler"] = (
+        SCHEDULERS[scheduler](pipe.scheduler.config)
+        or pipe.scheduler.from_config(pipe.scheduler.config)
+    )
+    if "requires_safety_checker" in inspect.signature(type(pipe).__init__).parameters:
+        components["requires_safety_checker"] = pipe.config.get("requires_safety_checker", False)
+    view = type(pipe)(**components)
+    view.set_progress_bar_config(**getattr(pipe, "_progress_bar_config", {}))
+    return view
+
+@traced("create_mask_and_image")
+def create_mask_and_image(segmented_image: Image.Image, size: Optional[tuple[int, int]] = None) -> tuple:
+    """
+    Builds the inpainting inputs for a cut-out: the product composited over
+    white, and a mask that is white where the new scene is painted.
+
+    The canvas is `size` if given, otherwise it follows the compositing
+    settings (512 px square by default). See `compositing.composite_batch`.
+    """
+    return composite(segmented_image, size=size)
+
+
+def resolve_seeds(num_variants: int, seeds: Optional[list[int]] = None) -> list[int]:
+    """Pads the caller's seeds with random ones so there is one seed per variant."""
+    seeds = list(seeds or [])[:num_variants]
+    while len(seeds) < num_variants:
+        seeds.append(int(torch.randint(0, 2 ** 31 - 1, (1,)).item()))
+    return seeds
+
+def encode_masked_image(pipe, base_image: Image.Image, mask_image: Image.Image) -> torch.Tensor:
+    """
+    VAE-encodes the masked product image once per request.
+
+    Uses the mode of the latent distribution, so the latents are deterministic
+    and each variant depends only on its own seed, whatever batch it lands in.
+    """
+    width, height = base_image.size
+    init_image = pipe.image_processor.preprocess(base_image, height=height, width=width)
+    mask_condition = pipe.mask_processor.preprocess(mask_image, height=height, width=width)
+    masked_image = init_image * (mask_condition < 0.5)
+    masked_image = masked_image.to(device=pipe.device, dtype=pipe.vae.dtype)
+    latents = pipe.vae.encode(masked_image).latent_dist.mode()
+    return latents * pipe.vae.config.scaling_factor
+
+@traced("generate_new_images")
+def generate_new_images(
+    base_image: Image.Image,
+    mask_image: Image.Image,
+    prompt: str,
+    num_variants: int = 1,
+    seeds: Optional[list[int]] = None,
+    on_step: Optional[Callable[[int, int], None]] = None,
+    profile: Optional[str] = None,
+    cancel_token: Optional[CancelToken] = None,
+) -> tuple[list[Image.Image], list[int]]:
+    """
+    Inpaints `num_variants` scene variants around the product.
+
+    The prompt and the masked product image are encoded once and the variants
+    are denoised together through `num_images_per_prompt`, in chunks of at
+    most DIFFUSION_MAX_BATCH images.
+    Each variant has its own seed, so any single variant can be reproduced,
+    and a "preview" draft can be re-rendered at "final" quality from its seed.
+
+    `profile` names one of SPEED_PROFILES (scheduler, steps and guidance).
+
+    `on_step(step, total)` is called after every denoising step across all
+    chunks, so callers can report diffusion progress.
+
+    `cancel_token` is checked after every denoising step: once it fires, the
+    denoising loop stops and OperationCancelled is raised, with the
+    request's latents already freed.
+
+    Returns:
+        A tuple of (generated images, the seed used for each image).
+    """
+    check(cancel_token)
+    settings = get_speed_profile(profile)
+    pipe = request_pipeline(load_inpainting_model(), settings["scheduler"])
+    seeds = resolve_seeds(num_variants, seeds)
+    print(f"Generating {num_variants} image(s) for prompt: '{prompt}' (seeds {seeds}, profile {profile or DEFAULT_SPEED_PROFILE})")
+
+    # Prompt embeddings come from the shared cache; the masked image is
+    # encoded once and reused for every chunk
+    encode = lambda text: encode_text(pipe, text)
+    prompt_embeds = PROMPT_EMBEDDINGS.get(INPAINTING_MODEL_ID, prompt, encode)
+    negative_prompt_embeds = None
+    if settings["guidance_scale"] > 1.0:
+        negative_prompt_embeds = PROMPT_EMBEDDINGS.get(INPAINTING_MODEL_ID, NEGATIVE_PROMPT, encode)
+    with torch.inference_mode():
+        masked_image_latents = encode_masked_image(pipe, base_image, mask_image)
+
+    chunks = [seeds[i:i + DIFFUSION_MAX_BATCH] for i in range(0, len(seeds), DIFFUSION_MAX_BATCH)]
+    images = []
+    try:
+        for chunk_index, chunk_seeds in enumerate(chunks):
+
+            def step_end(pipeline, step, timestep, callback_kwargs, chunk_index=chunk_index):
+                if on_step is not None:
+                    # Some schedulers take one more step than requested, so ask the pipeline
+                    steps_per_chunk = pipeline.num_timesteps
+                    on_step(chunk_index * steps_per_chunk + step + 1, steps_per_chunk * len(chunks))
+                # Raising here leaves the denoising loop before the next UNet call
+                check(cancel_token)
+                return callback_kwargs
+
+            output = pipe(
+                prompt_embeds=prompt_embeds, negative_prompt_embeds=negative_prompt_embeds,
+                image=base_image, mask_image=mask_image, masked_image_latents=masked_image_latents,
+                height=base_image.height, width=base_image.width,
+                num_images_per_prompt=len(chunk_seeds),
+                generator=[torch.Generator("cpu").manual_seed(seed) for seed in chunk_seeds],
+                num_inference_steps=settings["num_inference_steps"], strength=1.0,
+                guidance_scale=settings["guidance_scale"],
+                callback_on_step_end=step_end if on_step or cancel_token else None,
+            )
+            images.extend(output.images)
+    except OperationCancelled as e:
+        error = type(e), str(e)
+    else:
+        return images, seeds
+
+    # Raised outside the handler, so no traceback keeps the aborted loop's latents alive
+    print(f"Inpainting stopped: {error[1]}")
+    del pipe, images, masked_image_latents
+    release_memory()
+    raise error[0](error[1])
+
+def generate_new_image(
+    base_image: Image.Image,
+    mask_image: Image.Image,
+    prompt: str,
+    on_step: Optional[Callable[[int, int], None]] = None,
+    seed: Optional[int] = None,
+    profile: Optional[str] = None,
+    cancel_token: Optional[CancelToken] = None,
+) -> Image.Image:
+    """
+    Inpaints a single new scene around the product.
+
+    `on_step(step, total)` is called after every denoising step, so callers
+    can report diffusion progress; `cancel_token` stops the loop within one step.
+    """
+    images, _ = generate_new_images(
+        base_image, mask_image, prompt, num_variants=1,
+        seeds=[seed] if seed is not None else None, on_step=on_step, profile=profile,
+        cancel_token=cancel_token,
+    )
+    return images[0]
+
+def warm_up_inpainting_model(forward: bool = True) -> None:
+    """
+    Loads the pipeline and, with `forward`, runs one denoising step on a blank
+    canvas of the default size, so the first request doesn't pay for paging
+    in weights and allocating the UNet's activation buffers.
+    """
+    pipe = load_inpainting_model()
+    if not forward:
+        return
+    base_image, mask_image = create_mask_and_image(Image.new("RGBA", (64, 64)))
+    pipe = request_pipeline(pipe, get_speed_profile()["scheduler"])
+    prompt_embeds = PROMPT_EMBEDDINGS.get(INPAINTING_MODEL_ID, NEGATIVE_PROMPT, lambda text: encode_text(pipe, text))
+    with torch.inference_mode():
+        pipe(
+            prompt_embeds=prompt_embeds, image=base_image, mask_image=mask_image,
+            height=base_image.height, width=base_image.width,
+            num_inference_steps=1, strength=1.0, guidance_scale=1.0,
+        )
+
 def del_inpainting_model():
-    """Deletes the Stable Diffusion model from memory."""
-    global PIPE
-    if PIPE is not None:
-        del PIPE
-        PIPE = None
-    gc.collect()
-    print("Unloaded Stable Diffusion model from RAM.")
\ No newline at end of file
+    """Explicitly unloads the Stable Diffusion model from the registry."""
+    if REGISTRY.evict(INPAINTING_MODEL_ID):
+        print("Unloaded Stable Diffusion model from RAM.")
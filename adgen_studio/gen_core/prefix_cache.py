@@ -0,0 +1,87 @@
+import copy
+import threading
+import time
+from typing import TYPE_CHECKING, Callable
+
+if TYPE_CHECKING:
+    import torch
+    from transformers import Cache
+
+
+class PromptPrefix:
+    """The token ids of a static prompt prefix and its prefilled KV cache."""
+
+    def __init__(self, input_ids: "torch.Tensor", past_key_values: "Cache", prefill_seconds: float = 0.0):
+        self.input_ids = input_ids
+        self.past_key_values = past_key_values
+        self.prefill_seconds = prefill_seconds
+
+    @property
+    def length(self) -> int:
+        return self.input_ids.shape[1]
+
+    def expand(self, batch_size: int) -> "Cache":
+        """A private copy of the KV cache for a batch of `batch_size` rows; `generate` extends it in place."""
+        past_key_values = copy.deepcopy(self.past_key_values)
+        if batch_size > 1:
+            past_key_values.batch_repeat_interleave(batch_size)
+        return past_key_values
+
+
+class PromptPrefixCache:
+    """
+    Prefilled KV caches of static prompt prefixes, keyed by (model id, prefix key).
+
+    Every ad-copy prompt of a template shares the same copywriter preamble,
+    so its keys and values are computed once and each request only prefills
+    its own suffix (the caption). Entries depend only on the model weights,
+    so they stay valid when the model is evicted and reloaded.
+    """
+
+    def __init__(self):
+        self._entries: dict = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, model_id: str, key: tuple, build: Callable[[], PromptPrefix]) -> PromptPrefix:
+        """Returns the prefix for `key`, calling `build()` on a miss."""
+        with self._lock:
+            if (model_id, key) in self._entries:
+                self.hits += 1
+                return self._entries[(model_id, key)]
+            self.misses += 1
+
+        # Built outside the lock; two threads missing on the same key just both build it
+        start = time.perf_counter()
+        prefix = build()
+        prefix.prefill_seconds = time.perf_counter() - start
+        with self._lock:
+            self._entries[(model_id, key)] = prefix
+        return prefix
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "items": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "prefixes": [
+                    {
+                        "key": "/".join(str(part) for part in key),
+                        "tokens": prefix.length,
+                        "prefill_seconds": round(prefix.prefill_seconds, 4),
+                    }
+                    for (_, key), prefix in self._entries.items()
+                ],
+            }
+
+
+# --- Shared Instance ---
+PROMPT_PREFIXES = PromptPrefixCache()
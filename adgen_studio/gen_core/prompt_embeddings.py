@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable
+
+if TYPE_CHECKING:
+    import torch
+
+from adgen_studio.config import PROMPT_EMBED_CACHE_ITEMS
+
+
+class PromptEmbeddingCache:
+    """
+    An LRU cache of text-encoder outputs, keyed by (model id, prompt).
+
+    Catalog runs reuse a handful of scene prompts across many products, so
+    the CLIP text encoder only needs to run once per prompt. Pinned entries
+    (the fixed negative prompt) are never evicted.
+    """
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._entries: "OrderedDict[tuple, torch.Tensor]" = OrderedDict()
+        self._pinned: dict = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, model_id: str, prompt: str, encode: Callable[[str], "torch.Tensor"]) -> "torch.Tensor":
+        """Returns the embedding of `prompt`, calling `encode(prompt)` on a miss."""
+        key = (model_id, prompt)
+        with self._lock:
+            if key in self._pinned:
+                self.hits += 1
+                return self._pinned[key]
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        # Encode outside the lock; two threads missing on the same prompt just both encode it
+        embedding = encode(prompt)
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return embedding
+
+    def pin(self, model_id: str, prompt: str, embedding: "torch.Tensor") -> None:
+        """Stores an embedding that is never evicted (e.g. the fixed negative prompt)."""
+        with self._lock:
+            self._pinned[(model_id, prompt)] = embedding
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._pinned.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "items": len(self._entries),
+                "pinned": len(self._pinned),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# --- Shared Instance ---
+PROMPT_EMBEDDINGS = PromptEmbeddingCache(max_items=PROMPT_EMBED_CACHE_ITEMS)
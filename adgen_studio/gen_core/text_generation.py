@@ -1,75 +1,483 @@
-import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
+import queue
 import re
-import gc # <-- ADD THIS
+import threading
+import time
+from typing import Callable, Iterator, Optional
 
-# --- Model Loading (Lazy) ---
-TEXT_GENERATOR = None
+from adgen_studio.model_registry import REGISTRY
+from adgen_studio.batching import MicroBatcher
+from adgen_studio.metrics import span, traced
+from adgen_studio.cancellation import CancelToken, CancelledRows, OperationCancelled, check
+from adgen_studio.result_cache import RESULT_CACHE, hash_bytes, make_key
+from adgen_studio.precision import apply_precision, check_precision, load_dtype, scaled_size_hint
+from adgen_studio.weights import model_source, pretrained_kwargs, share_weights
+from adgen_studio.config import (
+    GB, TEXT_GEN_BATCH_SIZE, TEXT_GEN_BATCH_WAIT_MS, TEXT_GEN_PRECISION, AD_COPY_VARIATIONS,
+    AD_COPY_TEMPLATE, TEXT_GEN_PREFIX_CACHE,
+)
+from .prefix_cache import PROMPT_PREFIXES, PromptPrefix
+
+# --- Model Loading (Shared Registry) ---
+TEXT_GEN_MODEL_ID = "google/gemma-2b-it"
+TEXT_GEN_PRECISION = check_precision(TEXT_GEN_PRECISION)
+TEXT_GEN_MODEL_SIZE_HINT = scaled_size_hint(int(10 * GB), TEXT_GEN_PRECISION)  # ~2.5B params in fp32
+
+def _load_gemma():
+    from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
+    source = model_source(TEXT_GEN_MODEL_ID)
+    tokenizer = AutoTokenizer.from_pretrained(source, **pretrained_kwargs(TEXT_GEN_MODEL_ID))
+    model = AutoModelForCausalLM.from_pretrained(
+        source,
+        torch_dtype=load_dtype(TEXT_GEN_PRECISION),
+        **pretrained_kwargs(TEXT_GEN_MODEL_ID),
+    ).to("cpu")
+    return pipeline(
+        "text-generation", model=model, tokenizer=tokenizer,
+    )
+
+def _load_gemma_at_precision():
+    start = time.perf_counter()
+    text_generator = _load_gemma()
+    share_weights(TEXT_GEN_MODEL_ID, {"": text_generator.model}, time.perf_counter() - start)
+    apply_precision([text_generator.model], TEXT_GEN_PRECISION, quantize=[text_generator.model])
+    if TEXT_GEN_PREFIX_CACHE:
+        # Prefill the default copywriter preamble now, not on the first request
+        get_prompt_prefix(text_generator, AD_COPY_TEMPLATE, AD_COPY_VARIATIONS)
+    return text_generator
 
 def load_text_gen_model():
-    """Loads the Gemma-2b-it model into memory."""
-    global TEXT_GENERATOR
-    if TEXT_GENERATOR is None:
+    """Returns the Gemma-2b-it text-generation pipeline, loading it into the registry on a miss."""
+    try:
+        return REGISTRY.get(TEXT_GEN_MODEL_ID, _load_gemma_at_precision, TEXT_GEN_MODEL_SIZE_HINT)
+    except Exception as e:
+        print(f"Error loading Gemma model: {e}")
+        raise
+
+# --- Prompt Templates ---
+# Copywriter instructions per tone or language. The caption comes last, so
+# everything before it is a static prefix whose KV cache is prefilled once
+# per template and variation count (see PROMPT_PREFIXES). The ads must still
+# start with "Variation:" so they can be split apart.
+AD_COPY_TEMPLATES = {
+    "default": (
+        "You are an expert e-commerce copywriter.\n"
+        "Your task is to write {num_variations} compelling, short ad variations for a product.\n"
+        "Do not use hashtags. Keep the ads between 1-3 sentences.\n"
+        "Return ONLY the {num_variations} ad variations, each starting with \"Variation:\".\n"
+        "The product is: \""
+    ),
+    "playful": (
+        "You are a witty e-commerce copywriter with a playful, upbeat voice.\n"
+        "Your task is to write {num_variations} fun, short ad variations for a product.\n"
+        "Do not use hashtags. Keep the ads between 1-3 sentences.\n"
+        "Return ONLY the {num_variations} ad variations, each starting with \"Variation:\".\n"
+        "The product is: \""
+    ),
+    "premium": (
+        "You are a copywriter for a luxury brand. Your voice is refined, calm and confident.\n"
+        "Your task is to write {num_variations} elegant, short ad variations for a product.\n"
+        "Do not use hashtags or exclamation marks. Keep the ads between 1-3 sentences.\n"
+        "Return ONLY the {num_variations} ad variations, each starting with \"Variation:\".\n"
+        "The product is: \""
+    ),
+    "es": (
+        "Eres un redactor publicitario experto en comercio electrónico.\n"
+        "Escribe {num_variations} variaciones de anuncio breves y atractivas, en español, para un producto.\n"
+        "No uses hashtags. Cada anuncio debe tener entre 1 y 3 frases.\n"
+        "Devuelve SOLO las {num_variations} variaciones, cada una empezando con \"Variation:\".\n"
+        "El producto es: \""
+    ),
+    "fr": (
+        "Tu es un rédacteur publicitaire expert en e-commerce.\n"
+        "Écris {num_variations} variantes d'annonce courtes et percutantes, en français, pour un produit.\n"
+        "N'utilise pas de hashtags. Chaque annonce fait entre 1 et 3 phrases.\n"
+        "Renvoie UNIQUEMENT les {num_variations} variantes, chacune commençant par \"Variation:\".\n"
+        "Le produit est : \""
+    ),
+}
+PROMPT_SUFFIX = "\".\n<end_of_turn>\n<start_of_turn>model\n"
+
+def check_template(template: Optional[str]) -> str:
+    """Resolves a template name (AD_COPY_TEMPLATE when None)."""
+    template = template or AD_COPY_TEMPLATE
+    if template not in AD_COPY_TEMPLATES:
+        raise ValueError(f"Unknown ad copy template '{template}'; expected one of {sorted(AD_COPY_TEMPLATES)}.")
+    return template
+
+def split_marketing_prompt(num_variations: int = AD_COPY_VARIATIONS, template: Optional[str] = None) -> tuple[str, str]:
+    """The static prefix and the suffix that go around the caption in a prompt."""
+    instructions = AD_COPY_TEMPLATES[check_template(template)].format(num_variations=num_variations)
+    return f"<start_of_turn>user\n{instructions}", PROMPT_SUFFIX
+
+def create_marketing_prompt(caption: str, num_variations: int = AD_COPY_VARIATIONS, template: Optional[str] = None) -> str:
+    prefix, suffix = split_marketing_prompt(num_variations, template)
+    return f"{prefix}{caption}{suffix}"
+
+def get_prompt_prefix(text_generator, template: str, num_variations: int) -> PromptPrefix:
+    """The prefilled KV cache of a template's static prefix, computed on first use."""
+    def build():
+        import torch
+        tokenizer, model = text_generator.tokenizer, text_generator.model
+        prefix_text, _ = split_marketing_prompt(num_variations, template)
+        input_ids = tokenizer(prefix_text, return_tensors="pt")["input_ids"]
+        with span("gemma_prefix_prefill"), torch.inference_mode():
+            output = model(input_ids=input_ids, use_cache=True)
+        print(f"Prefilled the '{template}' ad copy prefix ({input_ids.shape[1]} tokens).")
+        return PromptPrefix(input_ids, output.past_key_values)
+
+    return PROMPT_PREFIXES.get(TEXT_GEN_MODEL_ID, (template, num_variations), build)
+
+GENERATION_ARGS = {
+    "do_sample": True,
+    "temperature": 0.7, "top_k": 50, "top_p": 0.95,
+}
+# Token budget per requested variation (the old fixed 200 covered three)
+MAX_NEW_TOKENS_PER_VARIATION = 70
+
+# Up to the first colon, so colons inside the ad text are kept
+VARIATION_MARKER = re.compile(r"Variation[^:\n]*:")
+# A variation followed by a blank line is finished even before the next marker
+_PARAGRAPH = re.compile(r"\s*\S.*?\n[ \t]*\n", re.DOTALL)
+
+def parse_variations(raw_text: str, num_variations: Optional[int] = None, final: bool = True) -> list[str]:
+    """
+    Splits the model output into its "Variation:" parts.
+
+    Any text before the first marker (e.g. "Here are three ads:") or after a
+    blank line that ends the last variation is dropped; output without
+    markers is kept whole.
+
+    Args:
+        raw_text: The generated text.
+        num_variations: Return at most this many variations.
+        final: False while the text is still being generated. Only variations
+            known to be complete are returned then: those followed by another
+            marker or by a blank line.
+    """
+    markers = list(VARIATION_MARKER.finditer(raw_text))
+    if markers:
+        ends = [marker.start() for marker in markers[1:]] + [len(raw_text)]
+        parts = [raw_text[marker.end():end] for marker, end in zip(markers, ends)]
+        # The last variation ends at a blank line; anything after it is commentary
+        paragraph = _PARAGRAPH.match(parts[-1])
+        if paragraph:
+            parts[-1] = paragraph.group(0)
+        elif not final:
+            parts.pop()
+    else:
+        parts = [raw_text] if final else []
+
+    variations = []
+    for part in parts:
+        cleaned_line = part.replace('**', '').replace('\n', ' ').strip()
+        if cleaned_line:
+            variations.append(cleaned_line)
+    return variations[:num_variations] if num_variations else variations
+
+class VariationStoppingCriteria:
+    """
+    Stopping criterion for a batched `generate`: a row is done as soon as it
+    holds its requested number of complete variations, so Gemma doesn't keep
+    decoding past them. Each completed variation is handed to the row's
+    `on_variation(index, text)` callback right away.
+
+    Decoding is incremental: each row keeps the text of its finished lines and
+    decodes only the tokens of the line in progress. Variations can only
+    complete at a line break, so the finished text is parsed once per line,
+    not once per token.
+    """
+
+    def __init__(self, tokenizer, prompt_length: int, counts: list[int], callbacks: list[Optional[Callable]]):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.counts = counts
+        self.callbacks = callbacks
+        self.emitted = [0] * len(counts)
+        self.done = [False] * len(counts)
+        # Per row: the decoded text of finished lines, and where the line in progress starts
+        self.lines = [""] * len(counts)
+        self.line_starts = [prompt_length] * len(counts)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+        for row, count in enumerate(self.counts):
+            if self.done[row]:
+                continue
+            # Tokens are only split off at a line break, so decoding them apart gives the same text
+            line = self.tokenizer.decode(input_ids[row, self.line_starts[row]:], skip_special_tokens=True)
+            if not line.endswith("\n"):
+                continue
+            self.lines[row] += line
+            self.line_starts[row] = input_ids.shape[1]
+            variations = parse_variations(self.lines[row], count, final=False)
+            self.emit(row, variations)
+            self.done[row] = len(variations) >= count
+        return torch.tensor(self.done, dtype=torch.bool, device=input_ids.device)
+
+    def emit(self, row: int, variations: list[str]) -> None:
+        """Calls the row's callback for variations it hasn't seen yet."""
+        callback = self.callbacks[row]
+        for index in range(self.emitted[row], len(variations)):
+            if callback is not None:
+                callback(index, variations[index])
+        self.emitted[row] = max(self.emitted[row], len(variations))
+
+def _prepare_inputs(text_generator, captions: list[str], template: str, num_variations: int) -> tuple:
+    """
+    Tokenizes a batch of prompts that share a template, left-padded so they
+    all end at the same position.
+
+    With the prefix cache on, the rows start from the template's prefilled
+    prefix and only the caption suffixes are tokenized; the padding then sits
+    between prefix and suffix, where the attention mask hides it.
+
+    Returns:
+        (input_ids, attention_mask, past_key_values, cached_length), where the
+        first `cached_length` tokens are already in `past_key_values`.
+    """
+    import torch
+    from transformers import DynamicCache
+    tokenizer = text_generator.tokenizer
+    tokenizer.padding_side = "left"
+    if not TEXT_GEN_PREFIX_CACHE:
+        prompts = [create_marketing_prompt(caption, num_variations, template) for caption in captions]
+        with span("gemma_tokenize"):
+            inputs = tokenizer(prompts, return_tensors="pt", padding=True)
+        return inputs["input_ids"], inputs["attention_mask"], DynamicCache(), 0
+
+    prefix = get_prompt_prefix(text_generator, template, num_variations)
+    _, suffix = split_marketing_prompt(num_variations, template)
+    with span("gemma_tokenize"):
+        inputs = tokenizer(
+            [f"{caption}{suffix}" for caption in captions],
+            return_tensors="pt", padding=True, add_special_tokens=False,
+        )
+    prefix_ids = prefix.input_ids.expand(len(captions), -1)
+    input_ids = torch.cat([prefix_ids, inputs["input_ids"]], dim=1)
+    attention_mask = torch.cat([torch.ones_like(prefix_ids), inputs["attention_mask"]], dim=1)
+    return input_ids, attention_mask, prefix.expand(len(captions)), prefix.length
+
+def _generate_group(
+    text_generator, captions: list[str], template: str, num_variations: int, callbacks: list[Optional[Callable]],
+    cancel_tokens: list[Optional[CancelToken]],
+) -> list:
+    """
+    Generates ad copy for captions that share a template and variation count.
+    Rows whose cancel token fires stop decoding at the next token, and get an
+    OperationCancelled error instead of their variations.
+    """
+    import torch
+    from transformers import StoppingCriteriaList
+    tokenizer, model = text_generator.tokenizer, text_generator.model
+    input_ids, attention_mask, past_key_values, cached_length = _prepare_inputs(
+        text_generator, captions, template, num_variations,
+    )
+
+    # Prefill the uncached prompt tokens except the last, which `generate` feeds
+    # itself, so prefill and decode are timed apart
+    prompt_length = input_ids.shape[1]
+    position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+    with span("gemma_prefill"), torch.inference_mode():
+        model(
+            input_ids=input_ids[:, cached_length:-1],
+            attention_mask=attention_mask[:, :-1],
+            position_ids=position_ids[:, cached_length:-1],
+            past_key_values=past_key_values, use_cache=True,
+        )
+
+    stopper = VariationStoppingCriteria(tokenizer, prompt_length, [num_variations] * len(captions), callbacks)
+    with span("gemma_generate"), torch.inference_mode():
+        output_ids = model.generate(
+            input_ids=input_ids, attention_mask=attention_mask, past_key_values=past_key_values,
+            **GENERATION_ARGS,
+            max_new_tokens=MAX_NEW_TOKENS_PER_VARIATION * num_variations,
+            stopping_criteria=StoppingCriteriaList([stopper, CancelledRows(cancel_tokens)]),
+            pad_token_id=tokenizer.pad_token_id,
+        )
+    new_tokens = output_ids[:, prompt_length:]
+    raw_texts = tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+    results = []
+    for row, raw_text in enumerate(raw_texts):
+        token = cancel_tokens[row]
+        if token is not None and token.cancelled:
+            results.append(OperationCancelled(token.reason))
+            continue
+        # Rows that hit end-of-turn or the token budget finish their last variation here
+        variations = parse_variations(raw_text, num_variations)
+        stopper.emit(row, variations)
+        results.append(variations)
+    return results
+
+def generate_ad_copy_batch(
+    captions: list[str],
+    counts: Optional[list[int]] = None,
+    callbacks: Optional[list[Optional[Callable]]] = None,
+    templates: Optional[list[Optional[str]]] = None,
+    cancel_tokens: Optional[list[Optional[CancelToken]]] = None,
+) -> list:
+    """
+    Writes ad copy for several captions in batched `generate` calls, one per
+    (template, variation count) group, since those share a prompt prefix.
+
+    Args:
+        captions: The product captions.
+        counts: Variations wanted per caption (default `AD_COPY_VARIATIONS`).
+            Each row stops decoding once it has that many.
+        callbacks: Optional per-caption `on_variation(index, text)` callbacks,
+            called as each variation is completed.
+        templates: Prompt template per caption (default `AD_COPY_TEMPLATE`).
+        cancel_tokens: Optional per-caption cancel tokens. A caption whose
+            token has fired gets an OperationCancelled error in place of its
+            variations; it is left out of the batch if it fired before
+            generation started.
+    """
+    counts = counts or [AD_COPY_VARIATIONS] * len(captions)
+    callbacks = callbacks or [None] * len(captions)
+    templates = [check_template(template) for template in (templates or [None] * len(captions))]
+    cancel_tokens = cancel_tokens or [None] * len(captions)
+    results: list = [None] * len(captions)
+
+    groups: dict = {}
+    for row, key in enumerate(zip(templates, counts)):
+        token = cancel_tokens[row]
+        if token is not None and token.cancelled:
+            results[row] = OperationCancelled(token.reason)
+        else:
+            groups.setdefault(key, []).append(row)
+    if not groups:
+        return results
+    text_generator = load_text_gen_model()
+    for (template, num_variations), rows in groups.items():
+        outputs = _generate_group(
+            text_generator, [captions[row] for row in rows], template, num_variations,
+            [callbacks[row] for row in rows], [cancel_tokens[row] for row in rows],
+        )
+        for row, variations in zip(rows, outputs):
+            results[row] = variations
+    return results
+
+def _ad_copy_batch(items: list[tuple]) -> list:
+    captions, counts, callbacks, templates, cancel_tokens = zip(*items)
+    return generate_ad_copy_batch(list(captions), list(counts), list(callbacks), list(templates), list(cancel_tokens))
+
+# Concurrent requests share Gemma batches through this batcher
+TEXT_GEN_BATCHER = MicroBatcher(
+    "gemma-ad-copy", _ad_copy_batch,
+    max_batch_size=TEXT_GEN_BATCH_SIZE, max_wait_ms=TEXT_GEN_BATCH_WAIT_MS,
+)
+
+@traced("generate_ad_copy")
+def generate_ad_copy(
+    caption: str,
+    num_variations: Optional[int] = None,
+    on_variation: Optional[Callable[[int, str], None]] = None,
+    template: Optional[str] = None,
+    cancel_token: Optional[CancelToken] = None,
+    raise_errors: bool = False,
+) -> list[str]:
+    """
+    Writes ad copy variations for a product caption.
+
+    Args:
+        caption: The product caption.
+        num_variations: How many variations to write (default `AD_COPY_VARIATIONS`).
+        on_variation: Optional `on_variation(index, text)` callback, called
+            once per returned variation, in order, as soon as it is complete.
+        template: The copywriter prompt template, a key of `AD_COPY_TEMPLATES`
+            (default `AD_COPY_TEMPLATE`).
+        cancel_token: Stops this caption's row of the shared batch at the
+            next decoded token; OperationCancelled is raised then.
+        raise_errors: Raise generation failures instead of returning an
+            error variation.
+
+    Returns:
+        The variations.
+    """
+    check(cancel_token)
+    num_variations = num_variations or AD_COPY_VARIATIONS
+    template = check_template(template)
+    emitted = 0
+
+    def emit(index: int, text: str) -> None:
+        nonlocal emitted
+        emitted = index + 1
+        if on_variation is not None:
+            on_variation(index, text)
+
+    cache_key = make_key(
+        "ad_copy", TEXT_GEN_MODEL_ID, hash_bytes(caption.encode("utf-8")),
+        {
+            **GENERATION_ARGS, "precision": TEXT_GEN_PRECISION,
+            "variations": num_variations, "tokens_per_variation": MAX_NEW_TOKENS_PER_VARIATION,
+            "template": template,
+        },
+    )
+    cached = RESULT_CACHE.get(cache_key)
+    if cached is not None:
+        print(f"Ad copy for caption '{caption}' (cached).")
+        variations = cached
+    else:
+        print(f"Generating ad copy for caption: '{caption}'")
         try:
-            print("LAZY LOADING: Loading LLM (Gemma-2b-it)...")
-            MODEL_NAME = "google/gemma-2b-it"
-            TOKENIZER = AutoTokenizer.from_pretrained(MODEL_NAME)
-            MODEL = AutoModelForCausalLM.from_pretrained(
-                MODEL_NAME,
-                torch_dtype=torch.float32,
-            ).to("cpu")
-            TEXT_GENERATOR = pipeline(
-                "text-generation", model=MODEL, tokenizer=TOKENIZER,
-            )
-            print("Gemma-2b-it model loaded successfully.")
-        except Exception as e:
-            print(f"Error loading Gemma model: {e}")
+            variations = TEXT_GEN_BATCHER.submit((caption, num_variations, emit, template, cancel_token))
+            RESULT_CACHE.put(cache_key, variations)
+        except OperationCancelled:
             raise
+        except Exception as e:
+            if raise_errors:
+                raise
+            print(f"Error during text generation: {e}")
+            variations = ["Error generating ad copy."]
+    for index in range(emitted, len(variations)):
+        emit(index, variations[index])
+    return variations
 
-# --- (create_marketing_prompt function stays the same) ---
-def create_marketing_prompt(caption: str) -> str:
-    prompt = f"""<start_of_turn>user
-You are an expert e-commerce copywriter.
-Your task is to write 3 compelling, short ad variations for a product.
-The product is: "{caption}".
-Do not use hashtags. Keep the ads between 1-3 sentences.
-Return ONLY the 3 ad variations, each starting with "Variation:".
-<end_of_turn>
-<start_of_turn>model
-"""
-    return prompt
-
-# --- (generate_ad_copy function stays the same) ---
-def generate_ad_copy(caption: str) -> list[str]:
-    load_text_gen_model()
-    if TEXT_GENERATOR is None:
-        raise RuntimeError("Text generation model is not loaded.")
-    prompt = create_marketing_prompt(caption)
-    generation_args = {
-        "max_new_tokens": 200, "return_full_text": False, "do_sample": True,
-        "temperature": 0.7, "top_k": 50, "top_p": 0.95,
-    }
-    print(f"Generating ad copy for caption: '{caption}'")
+def stream_ad_copy(
+    caption: str, num_variations: Optional[int] = None, template: Optional[str] = None,
+    cancel_token: Optional[CancelToken] = None,
+) -> Iterator[str]:
+    """
+    Yields ad copy variations one at a time, each as soon as Gemma has
+    finished writing it. Generation still goes through the shared batcher.
+    Closing the generator early (the consumer went away) stops decoding.
+    """
+    variations: queue.Queue = queue.Queue()
+    done = object()
+    token = cancel_token.child(name="ad_copy stream") if cancel_token is not None else CancelToken(name="ad_copy stream")
+
+    def produce():
+        try:
+            generate_ad_copy(
+                caption, num_variations, on_variation=lambda index, text: variations.put(text), template=template,
+                cancel_token=token,
+            )
+        except OperationCancelled:
+            pass
+        finally:
+            variations.put(done)
+
+    threading.Thread(target=produce, name="ad-copy-stream", daemon=True).start()
     try:
-        outputs = TEXT_GENERATOR(prompt, **generation_args)
-        raw_text = outputs[0]['generated_text']
-        variations = []
-        parts = re.split(r"Variation.*:", raw_text)
-        for part in parts:
-            cleaned_line = part.replace('**', '').replace('\n', ' ').strip()
-            if cleaned_line:
-                variations.append(cleaned_line)
-        return variations
-    except Exception as e:
-        print(f"Error during text generation: {e}")
-        return ["Error generating ad copy."]
+        while (text := variations.get()) is not done:
+            yield text
+    finally:
+        token.cancel("Ad copy stream was closed.")
+    check(cancel_token)
+
+def warm_up_text_gen_model(forward: bool = True) -> None:
+    """
+    Loads Gemma and, with `forward`, generates a couple of tokens, so the
+    first request doesn't pay for paging in weights and allocating buffers.
+    """
+    text_generator = load_text_gen_model()
+    if forward:
+        import torch
+        tokenizer, model = text_generator.tokenizer, text_generator.model
+        inputs = tokenizer([create_marketing_prompt("a product")], return_tensors="pt")
+        with torch.inference_mode():
+            model.generate(**inputs, max_new_tokens=2, do_sample=False, pad_token_id=tokenizer.pad_token_id)
 
-# --- ADD THIS NEW FUNCTION ---
 def del_text_gen_model():
-    """Deletes the Gemma model from memory."""
-    global TEXT_GENERATOR
-    if TEXT_GENERATOR is not None:
-        del TEXT_GENERATOR
-        TEXT_GENERATOR = None
-    gc.collect()
-    print("Unloaded Gemma model from RAM.")
\ No newline at end of file
+    """Explicitly unloads the Gemma model from the registry."""
+    if REGISTRY.evict(TEXT_GEN_MODEL_ID):
+        print("Unloaded Gemma model from RAM.")
@@ -0,0 +1,167 @@
+import io
+import json
+from typing import Optional
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .config import MAX_UPLOAD_MB, MAX_IMAGE_PIXELS, WORKING_MAX_SIDE
+from .metrics import traced
+from .result_cache import hash_bytes
+
+MAX_UPLOAD_BYTES = int(MAX_UPLOAD_MB * 1024 * 1024)
+
+
+class ImageIngestError(ValueError):
+    """Raised when an upload can't be decoded or is too large to process."""
+
+
+class UploadTooLargeError(ImageIngestError):
+    """Raised when a request body goes over the upload size limit."""
+
+
+# --- Upload Size Limit ---
+class UploadLimitMiddleware:
+    """
+    ASGI middleware that answers 413 to request bodies over `max_bytes`.
+
+    A declared Content-Length over the limit is rejected before any of the
+    body is read. Otherwise the bytes are counted as they stream in, and
+    reading stops at the limit, so an oversized (or chunked) upload is never
+    buffered or spooled to disk in full.
+    """
+
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.max_bytes <= 0:
+            await self.app(scope, receive, send)
+            return
+        declared = dict(scope["headers"]).get(b"content-length", b"")
+        if declared.isdigit() and int(declared) > self.max_bytes:
+            await self._reject(send)
+            return
+
+        received = 0
+        exceeded = False
+        responded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    raise UploadTooLargeError(self._detail())
+            return message
+
+        async def limited_send(message):
+            nonlocal responded
+            if not exceeded:
+                responded = True
+                await send(message)
+            elif not responded and message["type"] == "http.response.start":
+                # The app answers the aborted body with its own parsing error; replace it
+                responded = True
+                await self._reject(send)
+
+        try:
+            await self.app(scope, limited_receive, limited_send)
+        except UploadTooLargeError:
+            if responded:
+                raise
+            await self._reject(send)
+
+    def _detail(self) -> str:
+        return f"Upload is larger than the {self.max_bytes / (1024 * 1024):g} MB limit."
+
+    async def _reject(self, send) -> None:
+        body = json.dumps({"detail": self._detail()}).encode("utf-8")
+        await send({
+            "type": "http.response.start", "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode("ascii"))],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+# --- Decoding ---
+def working_size(size: tuple[int, int], max_side: int) -> tuple[int, int]:
+    """`size` scaled down so its long side is at most `max_side` (unchanged if it already fits)."""
+    width, height = size
+    if not max_side or max(width, height) <= max_side:
+        return size
+    scale = max_side / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def working_side(output_size: int = 0) -> int:
+    """The working resolution for a request: large outputs need a cut-out at least their size."""
+    if not WORKING_MAX_SIDE:
+        return 0
+    return max(WORKING_MAX_SIDE, output_size)
+
+@traced("image_decode")
+def decode_image(image_bytes: bytes, max_side: Optional[int] = None) -> tuple[Image.Image, tuple[int, int]]:
+    """
+    Decodes an uploaded image once for every pipeline stage.
+
+    The image is downscaled to `max_side` as early as possible: JPEGs are
+    decoded at 1/2, 1/4 or 1/8 scale straight from the DCT coefficients
+    (`draft`), and the rest is resampled with `reduce` doing the coarse
+    steps. EXIF orientation is applied and the mode normalized to RGB, which
+    is what BLIP and rembg work in, or to RGBA for images with transparency
+    (e.g. PNG or WebP cut-outs), so their alpha isn't lost.
+
+    Args:
+        image_bytes: The raw uploaded file.
+        max_side: The working resolution's long side (WORKING_MAX_SIDE when
+            None, 0 for full resolution).
+
+    Returns:
+        The decoded RGB (or RGBA) image and the original (width, height).
+    """
+    max_side = WORKING_MAX_SIDE if max_side is None else max_side
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+    except (UnidentifiedImageError, Image.DecompressionBombError) as e:
+        raise ImageIngestError(f"Unreadable image: {e}")
+    original_size = image.size
+    if original_size[0] * original_size[1] > MAX_IMAGE_PIXELS:
+        raise ImageIngestError(
+            f"Image is {original_size[0]}x{original_size[1]}; at most {MAX_IMAGE_PIXELS} pixels are accepted."
+        )
+
+    try:
+        target = working_size(original_size, max_side)
+        if target != original_size:
+            image.draft("RGB", target)
+        mode = "RGBA" if image.has_transparency_data else "RGB"
+        image = ImageOps.exif_transpose(image)
+        if image.mode != mode:
+            image = image.convert(mode)
+        target = working_size(image.size, max_side)
+        if target != image.size:
+            image = image.resize(target, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    except (OSError, SyntaxError) as e:
+        # Truncated or corrupt data only shows up once the pixels are decoded
+        raise ImageIngestError(f"Unreadable image: {e}")
+    return image, original_size
+
+def ingest_image(image_bytes: bytes, max_side: Optional[int] = None) -> dict:
+    """
+    Decodes an upload into the dict the pipeline stages share: the working
+    image, its cache hash and the original size.
+
+    The hash covers the bytes and the working resolution, since cached
+    captions and cut-outs depend on both.
+    """
+    max_side = WORKING_MAX_SIDE if max_side is None else max_side
+    image, original_size = decode_image(image_bytes, max_side)
+    if image.size != original_size:
+        print(f"Decoded {original_size[0]}x{original_size[1]} image at {image.size[0]}x{image.size[1]}.")
+    return {
+        "image": image,
+        "hash": f"{hash_bytes(image_bytes)}@{max_side}",
+        "original_size": original_size,
+    }
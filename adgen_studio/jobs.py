@@ -0,0 +1,240 @@
+import queue
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+from .cancellation import CancelToken, OperationCancelled
+
+# --- Job States ---
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class Job:
+    """A single unit of pipeline work tracked by the JobQueue."""
+
+    def __init__(self, fn: Callable[..., Any], args: tuple, kwargs: dict, on_finish: Optional[Callable[[], None]] = None):
+        self.id = uuid.uuid4().hex
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.on_finish = on_finish
+        self.status = QUEUED
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_requested = False
+        # Fired by `JobQueue.cancel`; the pipeline checks it once per model step
+        self.cancel_token = CancelToken(name="job")
+        # Progress events, in order; streamed to clients as they are appended.
+        self.events: list[dict] = []
+        # Resolved with the job's return value; lets async code await the job.
+        self.future: Future = Future()
+
+    def emit(self, event: str, data: Optional[dict] = None) -> None:
+        """Records a progress event (e.g. "caption", "diffusion_step") for this job."""
+        self.events.append({
+            "id": len(self.events),
+            "event": event,
+            "data": data or {},
+            "time": time.time(),
+        })
+
+    @property
+    def result(self) -> Any:
+        if self.status != SUCCEEDED:
+            return None
+        return self.future.result()
+
+    def to_dict(self) -> dict:
+        """A JSON-safe summary of the job (without the result payload)."""
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """
+    A bounded queue drained by a fixed pool of worker threads.
+
+    Submitting never blocks: when `max_queued` jobs are already waiting,
+    `submit` raises QueueFullError so the API can answer with a 429.
+    Finished jobs are kept for `result_ttl_seconds` so clients can fetch them,
+    but at most `max_finished` of them (the oldest go first). Expired jobs are
+    pruned whenever a job is submitted or looked up.
+
+    `on_job_finished(job)` runs for every job once it finishes, after the
+    job's own `on_finish`, e.g. to drop payloads only needed while it ran.
+    """
+
+    def __init__(
+        self,
+        num_workers: int = 1,
+        max_queued: int = 16,
+        result_ttl_seconds: float = 3600,
+        name: str = "adgen-worker",
+        max_finished: int = 100,
+        on_job_finished: Optional[Callable[[Job], None]] = None,
+    ):
+        self.num_workers = num_workers
+        self.name = name
+        self.result_ttl_seconds = result_ttl_seconds
+        self.max_finished = max_finished
+        self.on_job_finished = on_job_finished
+        self._pending: "queue.Queue[Job]" = queue.Queue(maxsize=max_queued)
+        self._jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._workers: list[threading.Thread] = []
+
+    def start(self) -> None:
+        """Starts the worker threads (idempotent)."""
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.num_workers):
+                worker = threading.Thread(target=self._worker_loop, name=f"{self.name}-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def submit(self, fn: Callable[..., Any], *args, on_finish: Optional[Callable[[], None]] = None, **kwargs) -> Job:
+        """
+        Queues `fn(*args, **kwargs)` and returns its Job right away.
+
+        `fn` is also passed a `progress` keyword argument, the job's `emit`
+        method, so it can publish stage events while it runs, and a
+        `cancel_token` keyword argument, which fires when the job is cancelled.
+
+        `on_finish` runs once the job leaves the system for any reason
+        (success, failure or cancellation), e.g. to remove temp files.
+        """
+        self.start()
+        self._prune_finished()
+        job = Job(fn, args, kwargs, on_finish=on_finish)
+        try:
+            self._pending.put_nowait(job)
+        except queue.Full:
+            raise QueueFullError(f"Job queue is full ({self._pending.maxsize} jobs waiting).")
+        with self._lock:
+            self._jobs[job.id] = job
+        job.emit(QUEUED)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._prune_finished()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        Cancels a job. Queued jobs are dropped immediately; running jobs are
+        flagged with `cancel_requested` and their `cancel_token` fires, so the
+        pipeline stops at its next diffusion step or decoded token.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in FINISHED_STATES:
+                return job
+            job.cancel_requested = True
+            dropped = job.status == QUEUED
+            if dropped:
+                job.status = CANCELLED
+        job.cancel_token.cancel("Job was cancelled.")
+        if dropped:
+            self._finish(job, CANCELLED)
+        return job
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = {state: 0 for state in (QUEUED, RUNNING) + FINISHED_STATES}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return {
+            "workers": self.num_workers,
+            "max_queued": self._pending.maxsize,
+            "jobs": counts,
+        }
+
+    def _worker_loop(self) -> None:
+        while True:
+            job = self._pending.get()
+            try:
+                with self._lock:
+                    if job.status != QUEUED:
+                        continue  # Cancelled while waiting in the queue
+                    job.status = RUNNING
+                    job.started_at = time.time()
+                job.emit(RUNNING)
+                try:
+                    value = job.fn(*job.args, progress=job.emit, cancel_token=job.cancel_token, **job.kwargs)
+                except OperationCancelled as e:
+                    if job.cancel_requested:
+                        print(f"Job {job.id} was cancelled.")
+                        self._finish(job, CANCELLED)
+                    else:
+                        # A stage ran past its time budget
+                        print(f"Job {job.id} aborted: {e}")
+                        job.error = str(e)
+                        # Without the traceback, so the aborted stages' tensors and images can be freed
+                        self._finish(job, FAILED, error=e.with_traceback(None))
+                except Exception as e:
+                    print(f"Job {job.id} failed: {e}")
+                    traceback.print_exc()
+                    job.error = str(e)
+                    self._finish(job, FAILED, error=e)
+                else:
+                    self._finish(job, CANCELLED if job.cancel_requested else SUCCEEDED, value=value)
+            finally:
+                self._pending.task_done()
+
+    def _finish(self, job: Job, status: str, value: Any = None, error: Optional[BaseException] = None) -> None:
+        job.status = status
+        job.finished_at = time.time()
+        job.emit(status, {"error": job.error} if job.error else None)
+        if status == SUCCEEDED:
+            job.future.set_result(value)
+        elif status == FAILED:
+            job.future.set_exception(error)
+        else:
+            job.future.cancel()
+        if job.on_finish is not None:
+            try:
+                job.on_finish()
+            except Exception as e:
+                print(f"Job {job.id} cleanup failed: {e}")
+        if self.on_job_finished is not None:
+            try:
+                self.on_job_finished(job)
+            except Exception as e:
+                print(f"Job {job.id} cleanup failed: {e}")
+
+    def _prune_finished(self) -> None:
+        """Drops finished jobs past the TTL, then the oldest ones past `max_finished`."""
+        cutoff = time.time() - self.result_ttl_seconds
+        with self._lock:
+            finished = sorted(
+                (job for job in self._jobs.values() if job.status in FINISHED_STATES and job.finished_at is not None),
+                key=lambda job: job.finished_at,
+            )
+            expired = [job for job in finished if job.finished_at < cutoff]
+            kept = finished[len(expired):]
+            expired += kept[:max(len(kept) - self.max_finished, 0)]
+            for job in expired:
+                del self._jobs[job.id]
@@ -0,0 +1,201 @@
+import contextvars
+import functools
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+# --- Bucket Layouts ---
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+BYTES_BUCKETS = tuple(2 ** p for p in range(20, 35))  # 1 MB ... 16 GB
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Counter:
+    """A monotonically increasing Prometheus-style counter, with labels."""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: dict = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    """A Prometheus-style cumulative histogram, with labels."""
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = SECONDS_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict = {}  # labels -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+# --- Shared Metrics ---
+STAGE_SECONDS = Histogram("adgen_stage_seconds", "Latency of instrumented pipeline steps.")
+STAGE_PEAK_RSS_DELTA_BYTES = Histogram(
+    "adgen_stage_peak_rss_delta_bytes",
+    "Growth of the process peak RSS while a step ran (process-wide, so concurrent steps share it).",
+    buckets=BYTES_BUCKETS,
+)
+STAGE_ERRORS = Counter("adgen_stage_errors_total", "Instrumented steps that raised an exception.")
+STAGE_ABORTS = Counter("adgen_stage_aborts_total", "Pipeline stages stopped by a job cancellation or their time budget.")
+MODEL_LOAD_SECONDS = Histogram("adgen_model_load_seconds", "Time to load a model into the registry.")
+
+ALL_METRICS = [STAGE_SECONDS, STAGE_PEAK_RSS_DELTA_BYTES, STAGE_ERRORS, STAGE_ABORTS, MODEL_LOAD_SECONDS]
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """The process's peak resident set size so far, or None if unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def process_memory(pid: Optional[int] = None) -> Optional[dict]:
+    """
+    Current memory of a process (this one by default) from Linux's
+    /proc/<pid>/smaps_rollup, or None where that isn't available.
+
+    RSS counts every resident page; PSS splits shared pages between the
+    processes that map them, so memory-mapped weights shared by N workers
+    add only 1/N of their size to each worker's PSS.
+    """
+    fields = {"Rss": "rss_bytes", "Pss": "pss_bytes", "Shared_Clean": "shared_bytes", "Shared_Dirty": "shared_bytes"}
+    memory = {"rss_bytes": 0, "pss_bytes": 0, "shared_bytes": 0}
+    try:
+        with open(f"/proc/{pid or 'self'}/smaps_rollup", encoding="ascii") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in fields:
+                    memory[fields[key]] += int(value.split()[0]) * 1024  # kB
+    except (OSError, ValueError):
+        return None
+    memory["private_bytes"] = memory["rss_bytes"] - memory["shared_bytes"]
+    return memory
+
+
+# --- Per-Request Traces ---
+# When a trace is active, every span adds its duration to it, so one request
+# can report where its time went (e.g. in a Server-Timing header).
+_CURRENT_TRACE: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("adgen_trace", default=None)
+
+
+@contextmanager
+def collect_trace():
+    """Collects `{span name: total seconds}` for all spans run inside the block."""
+    trace: dict = {}
+    token = _CURRENT_TRACE.set(trace)
+    try:
+        yield trace
+    finally:
+        _CURRENT_TRACE.reset(token)
+
+
+def add_to_trace(timings: dict) -> None:
+    """Adds `{span name: seconds}` recorded elsewhere (e.g. in a worker process) to the active trace."""
+    trace = _CURRENT_TRACE.get()
+    if trace is not None:
+        for name, seconds in timings.items():
+            trace[name] = trace.get(name, 0.0) + seconds
+
+
+@contextmanager
+def span(name: str):
+    """Times a block, recording its latency and peak-RSS growth under `name`."""
+    rss_before = peak_rss_bytes()
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(seconds, stage=name)
+        if rss_before is not None:
+            STAGE_PEAK_RSS_DELTA_BYTES.observe(peak_rss_bytes() - rss_before, stage=name)
+        trace = _CURRENT_TRACE.get()
+        if trace is not None:
+            trace[name] = trace.get(name, 0.0) + seconds
+
+
+def traced(name: str) -> Callable:
+    """Decorator form of `span`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def server_timing_header(timings: dict) -> str:
+    """Formats `{name: seconds}` as a Server-Timing header value (in milliseconds)."""
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+
+def render_prometheus(gauges: Optional[dict] = None) -> str:
+    """
+    Renders all shared metrics in the Prometheus text format.
+
+    `gauges` maps metric names to a number, or to a list of
+    (labels dict, number) pairs, for point-in-time values like cache sizes.
+    """
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    for name, value in (gauges or {}).items():
+        lines.append(f"# TYPE {name} gauge")
+        samples = value if isinstance(value, list) else [({}, value)]
+        for labels, sample in samples:
+            lines.append(f"{name}{_format_labels(tuple(sorted(labels.items())))} {sample}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,185 @@
+import gc
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+from .config import GB, MODEL_RAM_BUDGET_GB
+from .metrics import MODEL_LOAD_SECONDS
+
+
+def estimate_model_bytes(obj: Any) -> int:
+    """
+    Estimates how much RAM a loaded model object holds in weights.
+
+    Works on plain torch modules, diffusers pipelines (via `components`),
+    transformers pipelines (via `model`) and tuples/lists of those.
+    Shared tensors are only counted once.
+    """
+    seen = set()
+
+    def visit(item) -> int:
+        if item is None or id(item) in seen:
+            return 0
+        seen.add(id(item))
+        if isinstance(item, (list, tuple)):
+            return sum(visit(x) for x in item)
+        if isinstance(item, dict):
+            return sum(visit(x) for x in item.values())
+        if hasattr(item, "parameters") and hasattr(item, "buffers"):
+            total = 0
+            for tensor in list(item.parameters()) + list(item.buffers()):
+                if id(tensor) in seen:
+                    continue
+                seen.add(id(tensor))
+                total += tensor.numel() * tensor.element_size()
+            # Dynamically quantized layers keep their int8 weights outside parameters()
+            for module in item.modules() if hasattr(item, "modules") else ():
+                if hasattr(module, "_packed_params") and callable(getattr(module, "weight", None)):
+                    weight = module.weight()
+                    total += weight.numel() * weight.element_size()
+            return total
+        if hasattr(item, "components"):
+            return visit(dict(item.components))
+        if hasattr(item, "model"):
+            return visit(item.model)
+        return 0
+
+    return visit(obj)
+
+
+class _Entry:
+    def __init__(self, value: Any, size_bytes: int, load_seconds: float):
+        self.value = value
+        self.size_bytes = size_bytes
+        self.load_seconds = load_seconds
+
+
+class ModelRegistry:
+    """
+    A shared, memory-budgeted pool of resident models.
+
+    Models stay loaded between requests while they fit in the RAM budget.
+    When a new model would push the total over budget, the least-recently-used
+    models are evicted until it fits.
+    """
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = int(budget_bytes)
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # Guards the bookkeeping only; loads run under a per-name lock, so a
+        # long load never blocks hits on models that are already resident.
+        self._lock = threading.RLock()
+        self._load_locks: dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, name: str, loader: Callable[[], Any], size_hint_bytes: int = 0) -> Any:
+        """
+        Returns the model registered under `name`, calling `loader()` on a miss.
+
+        `size_hint_bytes` is the expected footprint of the model. It is used to
+        make room *before* loading; the real size is measured afterwards.
+        Concurrent misses on the same name load it once; misses on different
+        names load in parallel.
+        """
+        with self._lock:
+            entry = self._hit(name)
+            if entry is not None:
+                return entry.value
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                # Another caller may have loaded it while this one waited
+                entry = self._hit(name)
+                if entry is not None:
+                    return entry.value
+                self.misses += 1
+                self._make_room(size_hint_bytes, keep=name)
+
+            print(f"LAZY LOADING: Loading '{name}' into the model registry...")
+            start = time.perf_counter()
+            value = loader()
+            load_seconds = time.perf_counter() - start
+            MODEL_LOAD_SECONDS.observe(load_seconds, model=name)
+            size_bytes = estimate_model_bytes(value) or size_hint_bytes
+            print(f"Loaded '{name}' ({size_bytes / GB:.2f} GB) in {load_seconds:.1f}s.")
+
+            with self._lock:
+                self._entries[name] = _Entry(value, size_bytes, load_seconds)
+                # The real size can be larger than the hint; trim other models if so.
+                self._make_room(0, keep=name)
+            return value
+
+    def _hit(self, name: str) -> Optional[_Entry]:
+        """The resident entry for `name`, marked most recently used (call with the lock held)."""
+        entry = self._entries.get(name)
+        if entry is not None:
+            self._entries.move_to_end(name)
+            self.hits += 1
+        return entry
+
+    def _make_room(self, incoming_bytes: int, keep: str) -> None:
+        """Evicts LRU models until `incoming_bytes` more would fit in the budget."""
+        while self._entries and self.used_bytes() + incoming_bytes > self.budget_bytes:
+            victim = next((n for n in self._entries if n != keep), None)
+            if victim is None:
+                break
+            self._drop(victim)
+            self.evictions += 1
+
+    def _drop(self, name: str) -> None:
+        entry = self._entries.pop(name)
+        print(f"Evicting '{name}' from the model registry ({entry.size_bytes / GB:.2f} GB).")
+        del entry
+        gc.collect()
+
+    def evict(self, name: str) -> bool:
+        """Explicitly unloads a model. Returns True if it was resident."""
+        with self._lock:
+            if name not in self._entries:
+                return False
+            self._drop(name)
+            self.evictions += 1
+            return True
+
+    def clear(self) -> None:
+        """Unloads every resident model."""
+        with self._lock:
+            for name in list(self._entries):
+                self._drop(name)
+                self.evictions += 1
+
+    def is_loaded(self, name: str) -> bool:
+        with self._lock:
+            return name in self._entries
+
+    def used_bytes(self) -> int:
+        return sum(entry.size_bytes for entry in self._entries.values())
+
+    def stats(self) -> dict:
+        """Returns the registry counters and the list of resident models."""
+        with self._lock:
+            return {
+                "budget_bytes": self.budget_bytes,
+                "used_bytes": self.used_bytes(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "resident": [
+                    {
+                        "name": name,
+                        "size_bytes": entry.size_bytes,
+                        "load_seconds": round(entry.load_seconds, 3),
+                    }
+                    # Least recently used first
+                    for name, entry in self._entries.items()
+                ],
+            }
+
+
+# --- Shared Instance ---
+# All core modules load their models through this one registry.
+REGISTRY = ModelRegistry(budget_bytes=int(MODEL_RAM_BUDGET_GB * GB))
@@ -0,0 +1,271 @@
+import time
+from typing import Callable, Optional
+
+from adgen_studio.config import GB, PIPELINE_MAX_PARALLEL_STAGES, PIPELINE_MEMORY_BUDGET_GB, OUTPUT_SIZE, STAGE_TIMEOUTS
+from adgen_studio.cancellation import CancelToken, OperationCancelled, current_token
+from adgen_studio.ingest import ImageIngestError, ingest_image, working_side
+from adgen_studio.metrics import collect_trace
+from adgen_studio.stage_graph import Stage, run_stage_graph
+from adgen_studio.workers import WORKER_POOL, run_on_model
+from adgen_studio.vision_core.main import caption_image, segment_image
+from adgen_studio.vision_core.captioning import CAPTION_MODEL_SIZE_HINT
+from adgen_studio.vision_core.segmentation import SEGMENTATION_MODEL_SIZE_HINT
+from adgen_studio.gen_core.image_generation import create_mask_and_image, generate_new_images, INPAINTING_MODEL_SIZE_HINT
+from adgen_studio.gen_core.compositing import upscale_with_product
+from adgen_studio.gen_core.text_generation import generate_ad_copy, TEXT_GEN_MODEL_SIZE_HINT
+
+
+class PipelineError(Exception):
+    """Raised when a pipeline stage fails in a way the caller should report."""
+
+
+# Size of the segmented-image preview sent with the "mask" progress event
+PREVIEW_SIZE = (256, 256)
+
+def _no_progress(event: str, data: Optional[dict] = None) -> None:
+    pass
+
+def _local_bytes(model: str, size_hint: int) -> int:
+    """RAM a stage needs in this process: none when a worker process hosts its model."""
+    return 0 if WORKER_POOL.hosts(model) else size_hint
+
+def run_ad_package(
+    image_bytes: bytes,
+    prompt: str,
+    progress: Optional[Callable[..., None]] = None,
+    num_variants: int = 1,
+    seeds: Optional[list[int]] = None,
+    profile: Optional[str] = None,
+    copy_template: Optional[str] = None,
+    output_size: Optional[int] = None,
+    cancel_token: Optional[CancelToken] = None,
+) -> dict:
+    """
+    Runs the full ad-package pipeline (Sprint 1 + Sprint 2) for one product.
+
+    The stages form a small dependency graph:
+
+        load ─┬─> caption ──────> ad_copy
+              └─> segmentation ─> inpainting ─> upscale (with `output_size`)
+
+    Independent stages (captioning vs. segmentation, ad copy vs. inpainting)
+    run in parallel on worker threads, within the pipeline memory budget.
+
+    Everything stays in memory: the upload is decoded once, at the working
+    resolution (ADGEN_WORKING_MAX_SIDE), and the decoded images are handed
+    straight from stage to stage, with no temp files.
+
+    This is blocking, CPU-heavy work; the API runs it on a job worker thread.
+
+    Args:
+        image_bytes: The raw bytes of the uploaded product image.
+        prompt: The scene prompt for the new lifestyle image.
+        progress: Optional `progress(event, data)` callback. It receives
+            "caption", "mask", "ad_copy_variation" (once per variation, as
+            Gemma finishes it), "ad_copy", "diffusion_step", "image" (once per
+            variant) and "timings" events as soon as each result is available.
+        num_variants: How many scene variants to generate. They share the
+            Sprint 1 outputs and the prompt embeddings, and are denoised in
+            batches.
+        seeds: Optional per-variant seeds; missing ones are picked at random.
+        profile: The inpainting speed profile (a key of `SPEED_PROFILES`).
+            A preview can later be re-rendered with `refine_ad_package`.
+        copy_template: The ad copy prompt template (tone or language), a key
+            of `AD_COPY_TEMPLATES`; ADGEN_AD_COPY_TEMPLATE when None.
+        output_size: Long side of the returned images (ADGEN_OUTPUT_SIZE when
+            None). Scenes are upscaled to it and the full-resolution product
+            is pasted back on top; 0 keeps the diffusion canvas size.
+        cancel_token: Stops the pipeline when it fires: the running model
+            calls stop at their next diffusion step or decoded token and
+            OperationCancelled is raised. Each model stage also has its own
+            time budget (STAGE_TIMEOUTS), and raises StageTimeoutError past it.
+
+    Returns:
+        A dictionary with the caption, the ad copy variations, the generated
+        PIL images and their seeds, the product cut-out (for refinement),
+        per-stage timings in seconds and the trace
+        of instrumented function timings.
+    """
+    progress = progress or _no_progress
+    output_size = OUTPUT_SIZE if output_size is None else output_size
+    # The stage whose images are the final ones
+    scene_stage = "upscale" if output_size else "inpainting"
+    print(f"--- Pipeline Started ---")
+    print(f"Prompt: {prompt}")
+
+    # --- Stage Functions ---
+    def load():
+        try:
+            return ingest_image(image_bytes, working_side(output_size))
+        except ImageIngestError as e:
+            print(f"Error opening image: {e}")
+            raise PipelineError(f"Failed to open image. {e}")
+
+    # Each stage runs with its own token (see run_stage_graph) and hands it to its model call
+    def caption(load):
+        return run_on_model("caption", caption_image, load["image"], load["hash"], cancel_token=current_token())
+
+    def segmentation(load):
+        try:
+            return run_on_model("segmentation", segment_image, load["image"], load["hash"], cancel_token=current_token())
+        except OperationCancelled:
+            raise
+        except Exception as e:
+            print(f"Background removal failed: {e}")
+            raise PipelineError("Failed to remove background.")
+
+    def ad_copy(caption):
+        return run_on_model(
+            "ad_copy", generate_ad_copy, caption,
+            on_variation=lambda index, text: progress("ad_copy_variation", {"index": index, "text": text}),
+            template=copy_template, cancel_token=current_token(),
+        )
+
+    def inpainting(segmentation):
+        base_image, mask_image = create_mask_and_image(segmentation)
+        images, used_seeds = run_on_model(
+            "inpainting", generate_new_images, base_image, mask_image, prompt,
+            num_variants=num_variants, seeds=seeds,
+            on_step=lambda step, total: progress("diffusion_step", {"step": step, "total": total}),
+            profile=profile, cancel_token=current_token(),
+        )
+        return {"images": images, "seeds": used_seeds}
+
+    def upscale(inpainting, segmentation):
+        images = [upscale_with_product(image, segmentation, output_size) for image in inpainting["images"]]
+        return {"images": images, "seeds": inpainting["seeds"]}
+
+    stages = [
+        Stage("load", load),
+        Stage(
+            "caption", caption, deps=["load"],
+            memory_bytes=_local_bytes("caption", CAPTION_MODEL_SIZE_HINT), timeout=STAGE_TIMEOUTS["caption"],
+        ),
+        Stage(
+            "segmentation", segmentation, deps=["load"],
+            memory_bytes=_local_bytes("segmentation", SEGMENTATION_MODEL_SIZE_HINT), timeout=STAGE_TIMEOUTS["segmentation"],
+        ),
+        Stage(
+            "ad_copy", ad_copy, deps=["caption"],
+            memory_bytes=_local_bytes("ad_copy", TEXT_GEN_MODEL_SIZE_HINT), timeout=STAGE_TIMEOUTS["ad_copy"],
+        ),
+        Stage(
+            "inpainting", inpainting, deps=["segmentation"],
+            memory_bytes=_local_bytes("inpainting", INPAINTING_MODEL_SIZE_HINT), timeout=STAGE_TIMEOUTS["inpainting"],
+        ),
+    ]
+    if output_size:
+        stages.append(Stage("upscale", upscale, deps=["inpainting", "segmentation"]))
+
+    # --- Progress Events ---
+    def on_stage_done(name, output, seconds):
+        print(f"Stage '{name}' finished in {seconds:.1f}s.")
+        if name == "caption":
+            progress("caption", {"caption": output})
+        elif name == "segmentation":
+            preview = output.copy()
+            preview.thumbnail(PREVIEW_SIZE)
+            progress("mask", {"segmented_image": preview})
+        elif name == "ad_copy":
+            progress("ad_copy", {"ad_copy": output})
+        elif name == scene_stage:
+            for index, (image, seed) in enumerate(zip(output["images"], output["seeds"])):
+                progress("image", {"generated_image": image, "variant": index, "seed": seed})
+
+    start = time.perf_counter()
+    with collect_trace() as trace:
+        outputs, timings = run_stage_graph(
+            stages,
+            max_workers=PIPELINE_MAX_PARALLEL_STAGES,
+            memory_budget_bytes=int(PIPELINE_MEMORY_BUDGET_GB * GB),
+            on_stage_done=on_stage_done,
+            cancel_token=cancel_token,
+        )
+    timings["total"] = round(time.perf_counter() - start, 3)
+    progress("timings", timings)
+
+    print(f"--- Pipeline Successful ({timings['total']:.1f}s) ---")
+    return {
+        "caption": outputs["caption"],
+        "ad_copy": outputs["ad_copy"],
+        "generated_image": outputs[scene_stage]["images"][0],
+        "generated_images": outputs[scene_stage]["images"],
+        "seeds": outputs[scene_stage]["seeds"],
+        "variants": list(range(len(outputs[scene_stage]["seeds"]))),
+        "segmented_image": outputs["segmentation"],
+        "prompt": prompt,
+        "output_size": output_size,
+        "profile": profile,
+        "timings": timings,
+        "trace": {name: round(seconds, 3) for name, seconds in trace.items()},
+    }
+
+def refine_ad_package(
+    previous: dict,
+    profile: str = "final",
+    variants: Optional[list[int]] = None,
+    progress: Optional[Callable[..., None]] = None,
+    cancel_token: Optional[CancelToken] = None,
+) -> dict:
+    """
+    Re-renders scene variants of a finished ad package at a higher-quality profile.
+
+    Only inpainting (and the upscale, for packages with an output size) runs
+    again. The cut-out, caption and ad copy are taken from `previous`, and
+    each variant keeps its seed, so the refined images keep the composition
+    of the drafts the user picked.
+
+    Args:
+        previous: A result of `run_ad_package` (typically a "preview" run).
+        profile: The speed profile to render with.
+        variants: Indices of the variants to refine; all of them by default.
+        progress: Optional `progress(event, data)` callback, receiving
+            "diffusion_step", "image" and "timings" events.
+        cancel_token: Stops the re-render at its next diffusion step. The
+            inpainting time budget (STAGE_TIMEOUTS) applies here too.
+
+    Returns:
+        A dictionary shaped like the `run_ad_package` result, with only the
+        refined variants (their original indices are in "variants").
+    """
+    progress = progress or _no_progress
+    variants = list(range(len(previous["seeds"]))) if variants is None else variants
+    unknown = [i for i in variants if not 0 <= i < len(previous["seeds"])]
+    if not variants or unknown:
+        raise PipelineError(f"Unknown variant indices: {unknown or variants}")
+    seeds = [previous["seeds"][i] for i in variants]
+    print(f"--- Refinement Started: variants {variants} at '{profile}' ---")
+
+    start = time.perf_counter()
+    output_size = previous.get("output_size", 0)
+    inpainting_token = (cancel_token or CancelToken()).child(STAGE_TIMEOUTS["inpainting"], "inpainting")
+    with collect_trace() as trace:
+        base_image, mask_image = create_mask_and_image(previous["segmented_image"])
+        images, _ = run_on_model(
+            "inpainting", generate_new_images, base_image, mask_image, previous["prompt"],
+            num_variants=len(seeds), seeds=seeds,
+            on_step=lambda step, total: progress("diffusion_step", {"step": step, "total": total}),
+            profile=profile, cancel_token=inpainting_token,
+        )
+        timings = {"inpainting": round(time.perf_counter() - start, 3)}
+        if output_size:
+            upscale_start = time.perf_counter()
+            images = [upscale_with_product(image, previous["segmented_image"], output_size) for image in images]
+            timings["upscale"] = round(time.perf_counter() - upscale_start, 3)
+    seconds = round(time.perf_counter() - start, 3)
+    timings["total"] = seconds
+    for index, image, seed in zip(variants, images, seeds):
+        progress("image", {"generated_image": image, "variant": index, "seed": seed})
+    progress("timings", timings)
+
+    print(f"--- Refinement Successful ({seconds:.1f}s) ---")
+    return {
+        **previous,
+        "generated_image": images[0],
+        "generated_images": images,
+        "seeds": seeds,
+        "variants": variants,
+        "profile": profile,
+        "timings": timings,
+        "trace": {name: round(seconds, 3) for name, seconds in trace.items()},
+    }
@@ -0,0 +1,65 @@
+import warnings
+from typing import TYPE_CHECKING, Iterable
+
+if TYPE_CHECKING:
+    import torch  # Imported where it's used, so importing this module stays cheap
+
+# --- Precision Modes ---
+# fp32: full precision (the reference).
+# bf16: bfloat16 weights and activations; half the RAM, faster matmuls on CPUs with AVX512-BF16/AMX.
+# int8: dynamic int8 quantization of Linear layers; weights stored in int8,
+#       activations quantized on the fly, everything else stays fp32.
+PRECISIONS = ("fp32", "bf16", "int8")
+
+# Rough fraction of the fp32 footprint each mode keeps, for registry size hints
+SIZE_FACTORS = {"fp32": 1.0, "bf16": 0.5, "int8": 0.35}
+
+
+def check_precision(precision: str) -> str:
+    """Validates a precision setting and returns it normalised."""
+    precision = precision.lower()
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}'; expected one of {PRECISIONS}.")
+    return precision
+
+
+def load_dtype(precision: str) -> "torch.dtype":
+    """The `torch_dtype` to load weights in; int8 quantizes from fp32 weights."""
+    import torch
+    return torch.bfloat16 if precision == "bf16" else torch.float32
+
+
+def scaled_size_hint(fp32_bytes: int, precision: str) -> int:
+    return int(fp32_bytes * SIZE_FACTORS[precision])
+
+
+def quantize_int8(module: "torch.nn.Module") -> "torch.nn.Module":
+    """Dynamically quantizes every `nn.Linear` in `module` to int8, in place."""
+    import torch
+    from torch.ao.quantization import quantize_dynamic
+    with warnings.catch_warnings():
+        # The eager-mode quantization API warns that it is deprecated on every call
+        warnings.simplefilter("ignore")
+        return quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def apply_precision(modules: Iterable["torch.nn.Module"], precision: str, quantize: Iterable["torch.nn.Module"] = ()) -> None:
+    """
+    Converts loaded models to `precision`.
+
+    Args:
+        modules: All the model's modules. They are cast to bf16 in bf16 mode.
+        precision: One of PRECISIONS.
+        quantize: The subset whose Linear layers are int8-quantized in int8
+            mode. Modules left out (e.g. conv-heavy VAEs) stay in fp32.
+    """
+    import torch
+    if precision == "bf16":
+        for module in modules:
+            # Loaders already ask for bf16 weights; only cast what isn't yet
+            if next(module.parameters()).dtype != torch.bfloat16:
+                module.to(torch.bfloat16)
+    elif precision == "int8":
+        for module in quantize:
+            quantize_int8(module)
+
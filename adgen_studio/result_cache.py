@@ -0,0 +1,231 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from PIL import Image
+
+from .config import (
+    RESULT_CACHE_ENABLED, RESULT_CACHE_MEMORY_ITEMS, RESULT_CACHE_MEMORY_MB,
+    RESULT_CACHE_DIR, RESULT_CACHE_DISK_MB,
+)
+
+
+def hash_bytes(data: bytes) -> str:
+    """Content hash used to address cache entries by their input."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_key(stage: str, model_id: str, content_hash: str, params: Optional[dict] = None) -> str:
+    """Builds a cache key from the input hash, stage name, model id and parameters."""
+    material = json.dumps(
+        {"stage": stage, "model": model_id, "input": content_hash, "params": params or {}},
+        sort_keys=True, default=str,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def value_size(value: Any) -> int:
+    """Approximate in-memory size of a cached value: pixel bytes for images, JSON length otherwise."""
+    if isinstance(value, Image.Image):
+        return value.width * value.height * len(value.getbands())
+    return len(json.dumps(value))
+
+
+class ResultCache:
+    """
+    A two-tier cache for stage outputs.
+
+    The memory tier is an LRU of up to `memory_items` entries and
+    `memory_max_bytes` of values; a value bigger than that is kept on disk
+    only. The disk tier stores PIL images as PNG and everything else as JSON
+    under `disk_dir`, evicting the least recently used files once it grows
+    past `disk_max_bytes`. Its size is kept as a running total, so a put
+    doesn't list the directory.
+    """
+
+    def __init__(
+        self,
+        memory_items: int,
+        disk_dir: Optional[str],
+        disk_max_bytes: int,
+        enabled: bool = True,
+        memory_max_bytes: Optional[int] = None,
+    ):
+        self.enabled = enabled
+        self.memory_items = memory_items
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        # key -> (value, size)
+        self._memory: "OrderedDict[str, tuple[Any, int]]" = OrderedDict()
+        self._memory_bytes = 0
+        # path -> size, least recently used first
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self.enabled and self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._scan_disk()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns the cached value for `key`, or None on a miss."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return self._memory[key][0]
+
+        value = self._read_disk(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, value)
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        """Stores `value` in both tiers. Values must be PIL images or JSON-serializable."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._remember(key, value)
+        try:
+            self._write_disk(key, value)
+        except Exception as e:
+            print(f"Result cache: failed to write {key[:12]} to disk: {e}")
+
+    def _remember(self, key: str, value: Any) -> None:
+        size = value_size(value)
+        if key in self._memory:
+            self._memory_bytes -= self._memory.pop(key)[1]
+        if self.memory_max_bytes is not None and size > self.memory_max_bytes:
+            return  # Would push everything else out; the disk tier still has it
+        self._memory[key] = (value, size)
+        self._memory_bytes += size
+        while len(self._memory) > self.memory_items or (
+            self.memory_max_bytes is not None and self._memory_bytes > self.memory_max_bytes
+        ):
+            _, (_, evicted_size) = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted_size
+
+    # --- Disk Tier ---
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.{ext}")
+
+    def _scan_disk(self) -> None:
+        """Rebuilds the running total from the files on disk, oldest (by modification time) first."""
+        entries = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue  # Removed by another process meanwhile
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+        self._disk = OrderedDict((path, size) for _, path, size in sorted(entries))
+        self._disk_bytes = sum(self._disk.values())
+
+    def _read_disk(self, key: str) -> Optional[Any]:
+        if not self.disk_dir:
+            return None
+        try:
+            png_path = self._path(key, "png")
+            if os.path.exists(png_path):
+                self._touch(png_path)
+                with Image.open(png_path) as image:
+                    image.load()
+                    return image.copy()
+            json_path = self._path(key, "json")
+            if os.path.exists(json_path):
+                self._touch(json_path)
+                with open(json_path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+        except Exception as e:
+            print(f"Result cache: failed to read {key[:12]} from disk: {e}")
+        return None
+
+    def _touch(self, path: str) -> None:
+        """Marks a file as recently used, in the running order and (for the next startup) its mtime."""
+        os.utime(path)
+        with self._lock:
+            if path in self._disk:
+                self._disk.move_to_end(path)
+
+    def _write_disk(self, key: str, value: Any) -> None:
+        if not self.disk_dir:
+            return
+        # A temp file of its own per write, so concurrent puts of one key don't interleave
+        fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+        try:
+            if isinstance(value, Image.Image):
+                path = self._path(key, "png")
+                with os.fdopen(fd, "wb") as f:
+                    value.save(f, format="PNG")
+            else:
+                path = self._path(key, "json")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(value, f)
+            size = os.path.getsize(tmp_path)
+            with self._lock:
+                os.replace(tmp_path, path)  # Atomic, so readers never see partial files
+                self._disk_bytes += size - self._disk.pop(path, 0)
+                self._disk[path] = size
+                self._evict_disk()
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _evict_disk(self) -> None:
+        """
+        Removes the least recently used files once the total is over the limit.
+        Called with the lock held.
+
+        The directory is rescanned first, to count files written by worker
+        processes sharing it, and eviction goes down to 90% of the limit, so
+        the scan happens once per tenth of the budget written, not per put.
+        """
+        if self._disk_bytes <= self.disk_max_bytes:
+            return
+        self._scan_disk()
+        while self._disk_bytes > self.disk_max_bytes * 0.9 and self._disk:
+            path, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "memory_items": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+
+# --- Shared Instance ---
+RESULT_CACHE = ResultCache(
+    memory_items=RESULT_CACHE_MEMORY_ITEMS,
+    memory_max_bytes=int(RESULT_CACHE_MEMORY_MB * 1024 * 1024),
+    disk_dir=RESULT_CACHE_DIR or None,
+    disk_max_bytes=int(RESULT_CACHE_DISK_MB * 1024 * 1024),
+    enabled=RESULT_CACHE_ENABLED,
+)
@@ -0,0 +1,115 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Optional, Sequence
+
+from .cancellation import CancelToken, OperationCancelled, cancel_scope
+from .metrics import STAGE_ABORTS
+
+
+class Stage:
+    """
+    One node of a pipeline graph.
+
+    `fn` is called with the outputs of its dependencies as keyword arguments
+    (named after the dependency stages). `memory_bytes` is the RAM the stage
+    needs while it runs, e.g. the size of the model it uses. `timeout` is
+    the stage's time budget in seconds (None or 0 for no limit).
+    """
+
+    def __init__(
+        self, name: str, fn: Callable[..., Any], deps: Sequence[str] = (), memory_bytes: int = 0,
+        timeout: Optional[float] = None,
+    ):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.memory_bytes = memory_bytes
+        self.timeout = timeout
+
+
+def run_stage_graph(
+    stages: Sequence[Stage],
+    max_workers: int = 2,
+    memory_budget_bytes: Optional[int] = None,
+    on_stage_done: Optional[Callable[[str, Any, float], None]] = None,
+    cancel_token: Optional[CancelToken] = None,
+) -> tuple[dict, dict]:
+    """
+    Runs a dependency graph of stages, running independent stages in parallel.
+
+    A stage starts as soon as all of its dependencies are done, as long as a
+    worker thread is free and the stages already running leave room for its
+    `memory_bytes` in `memory_budget_bytes`. A stage that needs more than the
+    whole budget still runs, but only on its own.
+
+    `on_stage_done(name, output, seconds)` is called as each stage finishes.
+
+    Each stage runs with its own cancel token as the current token (see
+    `cancellation.current_token`), a child of `cancel_token` with the stage's
+    time budget. When a stage fails, the tokens of the stages still running
+    fire, so they stop at their next step instead of finishing work that
+    will be thrown away.
+
+    Returns:
+        A tuple of (outputs by stage name, wall-clock seconds by stage name).
+        The first stage error is re-raised once running stages have finished.
+    """
+    names = [stage.name for stage in stages]
+    for stage in stages:
+        missing = [dep for dep in stage.deps if dep not in names]
+        if missing:
+            raise ValueError(f"Stage '{stage.name}' depends on unknown stages: {missing}")
+
+    pending = {stage.name: stage for stage in stages}
+    running: dict = {}  # future -> Stage
+    outputs: dict = {}
+    timings: dict = {}
+    graph_token = cancel_token.child(name="stage graph") if cancel_token is not None else CancelToken(name="stage graph")
+
+    def timed(stage: Stage, inputs: dict):
+        token = graph_token.child(stage.timeout, stage.name)
+        start = time.perf_counter()
+        try:
+            with cancel_scope(token):
+                token.check()
+                value = stage.fn(**inputs)
+        except OperationCancelled:
+            STAGE_ABORTS.inc(stage=stage.name, reason="timeout" if token.timed_out else "cancelled")
+            raise
+        return value, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="adgen-stage") as pool:
+        while pending or running:
+            ready = [s for s in pending.values() if all(dep in outputs for dep in s.deps)]
+            for stage in ready:
+                if len(running) >= max_workers:
+                    break
+                in_use = sum(s.memory_bytes for s in running.values())
+                if running and memory_budget_bytes is not None and in_use + stage.memory_bytes > memory_budget_bytes:
+                    continue  # Wait for memory to free up
+                inputs = {dep: outputs[dep] for dep in stage.deps}
+                # Copy the context so per-request traces follow the stage onto its thread
+                context = contextvars.copy_context()
+                running[pool.submit(context.run, timed, stage, inputs)] = stage
+                del pending[stage.name]
+
+            if not running:
+                raise ValueError(f"Stage graph has a cycle between: {sorted(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    value, seconds = future.result()
+                except Exception:
+                    # Stop the stages already running at their next step, then fail
+                    graph_token.cancel(f"Stage '{stage.name}' failed.")
+                    wait(running)
+                    raise
+                outputs[stage.name] = value
+                timings[stage.name] = round(seconds, 3)
+                if on_stage_done is not None:
+                    on_stage_done(stage.name, value, seconds)
+
+    return outputs, timings
@@ -1,49 +1,122 @@
-from transformers import BlipProcessor, BlipForConditionalGeneration
+import time
+from typing import Optional
+
 from PIL import Image
-import gc # <-- ADD THIS
-
-# --- Model Loading (Lazy) ---
-PROCESSOR = None
-MODEL = None
-
-def load_caption_model():
-    """Loads the BLIP model into memory."""
-    global PROCESSOR, MODEL
-    if PROCESSOR is None or MODEL is None:
-        try:
-            print("LAZY LOADING: Loading BLIP model (this may take a moment)...")
-            PROCESSOR = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-large")
-            MODEL = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-large")
-            print("BLIP model loaded successfully.")
-        except Exception as e:
-            print(f"Error loading BLIP model: {e}")
-            raise
 
-# --- (generate_caption function stays the same) ---
-def generate_caption(image: Image.Image) -> str:
-    load_caption_model()
-    if MODEL is None or PROCESSOR is None:
-        return "Error: Captioning model not loaded."
-    if image.mode != "RGB":
-        image = image.convert(mode="RGB")
+from adgen_studio.model_registry import REGISTRY
+from adgen_studio.batching import MicroBatcher
+from adgen_studio.metrics import span, traced
+from adgen_studio.cancellation import CancelToken, CancelledRows, OperationCancelled, check
+from adgen_studio.precision import apply_precision, check_precision, load_dtype, scaled_size_hint
+from adgen_studio.weights import model_source, pretrained_kwargs, share_weights
+from adgen_studio.config import GB, CAPTION_BATCH_SIZE, CAPTION_BATCH_WAIT_MS, CAPTION_PRECISION
+
+# --- Model Loading (Shared Registry) ---
+CAPTION_MODEL_ID = "Salesforce/blip-image-captioning-large"
+CAPTION_PRECISION = check_precision(CAPTION_PRECISION)
+CAPTION_MODEL_SIZE_HINT = scaled_size_hint(int(1.9 * GB), CAPTION_PRECISION)  # ~470M params in fp32
+
+def _load_blip() -> tuple:
+    from transformers import BlipProcessor, BlipForConditionalGeneration
+    source = model_source(CAPTION_MODEL_ID)
+    processor = BlipProcessor.from_pretrained(source, **pretrained_kwargs(CAPTION_MODEL_ID))
+    model = BlipForConditionalGeneration.from_pretrained(
+        source, torch_dtype=load_dtype(CAPTION_PRECISION), **pretrained_kwargs(CAPTION_MODEL_ID),
+    )
+    return processor, model
+
+def _load_blip_at_precision() -> tuple:
+    start = time.perf_counter()
+    processor, model = _load_blip()
+    # Map the weights before int8 replaces the Linear ones with private copies
+    share_weights(CAPTION_MODEL_ID, {"": model}, time.perf_counter() - start)
+    # The vision encoder is mostly Linear layers too, so int8 covers the whole model
+    apply_precision([model], CAPTION_PRECISION, quantize=[model])
+    return processor, model
+
+def load_caption_model() -> tuple:
+    """Returns the (processor, model) BLIP pair, loading it into the registry on a miss."""
+    try:
+        return REGISTRY.get(CAPTION_MODEL_ID, _load_blip_at_precision, CAPTION_MODEL_SIZE_HINT)
+    except Exception as e:
+        print(f"Error loading BLIP model: {e}")
+        raise
+
+def generate_captions(images: list[Image.Image], cancel_tokens: Optional[list[Optional[CancelToken]]] = None) -> list:
+    """
+    Captions several images in a single batched BLIP forward pass.
+
+    `cancel_tokens` holds an optional token per image. Images whose token has
+    already fired are left out of the batch, and a row whose token fires
+    while decoding stops there; their entries are OperationCancelled errors
+    instead of captions.
+    """
+    cancel_tokens = cancel_tokens or [None] * len(images)
+    results: list = [None] * len(images)
+    live = []
+    for row, token in enumerate(cancel_tokens):
+        if token is not None and token.cancelled:
+            results[row] = OperationCancelled(token.reason)
+        else:
+            live.append(row)
+    if not live:
+        return results
+
+    processor, model = load_caption_model()
+    with span("blip_preprocess"):
+        batch = [images[row] if images[row].mode == "RGB" else images[row].convert(mode="RGB") for row in live]
+        # Pixel values must match the weights' dtype (bf16 mode)
+        inputs = processor(images=batch, return_tensors="pt").to(model.dtype)
+    tokens = [cancel_tokens[row] for row in live]
+    stopping = {}
+    if any(token is not None for token in tokens):
+        from transformers import StoppingCriteriaList
+        stopping["stopping_criteria"] = StoppingCriteriaList([CancelledRows(tokens)])
+    with span("blip_generate"):
+        output_ids = model.generate(**inputs, max_length=50, **stopping)
+    for row, token, caption in zip(live, tokens, processor.batch_decode(output_ids, skip_special_tokens=True)):
+        results[row] = OperationCancelled(token.reason) if token is not None and token.cancelled else caption
+    return results
+
+def _caption_batch(items: list[tuple]) -> list:
+    images, cancel_tokens = zip(*items)
+    return generate_captions(list(images), list(cancel_tokens))
+
+# Concurrent requests share BLIP batches through this batcher
+CAPTION_BATCHER = MicroBatcher(
+    "blip-caption", _caption_batch,
+    max_batch_size=CAPTION_BATCH_SIZE, max_wait_ms=CAPTION_BATCH_WAIT_MS,
+)
+
+@traced("generate_caption")
+def generate_caption(image: Image.Image, cancel_token: Optional[CancelToken] = None, raise_errors: bool = False) -> str:
+    """
+    Captions one image through the shared BLIP batcher. `cancel_token`
+    drops the image from its batch, or stops its row while decoding, and
+    raises OperationCancelled. A failure returns an error caption, or is
+    raised with `raise_errors`.
+    """
+    check(cancel_token)
     try:
-        inputs = PROCESSOR(image, return_tensors="pt")
-        output_ids = MODEL.generate(**inputs, max_length=50)
-        caption = PROCESSOR.decode(output_ids[0], skip_special_tokens=True)
-        return caption
+        return CAPTION_BATCHER.submit((image, cancel_token))
+    except OperationCancelled:
+        raise
     except Exception as e:
+        if raise_errors:
+            raise
         print(f"Error during caption generation: {e}")
         return "Error generating caption."
 
-# --- ADD THIS NEW FUNCTION ---
+def warm_up_caption_model(forward: bool = True) -> None:
+    """
+    Loads BLIP and, with `forward`, captions a blank image, so the first
+    request doesn't pay for paging in weights and allocating buffers.
+    """
+    load_caption_model()
+    if forward:
+        generate_captions([Image.new("RGB", (64, 64), "white")])
+
 def del_caption_model():
-    """Deletes the BLIP model from memory."""
-    global PROCESSOR, MODEL
-    if PROCESSOR is not None:
-        del PROCESSOR
-        PROCESSOR = None
-    if MODEL is not None:
-        del MODEL
-        MODEL = None
-    gc.collect()
-    print("Unloaded BLIP model from RAM.")
\ No newline at end of file
+    """Explicitly unloads the BLIP model from the registry."""
+    if REGISTRY.evict(CAPTION_MODEL_ID):
+        print("Unloaded BLIP model from RAM.")
@@ -1,72 +1,145 @@
 from PIL import Image
 import os
 import tempfile
+from typing import Optional
 
 # Import our custom functions from the other files in this module
-from .segmentation import remove_background
-from .captioning import generate_caption
+from .segmentation import remove_background, remove_backgrounds, SEGMENTATION_MODEL_ID
+from .captioning import generate_caption, CAPTION_MODEL_ID, CAPTION_PRECISION
+from adgen_studio.result_cache import RESULT_CACHE, make_key
+from adgen_studio.metrics import traced
+from adgen_studio.ingest import ImageIngestError, ingest_image
+from adgen_studio.cancellation import CancelToken, OperationCancelled, check
 
-def process_image(input_image_path: str) -> dict:
+def caption_image(
+    image: Image.Image, image_hash: str, cancel_token: Optional[CancelToken] = None, raise_errors: bool = False,
+) -> str:
+    """
+    Captions an image, reusing the cached caption for the same image bytes.
+    Raises OperationCancelled if `cancel_token` fires first. A failure
+    returns an error caption, or is raised with `raise_errors` (for callers
+    that record failures, like the catalog).
+    """
+    caption_key = make_key("caption", CAPTION_MODEL_ID, image_hash, {"max_length": 50, "precision": CAPTION_PRECISION})
+    caption = RESULT_CACHE.get(caption_key)
+    if caption is not None:
+        print(f"Caption (cached): {caption}")
+        return caption
+    print("Generating caption...")
+    try:
+        caption = generate_caption(image, cancel_token, raise_errors)
+        print(f"Caption: {caption}")
+        if not caption.startswith("Error"):
+            RESULT_CACHE.put(caption_key, caption)
+    except OperationCancelled:
+        raise
+    except Exception as e:
+        if raise_errors:
+            raise
+        print(f"Captioning failed: {e}")
+        caption = "Error generating caption."
+    return caption
+
+def segment_image(image: Image.Image, image_hash: str, cancel_token: Optional[CancelToken] = None) -> Image.Image:
+    """
+    Removes the background, reusing the cached cut-out for the same image bytes.
+
+    A single ONNX run can't be interrupted, so `cancel_token` is checked
+    before it starts and once it is done (the cut-out is still cached).
+    """
+    segmentation_key = make_key("segmentation", SEGMENTATION_MODEL_ID, image_hash)
+    segmented_image = RESULT_CACHE.get(segmentation_key)
+    if segmented_image is not None:
+        print("Background removal (cached).")
+        return segmented_image
+    check(cancel_token)
+    print("Removing background...")
+    segmented_image = remove_background(image, cancel_token=cancel_token)
+    print("Background removal complete.")
+    RESULT_CACHE.put(segmentation_key, segmented_image)
+    check(cancel_token)
+    return segmented_image
+
+def segment_images(
+    images: list[Image.Image], image_hashes: list[str], cancel_token: Optional[CancelToken] = None,
+) -> list[Image.Image]:
+    """
+    Batch form of `segment_image`: cached cut-outs are reused and the rest
+    go through the segmentation session back to back.
+    """
+    keys = [make_key("segmentation", SEGMENTATION_MODEL_ID, image_hash) for image_hash in image_hashes]
+    results = [RESULT_CACHE.get(key) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        print(f"Removing background from {len(missing)} image(s) ({len(images) - len(missing)} cached)...")
+        for i, segmented_image in zip(missing, remove_backgrounds([images[i] for i in missing], cancel_token=cancel_token)):
+            RESULT_CACHE.put(keys[i], segmented_image)
+            results[i] = segmented_image
+    return results
+
+@traced("process_image")
+def process_image(input_image_path: str, save_segmented: bool = True) -> dict:
     """
     Runs the full Sprint 1 vision pipeline on a single image.
     
     1. Opens the image.
     2. Generates a descriptive caption.
     3. Removes the background.
-    4. Saves the segmented image to a temporary file.
+    4. Saves the segmented image to a uniquely named temporary file
+       (skipped with `save_segmented=False`).
+
+    Captions and segmented images are cached by the hash of the image bytes,
+    so re-uploads of the same photo skip BLIP and rembg entirely.
     
     Args:
         input_image_path: The file path to the original product image.
+        save_segmented: Whether to also write the segmented image to disk.
 
     Returns:
-        A dictionary containing the caption and the path to the
-        newly created background-free image.
+        A dictionary containing the caption, the background-free PIL image
+        and (if saved) the path to its PNG file.
     """
     print(f"Starting full vision pipeline for: {input_image_path}")
     
     try:
-        # Open the original image
-        original_image = Image.open(input_image_path)
-    except Exception as e:
+        # Decode once, at the working resolution, for both models
+        with open(input_image_path, "rb") as f:
+            ingested = ingest_image(f.read())
+        original_image, image_hash = ingested["image"], ingested["hash"]
+    except (OSError, ImageIngestError) as e:
         print(f"Error opening image: {e}")
         return {"error": "Failed to open image."}
 
     # --- 1. Generate Caption ---
-    # We use the original image for captioning to get more context
-    print("Generating caption...")
-    try:
-        caption = generate_caption(original_image)
-        print(f"Caption: {caption}")
-    except Exception as e:
-        print(f"Captioning failed: {e}")
-        caption = "Error generating caption."
+    # BLIP sees the whole photo, background included, for more context
+    caption = caption_image(original_image, image_hash)
 
     # --- 2. Remove Background ---
-    # We use the original image for segmentation
-    print("Removing background...")
     try:
-        segmented_image = remove_background(original_image)
-        print("Background removal complete.")
+        segmented_image = segment_image(original_image, image_hash)
     except Exception as e:
         print(f"Background removal failed: {e}")
         return {"error": "Failed to remove background."}
 
     # --- 3. Save Segmented Image ---
     # Create a temporary file to save the output PNG
-    # We use a temp directory to keep our project folder clean
-    try:
-        temp_dir = tempfile.gettempdir()
-        segmented_image_name = f"segmented_{os.path.basename(input_image_path)}.png"
-        segmented_image_path = os.path.join(temp_dir, segmented_image_name)
-        
-        segmented_image.save(segmented_image_path, format="PNG")
-        print(f"Segmented image saved to: {segmented_image_path}")
-    except Exception as e:
-        print(f"Failed to save segmented image: {e}")
-        return {"error": "Failed to save segmented image."}
+    # We use a temp directory to keep our project folder clean. The name is
+    # unique, so concurrent uploads of same-named files can't overwrite each other.
+    segmented_image_path = None
+    if save_segmented:
+        try:
+            prefix = f"segmented_{os.path.basename(input_image_path)}_"
+            fd, segmented_image_path = tempfile.mkstemp(prefix=prefix, suffix=".png")
+            with os.fdopen(fd, "wb") as f:
+                segmented_image.save(f, format="PNG")
+            print(f"Segmented image saved to: {segmented_image_path}")
+        except Exception as e:
+            print(f"Failed to save segmented image: {e}")
+            return {"error": "Failed to save segmented image."}
 
     # --- 4. Return Results ---
     return {
         "caption": caption,
+        "segmented_image": segmented_image,
         "segmented_image_path": segmented_image_path
     }
\ No newline at end of file
@@ -0,0 +1,109 @@
+import importlib
+import threading
+import time
+import traceback
+from typing import Callable, Optional
+
+from .config import WARMUP_MODE, WARMUP_MODELS, WARMUP_FORWARD
+from .workers import WORKER_POOL
+
+WARMUP_MODES = ("background", "eager", "off")
+
+# --- Warm-up Steps ---
+# Model name -> (module, warm-up function). These modules pull in torch,
+# transformers, diffusers or onnxruntime, so they are imported here, by the
+# warm-up, and not when the API module is imported.
+WARMUP_STEPS = {
+    "caption": ("adgen_studio.vision_core.captioning", "warm_up_caption_model"),
+    "segmentation": ("adgen_studio.vision_core.segmentation", "warm_up_segmentation"),
+    "ad_copy": ("adgen_studio.gen_core.text_generation", "warm_up_text_gen_model"),
+    "inpainting": ("adgen_studio.gen_core.image_generation", "warm_up_inpainting_model"),
+}
+# Imported first, so the first request doesn't pay for importing them either
+WARMUP_IMPORTS = ("adgen_studio.pipeline", "adgen_studio.catalog")
+
+# --- Step States ---
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+
+class Warmup:
+    """
+    Loads models ahead of the first request, optionally running a dummy
+    forward pass through each, and tracks each step for the readiness check.
+
+    With no models there is nothing to wait for, so it is ready right away
+    (models then load on first use).
+    """
+
+    def __init__(self, models: list[str], forward: bool = True):
+        unknown = [name for name in models if name not in WARMUP_STEPS]
+        if unknown:
+            raise ValueError(f"Unknown warm-up model(s) {unknown}; expected some of {sorted(WARMUP_STEPS)}.")
+        self.models = list(models)
+        self.forward = forward
+        steps = ["imports", *self.models] if self.models else []
+        self._states = {name: {"status": PENDING, "seconds": None, "error": None} for name in steps}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def run(self) -> None:
+        """Runs every step in order on the calling thread. Failures are recorded, not raised."""
+        if not self.models:
+            return
+        self._run_step("imports", lambda: [importlib.import_module(name) for name in WARMUP_IMPORTS])
+        for name in self.models:
+            # Imported inside the step, so an import that fails is recorded as that step's failure
+            module_name, function_name = WARMUP_STEPS[name]
+            self._run_step(name, lambda: getattr(importlib.import_module(module_name), function_name)(forward=self.forward))
+
+    def start(self) -> None:
+        """Runs the warm-up on a background thread (once), so the server can answer meanwhile."""
+        with self._lock:
+            if self._thread is None and self.models:
+                self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+                self._thread.start()
+
+    def _run_step(self, name: str, step: Callable[[], object]) -> None:
+        self._update(name, status=LOADING)
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            traceback.print_exc()
+            self._update(name, status=FAILED, seconds=round(time.perf_counter() - start, 3), error=str(e))
+            print(f"Warm-up step '{name}' failed: {e}")
+            return
+        seconds = round(time.perf_counter() - start, 3)
+        self._update(name, status=READY, seconds=seconds)
+        print(f"Warm-up step '{name}' finished in {seconds:.1f}s.")
+
+    def _update(self, name: str, **fields) -> None:
+        with self._lock:
+            self._states[name].update(fields)
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            return all(state["status"] == READY for state in self._states.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            steps = {name: dict(state) for name, state in self._states.items()}
+        return {
+            "ready": all(state["status"] == READY for state in steps.values()),
+            "forward": self.forward,
+            "steps": steps,
+        }
+
+
+# --- Shared Instance ---
+if WARMUP_MODE not in WARMUP_MODES:
+    raise ValueError(f"Unknown warm-up mode '{WARMUP_MODE}'; expected one of {WARMUP_MODES}.")
+# Models hosted by worker processes are warmed up there, not in the API process
+WARMUP = Warmup(
+    [name for name in WARMUP_MODELS if not WORKER_POOL.hosts(name)] if WARMUP_MODE != "off" else [],
+    forward=WARMUP_FORWARD,
+)
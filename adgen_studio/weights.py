@@ -0,0 +1,260 @@
+import glob
+import json
+import os
+import struct
+import threading
+from typing import TYPE_CHECKING, Optional
+
+from .config import GB, MODEL_DIR, OFFLINE, MMAP_WEIGHTS
+
+if TYPE_CHECKING:
+    import torch  # Imported where it's used, so importing this module stays cheap
+
+
+class ModelNotAvailableError(RuntimeError):
+    """Raised in offline mode when a model is neither in the model dir nor in the local cache."""
+
+
+# --- Model Sources ---
+def _cached_snapshot(model_id: str) -> Optional[str]:
+    """The model's folder in the local Hugging Face cache, or None if it was never downloaded."""
+    try:
+        from huggingface_hub import snapshot_download
+        return snapshot_download(model_id, local_files_only=True)
+    except Exception:
+        return None
+
+def model_source(model_id: str) -> str:
+    """
+    Where to load `model_id` from: its folder under ADGEN_MODEL_DIR if there
+    is one (named like the id, or with "/" as "--"), otherwise the id itself
+    (resolved through the Hub, or only the local HF cache in offline mode).
+
+    Raises:
+        ModelNotAvailableError: In offline mode, when the model is in neither.
+    """
+    if MODEL_DIR:
+        for name in (model_id, model_id.replace("/", "--")):
+            path = os.path.join(MODEL_DIR, name)
+            if os.path.isdir(path):
+                return path
+    if OFFLINE and _cached_snapshot(model_id) is None:
+        raise ModelNotAvailableError(
+            f"'{model_id}' is not in ADGEN_MODEL_DIR ({MODEL_DIR or 'unset'}) or the local Hugging Face cache, "
+            "and ADGEN_OFFLINE=1 forbids downloading it."
+        )
+    return model_id
+
+def pretrained_kwargs(model_id: str) -> dict:
+    """Extra `from_pretrained` arguments: no Hub calls for local folders or in offline mode."""
+    return {"local_files_only": True} if OFFLINE or model_source(model_id) != model_id else {}
+
+def checkpoint_dir(model_id: str, subfolder: str = "") -> Optional[str]:
+    """The local folder holding the model's checkpoint files, or None if it isn't on disk."""
+    source = model_source(model_id)
+    if source == model_id:
+        source = _cached_snapshot(model_id)
+        if source is None:
+            return None
+    path = os.path.join(source, subfolder)
+    return path if os.path.isdir(path) else None
+
+
+# --- Memory-Mapped Safetensors ---
+SAFETENSORS_DTYPES = {
+    "F64": "float64", "F32": "float32", "F16": "float16", "BF16": "bfloat16",
+    "I64": "int64", "I32": "int32", "I16": "int16", "I8": "int8", "U8": "uint8", "BOOL": "bool",
+}
+
+def read_safetensors_header(path: str) -> tuple[dict, int]:
+    """The header of a safetensors file and the offset its tensor data starts at."""
+    with open(path, "rb") as f:
+        (header_length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_length))
+    header.pop("__metadata__", None)
+    return header, 8 + header_length
+
+def map_safetensors(path: str, names: Optional[set[str]] = None) -> dict[str, "torch.Tensor"]:
+    """
+    Memory-maps a safetensors file and returns its tensors (only those in
+    `names`, if given) as read-only views of the mapping (copy-on-write, so
+    nothing is ever written back). No weight bytes are copied: pages are
+    read in from the page cache on first use and shared with every other
+    process that maps the same file. Tensors that aren't aligned to their
+    dtype in the file are left out.
+    """
+    import torch
+    header, data_start = read_safetensors_header(path)
+    storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=os.path.getsize(path))
+    tensors = {}
+    for name, info in header.items():
+        if (names is not None and name not in names) or info["dtype"] not in SAFETENSORS_DTYPES:
+            continue
+        dtype = getattr(torch, SAFETENSORS_DTYPES[info["dtype"]])
+        offset = data_start + info["data_offsets"][0]
+        item_size = torch.empty(0, dtype=dtype).element_size()
+        if offset % item_size:
+            continue
+        tensor = torch.empty(0, dtype=dtype)
+        tensor.set_(storage, offset // item_size, info["shape"])
+        tensors[name] = tensor
+    return tensors
+
+def file_mappings(paths: list[str]) -> list[tuple[int, int]]:
+    """
+    Address ranges where this process already maps any of `paths`, from
+    Linux's /proc/self/maps (empty where that isn't available).
+    """
+    paths = {os.path.realpath(path) for path in paths}
+    ranges = []
+    try:
+        with open("/proc/self/maps", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                fields = line.split(maxsplit=5)
+                if len(fields) == 6 and fields[5].rstrip("\n") in paths:
+                    first, last = fields[0].split("-")
+                    ranges.append((int(first, 16), int(last, 16)))
+    except OSError:
+        pass
+    return ranges
+
+def map_weights(module: "torch.nn.Module", folder: str, remap: bool = True) -> tuple[int, int]:
+    """
+    Points the module's parameters and buffers at the memory-mapped tensors
+    of the safetensors files in `folder`, freeing their private copies.
+
+    Recent transformers and diffusers releases already load safetensors
+    weights as views of a file mapping; those tensors are counted as mapped
+    and left alone, as are the other tensors of any file the loader mapped
+    (those were converted on purpose). Of the rest, only tensors that the
+    loader kept exactly as stored (same name, shape, dtype and values) are
+    swapped; anything cast, converted, re-laid-out or quantized keeps its
+    own memory. Only tensors with a private copy are mapped and compared,
+    so no other part of the files is read. Tied weights stay tied, since the
+    shared Parameter object itself is updated. With `remap` off, only the
+    tensors the loader already mapped are counted.
+
+    This lowers steady-state memory only: the loader's private copy exists
+    until the swap, so peak memory while loading is unchanged.
+
+    Returns:
+        (bytes now mapped, bytes of parameters and buffers in total).
+    """
+    import torch
+    # Dtype variants such as "model.fp16.safetensors" are ones the loader didn't pick
+    paths = [
+        path for path in sorted(glob.glob(os.path.join(folder, "*.safetensors")))
+        if os.path.basename(path).count(".") == 1
+    ]
+    loader_mappings = file_mappings(paths)
+    mapped_bytes = total_bytes = 0
+    private = []
+    seen = set()
+    for name, tensor in [*module.named_parameters(), *module.named_buffers()]:
+        if id(tensor) in seen:
+            continue
+        seen.add(id(tensor))
+        size = tensor.numel() * tensor.element_size()
+        total_bytes += size
+        if tensor.device.type == "cpu" and any(first <= tensor.data_ptr() < last for first, last in loader_mappings):
+            mapped_bytes += size
+        else:
+            private.append((name, tensor, size))
+    if not remap or not private or not paths:
+        return mapped_bytes, total_bytes
+
+    # Stored name -> file, skipping files the loader mapped itself
+    locations = {}
+    for path in paths:
+        if not file_mappings([path]):
+            header, _ = read_safetensors_header(path)
+            locations.update(dict.fromkeys(header, path))
+    prefix = getattr(module, "base_model_prefix", "")
+    wanted: dict[str, set] = {}
+    keys = []
+    for name, tensor, size in private:
+        # Checkpoints of task models sometimes store the base model's keys without its prefix
+        candidates = [name]
+        if prefix and name.startswith(prefix + "."):
+            candidates.append(name[len(prefix) + 1:])
+        key = next((key for key in candidates if key in locations), None)
+        keys.append(key)
+        if key is not None and tensor.device.type == "cpu":
+            wanted.setdefault(locations[key], set()).add(key)
+
+    mapped: dict = {}
+    for path, names in wanted.items():
+        mapped.update(map_safetensors(path, names))
+    remapped = False
+    with torch.no_grad():
+        for (name, tensor, size), key in zip(private, keys):
+            source = mapped.get(key)
+            if (
+                source is None or source.shape != tensor.shape or source.dtype != tensor.dtype
+                or not torch.equal(source, tensor)
+            ):
+                continue
+            tensor.data = source
+            mapped_bytes += size
+            remapped = True
+    if remapped:
+        # The private copies are free now; hand their pages back
+        from .cancellation import release_memory
+        release_memory()
+    return mapped_bytes, total_bytes
+
+
+# --- Load Reports ---
+# Model id -> how its weights were loaded, for /models/stats and worker stats
+_REPORTS: dict = {}
+_REPORTS_LOCK = threading.Lock()
+
+def share_weights(model_id: str, modules: dict[str, "torch.nn.Module"], load_seconds: float) -> dict:
+    """
+    Memory-maps the weights of a freshly loaded model that the loader
+    didn't map itself (see `map_weights`) when ADGEN_MMAP_WEIGHTS is on, and
+    records a load report.
+
+    Args:
+        model_id: The model id the weights were loaded for.
+        modules: The model's modules by checkpoint subfolder ("" for the
+            model's root folder, e.g. "unet" for a diffusers pipeline).
+        load_seconds: How long `from_pretrained` took.
+
+    Returns:
+        The report: source, load time, and mapped (shared through the page
+        cache) vs. private weight bytes.
+    """
+    import time
+    start = time.perf_counter()
+    try:
+        source = model_source(model_id)
+    except ModelNotAvailableError:
+        source = None  # Built in memory rather than loaded from a checkpoint
+    mapped_bytes = total_bytes = 0
+    for subfolder, module in modules.items():
+        folder = checkpoint_dir(model_id, subfolder) if source else None
+        if folder is None:
+            total_bytes += sum(t.numel() * t.element_size() for t in [*module.parameters(), *module.buffers()])
+            continue
+        module_mapped, module_total = map_weights(module, folder, remap=MMAP_WEIGHTS)
+        mapped_bytes += module_mapped
+        total_bytes += module_total
+    if mapped_bytes:
+        print(f"{mapped_bytes / GB:.2f} of {total_bytes / GB:.2f} GB of '{model_id}' weights are memory-mapped.")
+
+    report = {
+        "source": source,
+        "offline": OFFLINE,
+        "load_seconds": round(load_seconds, 3),
+        "map_seconds": round(time.perf_counter() - start, 3),
+        "mapped_bytes": mapped_bytes,
+        "private_bytes": total_bytes - mapped_bytes,
+    }
+    with _REPORTS_LOCK:
+        _REPORTS[model_id] = report
+    return report
+
+def load_reports() -> dict:
+    with _REPORTS_LOCK:
+        return {model_id: dict(report) for model_id, report in _REPORTS.items()}
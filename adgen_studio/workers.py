@@ -0,0 +1,419 @@
+import itertools
+import multiprocessing
+import os
+import pickle
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Optional
+
+from .cancellation import CancelToken, OperationCancelled, StageTimeoutError
+from .config import WORKER_PROCESSES, WORKER_THREADS, WARMUP_FORWARD, WORKER_CANCEL_GRACE_SECONDS
+from .metrics import add_to_trace, collect_trace, process_memory
+
+# Models a worker process can host (the warm-up step names)
+MODELS = ("caption", "segmentation", "ad_copy", "inpainting")
+
+# --- Worker States ---
+STARTING = "starting"
+READY = "ready"
+FAILED = "failed"
+STOPPED = "stopped"
+
+
+class WorkerError(RuntimeError):
+    """Raised when a task can't run on, or fails inside, a worker process."""
+
+
+# --- Worker Specs ---
+def parse_cores(text: str) -> list[int]:
+    """Parses a core list like "0-3,8,10-11"."""
+    cores = []
+    for part in text.split(","):
+        part = part.strip()
+        if "-" in part:
+            first, last = part.split("-", 1)
+            cores.extend(range(int(first), int(last) + 1))
+        elif part:
+            cores.append(int(part))
+    return cores
+
+def available_cores() -> list[int]:
+    """The cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def parse_worker_specs(text: str) -> list[dict]:
+    """
+    Parses ADGEN_WORKER_PROCESSES into one `{"models", "cores"}` dict per worker.
+
+    Workers without an explicit "@cores" split the cores that no worker
+    claimed between them (sharing them if there are too few).
+    """
+    specs = []
+    for entry in text.split(";"):
+        entry = entry.strip()
+        if not entry:
+            continue
+        models_text, _, cores_text = entry.partition("@")
+        models = [name.strip() for name in models_text.split(",") if name.strip()]
+        unknown = [name for name in models if name not in MODELS]
+        if not models or unknown:
+            raise ValueError(f"Bad worker spec '{entry}'; models must be some of {MODELS}.")
+        cores = parse_cores(cores_text)
+        missing = sorted(set(cores) - set(available_cores()))
+        if missing:
+            raise ValueError(f"Bad worker spec '{entry}'; cores {missing} are not available to this process.")
+        specs.append({"models": models, "cores": cores})
+
+    unpinned = [spec for spec in specs if not spec["cores"]]
+    if unpinned:
+        claimed = {core for spec in specs for core in spec["cores"]}
+        free = [core for core in available_cores() if core not in claimed] or available_cores()
+        share = max(1, len(free) // len(unpinned))
+        for i, spec in enumerate(unpinned):
+            start = (i * share) % len(free)
+            spec["cores"] = free[start:start + share] or free[:share]
+    return specs
+
+
+# --- Worker Process ---
+def _worker_main(index: int, spec: dict, initializer: Optional[Callable[[], None]], tasks, results) -> None:
+    """Entry point of a worker process: pin, size thread pools, warm up, then serve tasks."""
+    threads = len(spec["cores"])
+    # Before torch is imported, so its thread pools are sized for this worker
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["MKL_NUM_THREADS"] = str(threads)
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, spec["cores"])
+    if initializer is not None:
+        initializer()
+
+    import torch
+    torch.set_num_threads(threads)
+
+    from .warmup import Warmup
+    warmup = Warmup(spec["models"], forward=WARMUP_FORWARD)
+    warmup.run()
+    from .weights import load_reports
+    results.put(("started", index, os.getpid(), warmup.stats(), load_reports()))
+
+    # Several tasks run at once, so the micro-batchers can fill batches
+    cancel_tokens: dict[int, list[CancelToken]] = {}  # task id -> the task's tokens
+    with ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix=f"worker-{index}") as pool:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            if task[0] == "cancel":
+                _, task_id, reason, timed_out = task
+                for token in cancel_tokens.get(task_id, ()):
+                    token.cancel(reason, timed_out)
+                continue
+            # Created here, not on the pool thread, so a cancel that arrives first still finds them
+            task_id, token_deadlines = task[0], task[5]
+            tokens = {name: _mirror_token(name, remaining) for name, remaining in token_deadlines.items()}
+            cancel_tokens[task_id] = list(tokens.values())
+            pool.submit(_run_task, task, tokens, cancel_tokens, results)
+
+def _mirror_token(name: str, remaining: Optional[float]) -> CancelToken:
+    """
+    The worker's copy of a caller's token, with `remaining` seconds left
+    (None for no deadline). A budget already spent (0.0) fires right away
+    rather than counting as no deadline.
+    """
+    token = CancelToken(remaining, name)
+    if remaining is not None and remaining <= 0:
+        token.cancel(f"'{name}' ran out of its time budget before reaching the worker.", timed_out=True)
+    return token
+
+def _run_task(task: tuple, tokens: dict, cancel_tokens: dict, results) -> None:
+    task_id, fn, args, kwargs, callback_names, _ = task
+    for name in callback_names:
+        # Callbacks (e.g. diffusion progress) are relayed to the API process
+        kwargs[name] = lambda *cb_args, name=name: results.put(("callback", task_id, name, cb_args))
+    kwargs.update(tokens)
+    try:
+        with collect_trace() as trace:
+            value = fn(*args, **kwargs)
+        # Pickled here, so an unpicklable result fails this task instead of the queue's feeder thread
+        results.put(("result", task_id, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), trace))
+    except OperationCancelled as e:
+        results.put(("cancelled", task_id, type(e), str(e)))
+    except Exception as e:
+        results.put(("error", task_id, f"{type(e).__name__}: {e}", traceback.format_exc()))
+    finally:
+        cancel_tokens.pop(task_id, None)
+
+
+# --- Supervisor ---
+class _Worker:
+    def __init__(self, index: int, spec: dict):
+        self.index = index
+        self.models = spec["models"]
+        self.cores = spec["cores"]
+        self.status = STARTING
+        self.process = None
+        self.tasks = None
+        self.in_flight = 0
+        self.completed = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.warmup: Optional[dict] = None
+        self.weights: dict = {}  # Model id -> weight load report, from the worker
+
+
+class WorkerPool:
+    """
+    Runs model stages in separate worker processes.
+
+    Each worker is pinned to its own CPU cores, sizes torch's thread pool to
+    them and keeps its own copy of the models it hosts, so a large host can
+    run e.g. one Stable Diffusion worker next to two BLIP/Gemma workers.
+    `call` routes work to the least-busy worker that hosts the model.
+    Weights memory-mapped from safetensors files are shared between workers
+    through the page cache, which their PSS in `stats` shows.
+
+    `initializer`, if set, runs first in every worker process (it must be
+    picklable, i.e. a module-level function).
+    """
+
+    def __init__(self, specs: list[dict], initializer: Optional[Callable[[], None]] = None):
+        self.specs = specs
+        self.initializer = initializer
+        self._workers = [_Worker(i, spec) for i, spec in enumerate(specs)]
+        self._pending: dict[int, tuple] = {}  # task id -> (future, callbacks, worker)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._results = None
+        self._listener: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._workers)
+
+    def hosts(self, model: str) -> bool:
+        """Whether any worker process hosts `model`."""
+        return any(model in worker.models for worker in self._workers)
+
+    def hosted_models(self) -> set:
+        return {model for worker in self._workers for model in worker.models}
+
+    def start(self) -> None:
+        """Launches the worker processes (idempotent). They warm their models up in the background."""
+        with self._lock:
+            if not self._workers or self._listener is not None:
+                return
+            # "spawn" gives each worker a fresh interpreter, so torch is
+            # initialised after pinning and no parent threads are inherited
+            context = multiprocessing.get_context("spawn")
+            self._results = context.Queue()
+            for worker in self._workers:
+                worker.tasks = context.Queue()
+                worker.process = context.Process(
+                    target=_worker_main, name=f"adgen-model-worker-{worker.index}",
+                    args=(worker.index, self.specs[worker.index], self.initializer, worker.tasks, self._results),
+                    daemon=True,
+                )
+                worker.process.start()
+                print(f"Started worker {worker.index} (pid {worker.process.pid}) for {worker.models} on cores {worker.cores}.")
+            self._listener = threading.Thread(target=self._listen, name="worker-results", daemon=True)
+            self._listener.start()
+
+    def stop(self, timeout: float = 10) -> None:
+        """Asks every worker to finish its tasks and exit, then terminates stragglers."""
+        with self._lock:
+            workers = [worker for worker in self._workers if worker.process is not None]
+        for worker in workers:
+            worker.tasks.put(None)
+        for worker in workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.status = STOPPED
+        if self._results is not None:
+            self._results.put(None)
+        self._fail_pending(lambda worker: True, "Worker pool stopped.")
+
+    def call(self, model: str, fn: Callable, args: tuple = (), kwargs: Optional[dict] = None) -> Any:
+        """
+        Runs `fn(*args, **kwargs)` on a worker that hosts `model` and returns
+        its result. Callable keyword arguments (progress callbacks) are called
+        back in this process. CancelToken keyword arguments are mirrored in
+        the worker: it gets a token with the same deadline, which fires when
+        this one is cancelled. `fn` must be a module-level function.
+        """
+        self.start()
+        kwargs = dict(kwargs or {})
+        tokens = {name: value for name, value in kwargs.items() if isinstance(value, CancelToken)}
+        callbacks = {name: value for name, value in kwargs.items() if callable(value)}
+        for name in [*tokens, *callbacks]:
+            del kwargs[name]
+        for token in tokens.values():
+            token.check()
+        future: Future = Future()
+        with self._lock:
+            candidates = [w for w in self._workers if model in w.models and w.status in (STARTING, READY)]
+            if not candidates:
+                raise WorkerError(f"No running worker process hosts '{model}'.")
+            # Prefer warmed-up workers, then the one with the least work queued
+            worker = min(candidates, key=lambda w: (w.status != READY, w.in_flight))
+            task_id = next(self._ids)
+            self._pending[task_id] = (future, callbacks, worker)
+            worker.in_flight += 1
+        worker.tasks.put((task_id, fn, args, kwargs, list(callbacks), {name: token.remaining() for name, token in tokens.items()}))
+        unregister = [
+            token.on_cancel(lambda token=token: worker.tasks.put(("cancel", task_id, token.reason, token.timed_out)))
+            for token in tokens.values()
+        ]
+        try:
+            value, trace = self._wait(task_id, future, worker, tokens)
+        finally:
+            for remove in unregister:
+                remove()
+        # Spans recorded in the worker still count towards this request's trace
+        add_to_trace(trace)
+        return value
+
+    def _wait(self, task_id: int, future: Future, worker: _Worker, tokens: dict) -> Any:
+        """
+        Waits for a task's result, never indefinitely: a dead worker is noticed
+        within a second (even while other workers keep the result queue busy),
+        and once a token fires (cancelled, or past its deadline) the worker
+        gets WORKER_CANCEL_GRACE_SECONDS to stop before the task is given up.
+        """
+        fired_at = None
+        while True:
+            try:
+                return future.result(timeout=1.0)
+            except FutureTimeoutError:
+                pass
+            if worker.process is not None and not worker.process.is_alive():
+                self._check_alive()
+                self._fail_pending(lambda w: w is worker, f"Worker {worker.index} exited unexpectedly.")
+                continue
+            fired = next((token for token in tokens.values() if token.cancelled), None)
+            if fired is None:
+                continue
+            fired_at = fired_at or time.monotonic()
+            if time.monotonic() - fired_at < WORKER_CANCEL_GRACE_SECONDS:
+                continue
+            with self._lock:
+                if self._pending.pop(task_id, None) is None:
+                    continue  # The result arrived just now
+                worker.in_flight -= 1
+                worker.cancelled += 1
+            print(f"Worker {worker.index} didn't stop a cancelled task within {WORKER_CANCEL_GRACE_SECONDS:g}s; giving up on it.")
+            raise (StageTimeoutError if fired.timed_out else OperationCancelled)(fired.reason)
+
+    def _listen(self) -> None:
+        while True:
+            try:
+                message = self._results.get(timeout=1.0)
+            except queue.Empty:
+                self._check_alive()
+                continue
+            if message is None:
+                return
+            kind = message[0]
+            if kind == "started":
+                _, index, pid, warmup, weights = message
+                with self._lock:
+                    worker = self._workers[index]
+                    worker.warmup = warmup
+                    worker.weights = weights
+                    worker.status = READY if warmup["ready"] else FAILED
+                print(f"Worker {index} (pid {pid}) is {worker.status}.")
+                if worker.status == FAILED:
+                    self._fail_pending(lambda w: w is worker, f"Worker {index} failed to load its models.")
+            elif kind == "callback":
+                _, task_id, name, cb_args = message
+                entry = self._pending.get(task_id)
+                if entry is not None:
+                    try:
+                        entry[1][name](*cb_args)
+                    except Exception as e:
+                        print(f"Worker callback '{name}' failed: {e}")
+            else:
+                task_id = message[1]
+                with self._lock:
+                    entry = self._pending.pop(task_id, None)
+                    if entry is None:
+                        continue
+                    future, _, worker = entry
+                    worker.in_flight -= 1
+                    if kind == "result":
+                        worker.completed += 1
+                    elif kind == "cancelled":
+                        worker.cancelled += 1
+                    else:
+                        worker.errors += 1
+                if kind == "result":
+                    future.set_result((pickle.loads(message[2]), message[3]))
+                elif kind == "cancelled":
+                    future.set_exception(message[2](message[3]))
+                else:
+                    print(f"Task failed in worker {worker.index}:\n{message[3]}")
+                    future.set_exception(WorkerError(message[2]))
+
+    def _check_alive(self) -> None:
+        """Fails the tasks of workers that died (e.g. killed for running out of memory)."""
+        for worker in self._workers:
+            if worker.status in (STARTING, READY) and worker.process is not None and not worker.process.is_alive():
+                worker.status = FAILED
+                print(f"Worker {worker.index} exited unexpectedly (code {worker.process.exitcode}).")
+                self._fail_pending(lambda w: w is worker, f"Worker {worker.index} exited unexpectedly.")
+
+    def _fail_pending(self, matches: Callable[[_Worker], bool], reason: str) -> None:
+        with self._lock:
+            failed = [(task_id, entry) for task_id, entry in self._pending.items() if matches(entry[2])]
+            for task_id, (_, _, worker) in failed:
+                del self._pending[task_id]
+                worker.in_flight -= 1
+                worker.errors += 1
+        for _, (future, _, _) in failed:
+            future.set_exception(WorkerError(reason))
+
+    @property
+    def ready(self) -> bool:
+        return all(worker.status == READY for worker in self._workers)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "memory": process_memory(),
+                "ready": all(worker.status == READY for worker in self._workers),
+                "workers": [
+                    {
+                        "index": worker.index,
+                        "pid": worker.process.pid if worker.process is not None else None,
+                        "models": worker.models,
+                        "cores": worker.cores,
+                        "status": worker.status,
+                        "in_flight": worker.in_flight,
+                        "completed": worker.completed,
+                        "errors": worker.errors,
+                        "cancelled": worker.cancelled,
+                        "warmup": worker.warmup,
+                        "weights": worker.weights,
+                        "memory": process_memory(worker.process.pid) if worker.process is not None else None,
+                    }
+                    for worker in self._workers
+                ],
+            }
+
+
+# --- Shared Instance ---
+WORKER_POOL = WorkerPool(parse_worker_specs(WORKER_PROCESSES))
+
+def run_on_model(model: str, fn: Callable, /, *args, **kwargs) -> Any:
+    """
+    Runs a model stage: on a worker process that hosts `model`, or in this
+    process when no worker does (including when worker processes are off).
+    """
+    if WORKER_POOL.hosts(model):
+        return WORKER_POOL.call(model, fn, args, kwargs)
+    return fn(*args, **kwargs)
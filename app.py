@@ -2,6 +2,7 @@ import streamlit as st
 import requests
 from PIL import Image
 import io
+import json
 import base64
 
 # --- Page Configuration ---
@@ -14,7 +15,8 @@ st.set_page_config(
 # --- API Configuration ---
 # This is the URL of your FastAPI backend.
 # If you are running both on your local machine, this is correct.
-BACKEND_URL = "http://127.0.0.1:8000/generate-ad-package/"
+BACKEND_URL = "http://127.0.0.1:8000"
+JOBS_URL = f"{BACKEND_URL}/jobs/"
 
 # --- Helper Function ---
 def base64_to_image(b64_string: str) -> Image.Image:
@@ -23,6 +25,21 @@ def base64_to_image(b64_string: str) -> Image.Image:
     img = Image.open(io.BytesIO(img_bytes))
     return img
 
+def stream_job_events(job_id: str):
+    """Yields (event, payload) pairs from the job's Server-Sent Events stream."""
+    with requests.get(f"{JOBS_URL}{job_id}/events", stream=True, timeout=(10, 600)) as response:
+        response.raise_for_status()
+        event, data = None, ""
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data += line[len("data:"):].strip()
+            elif line == "" and event:
+                # A blank line ends one event
+                yield event, json.loads(data or "{}")
+                event, data = None, ""
+
 # --- Main App Interface ---
 st.title("✨ AdGen Studio")
 st.header("AI-Powered Product Marketing Suite")
@@ -51,6 +68,11 @@ with st.form(key="ad_form"):
             "Enter a prompt for the new image:",
             placeholder="e.g., 'on a white marble table, next to a small plant'"
         )
+        num_variants = st.number_input("Number of scene variants:", min_value=1, max_value=8, value=1)
+        profile = st.radio(
+            "Quality:", ["preview", "baseline", "standard", "final"], index=1, horizontal=True,
+            help="A preview comes back in seconds; you can then render it at final quality.",
+        )
 
     # Submit Button
     st.divider()
@@ -63,37 +85,104 @@ if submit_button:
     elif not prompt:
         st.error("❌ Please enter a prompt for the scene.")
     else:
-        with st.spinner("🚀 AI is warming up... This will take 4-6 minutes..."):
-            try:
-                # Prepare the files and data for the POST request
-                files = {'image': (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)}
-                data = {'prompt': prompt}
-                
-                # Make the API call to your FastAPI backend
-                response = requests.post(BACKEND_URL, files=files, data=data, timeout=600) # 10 min timeout
-                
-                if response.status_code == 200:
-                    # Success!
-                    result = response.json()
-                    ad_copy = result.get("ad_copy", [])
-                    img_b64 = result.get("generated_image_b64")
+        try:
+            # Prepare the files and data for the POST request
+            files = {'image': (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)}
+            data = {'prompt': prompt, 'num_variants': int(num_variants), 'profile': profile}
+            
+            # Submit the job; the backend answers right away with a job id
+            response = requests.post(JOBS_URL, files=files, data=data, timeout=30)
+            if response.status_code == 429:
+                st.error("⏳ The server is busy right now. Please try again in a few minutes.")
+                st.stop()
+            response.raise_for_status()
+            job_id = response.json()["job_id"]
+            # Remembered across reruns, so a preview can be refined later
+            st.session_state["last_job"] = {"job_id": job_id, "profile": profile}
 
-                    st.success("✅ Your ad package is ready!")
-                    st.balloons()
-                    
-                    st.header("Generated Image")
-                    gen_image = base64_to_image(img_b64)
-                    st.image(gen_image, caption="AI-Generated Lifestyle Image", use_column_width=True)
+            # Placeholders that fill in as each stage finishes
+            status_box = st.empty()
+            status_box.info("🚀 Your job is queued...")
+            col_left, col_right = st.columns(2)
+            with col_left:
+                st.header("Generated Ad Copy")
+                caption_box = st.empty()
+                ad_copy_box = st.container()
+            with col_right:
+                st.header("Generated Images")
+                progress_bar = st.progress(0, text="Waiting for the image generator...")
+                image_box = st.empty()
+                # One grid cell per variant, filled as each image arrives
+                variant_cols = st.columns(min(int(num_variants), 2))
 
-                    st.header("Generated Ad Copy")
-                    for i, ad in enumerate(ad_copy, 1):
-                        st.markdown(f"**Variation {i}:**")
-                        st.info(ad)
+            # Stream progress events as the backend produces them
+            for event, payload in stream_job_events(job_id):
+                if event == "running":
+                    status_box.info("🧠 Analyzing your product...")
+                elif event == "caption":
+                    caption_box.caption(f"Product: *{payload['caption']}*")
+                elif event == "mask":
+                    image_box.image(base64_to_image(payload["segmented_image_b64"]), caption="Product cut-out")
+                elif event == "ad_copy_variation":
+                    # Each variation shows up as soon as Gemma finishes it
+                    with ad_copy_box:
+                        st.markdown(f"**Variation {payload['index'] + 1}:**")
+                        st.info(payload["text"])
+                elif event == "ad_copy":
+                    status_box.info("🎨 Ad copy is ready! Painting your new scene...")
+                elif event == "diffusion_step":
+                    step, total = payload["step"], payload["total"]
+                    progress_bar.progress(step / total, text=f"Diffusion step {step}/{total}")
+                elif event == "image":
+                    progress_bar.empty()
+                    image_box.empty()
+                    gen_image = base64_to_image(payload["generated_image_b64"])
+                    variant = payload.get("variant", 0)
+                    with variant_cols[variant % len(variant_cols)]:
+                        st.image(gen_image, caption=f"Variant {variant + 1} (seed {payload.get('seed')})", use_column_width=True)
+                elif event == "timings":
+                    with st.expander("⏱️ Stage timings"):
+                        st.json(payload)
+                elif event == "succeeded":
+                    status_box.success("✅ Your ad package is ready!")
+                    st.balloons()
+                elif event in ("failed", "cancelled"):
+                    # Handle pipeline errors
+                    status_box.error(f"Job {event}: {payload.get('error') or 'no details'}")
+                
+        except requests.exceptions.RequestException as e:
+            st.error(f"Connection Error: Could not connect to the backend API. Is it running?")
+            st.error(f"Details: {e}")
 
-                else:
-                    # Handle API errors
-                    st.error(f"Error from API: {response.status_code} - {response.text}")
-                    
-            except requests.exceptions.RequestException as e:
-                st.error(f"Connection Error: Could not connect to the backend API. Is it running?")
-                st.error(f"Details: {e}")
\ No newline at end of file
+# --- Preview-then-Refine ---
+# Re-renders the last preview at final quality; only the image generator runs again.
+last_job = st.session_state.get("last_job")
+if last_job and last_job["profile"] == "preview" and not submit_button:
+    st.divider()
+    if st.button("🖼️ Render the preview at final quality"):
+        try:
+            response = requests.post(f"{JOBS_URL}{last_job['job_id']}/refine", data={"profile": "final"}, timeout=30)
+            if response.status_code == 429:
+                st.error("⏳ The server is busy right now. Please try again in a few minutes.")
+                st.stop()
+            response.raise_for_status()
+            refine_id = response.json()["job_id"]
+            progress_bar = st.progress(0, text="Waiting for the image generator...")
+            refined_cols = st.columns(2)
+            for event, payload in stream_job_events(refine_id):
+                if event == "diffusion_step":
+                    step, total = payload["step"], payload["total"]
+                    progress_bar.progress(step / total, text=f"Diffusion step {step}/{total}")
+                elif event == "image":
+                    progress_bar.empty()
+                    variant = payload.get("variant", 0)
+                    with refined_cols[variant % 2]:
+                        st.image(base64_to_image(payload["generated_image_b64"]), caption=f"Variant {variant + 1} (final)", use_column_width=True)
+                elif event == "succeeded":
+                    st.success("✅ Final-quality images are ready!")
+                    st.session_state["last_job"] = {"job_id": refine_id, "profile": "final"}
+                elif event in ("failed", "cancelled"):
+                    st.error(f"Job {event}: {payload.get('error') or 'no details'}")
+        except requests.exceptions.RequestException as e:
+            st.error(f"Connection Error: Could not connect to the backend API. Is it running?")
+            st.error(f"Details: {e}")
@@ -0,0 +1,201 @@
+"""
+Quality-vs-speed check for the reduced-precision inference modes.
+
+Runs the same captions, ad copy and inpainting (fixed inputs and seeds) once
+per precision, each in a fresh process so load time and peak RSS are measured
+cleanly, and compares every mode against fp32:
+
+* caption and ad-copy similarity (difflib ratio, 1.0 = identical text),
+* image difference (mean absolute pixel error and PSNR),
+* per-stage speedup, model load time and peak RSS.
+
+By default it uses the tiny stand-in models, which checks that every mode
+runs end-to-end; pass `--real` to measure the production checkpoints.
+
+Usage:
+    python -m benchmarks.precision_check --precisions fp32,bf16,int8 --output precision.json
+"""
+import argparse
+import difflib
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Fixed inputs, so the only difference between runs is the precision
+AD_COPY_CAPTIONS = ["a white coffee mug on a table", "a black shoe", "a bottle of coffee"]
+SEED = 1234
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare fp32, bf16 and int8 inference quality and speed.")
+    parser.add_argument("--precisions", default="fp32,bf16,int8", help="Comma-separated modes; fp32 is the reference.")
+    parser.add_argument("--images", type=int, default=2, help="Synthetic product photos to caption and inpaint.")
+    parser.add_argument("--image-size", type=int, default=256, help="Side of the synthetic product photos.")
+    parser.add_argument("--real", action="store_true", help="Use the real checkpoints instead of the stand-ins.")
+    parser.add_argument("--output", default="precision_output.json", help="Where to write the JSON results.")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+# --- Worker (one process per precision) ---
+def run_worker(args) -> None:
+    """Runs every model once at the precision set in the environment and saves the outputs."""
+    import torch
+    from benchmarks.run_benchmark import make_product_photo
+    if not args.real:
+        from benchmarks.standins import install_standins
+        install_standins()
+    from PIL import Image
+    import io
+    from adgen_studio.metrics import peak_rss_bytes
+    from adgen_studio.vision_core.captioning import generate_captions, load_caption_model
+    from adgen_studio.vision_core.segmentation import remove_background
+    from adgen_studio.gen_core.text_generation import generate_ad_copy_batch, load_text_gen_model
+    from adgen_studio.gen_core.image_generation import (
+        create_mask_and_image, generate_new_images, load_inpainting_model,
+    )
+
+    out_dir = os.path.join(args.workdir, args.worker)
+    os.makedirs(out_dir, exist_ok=True)
+    photos = [Image.open(io.BytesIO(make_product_photo(i, args.image_size))) for i in range(args.images)]
+    timings = {}
+
+    def timed(name, fn, *fn_args, **fn_kwargs):
+        start = time.perf_counter()
+        value = fn(*fn_args, **fn_kwargs)
+        timings[name] = round(time.perf_counter() - start, 4)
+        return value
+
+    timed("load_caption_model", load_caption_model)
+    timed("load_text_gen_model", load_text_gen_model)
+    timed("load_inpainting_model", load_inpainting_model)
+
+    captions = timed("caption", generate_captions, photos)
+    torch.manual_seed(SEED)  # Same sampling noise for every precision
+    ad_copy = timed("ad_copy", generate_ad_copy_batch, AD_COPY_CAPTIONS)
+
+    start = time.perf_counter()
+    image_paths = []
+    for index, photo in enumerate(photos):
+        base_image, mask_image = create_mask_and_image(remove_background(photo))
+        images, _ = generate_new_images(base_image, mask_image, "on a wooden table", seeds=[SEED])
+        path = os.path.join(out_dir, f"image_{index}.png")
+        images[0].save(path, format="PNG")
+        image_paths.append(path)
+    timings["inpainting"] = round(time.perf_counter() - start, 4)
+
+    with open(os.path.join(out_dir, "outputs.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "captions": captions,
+            "ad_copy": ad_copy,
+            "image_paths": image_paths,
+            "timings": timings,
+            "peak_rss_bytes": peak_rss_bytes(),
+        }, f, indent=2)
+
+
+# --- Comparison ---
+def text_similarity(a: list, b: list) -> float:
+    ratios = [difflib.SequenceMatcher(None, str(x), str(y)).ratio() for x, y in zip(a, b)]
+    return round(sum(ratios) / len(ratios), 4) if ratios else 1.0
+
+
+def image_difference(paths_a: list, paths_b: list) -> dict:
+    import numpy as np
+    from PIL import Image
+    errors = []
+    for path_a, path_b in zip(paths_a, paths_b):
+        a = np.asarray(Image.open(path_a).convert("RGB"), dtype=np.float64)
+        b = np.asarray(Image.open(path_b).convert("RGB"), dtype=np.float64)
+        errors.append((np.abs(a - b).mean(), ((a - b) ** 2).mean()))
+    mean_abs = sum(e[0] for e in errors) / len(errors)
+    mse = sum(e[1] for e in errors) / len(errors)
+    psnr = float("inf") if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+    return {"mean_abs_error": round(mean_abs, 3), "psnr_db": round(psnr, 2) if mse else None}
+
+
+def compare(reference: dict, candidate: dict) -> dict:
+    speedup = {
+        stage: round(reference["timings"][stage] / seconds, 3) if seconds else None
+        for stage, seconds in candidate["timings"].items()
+    }
+    return {
+        "caption_similarity": text_similarity(reference["captions"], candidate["captions"]),
+        "ad_copy_similarity": text_similarity(
+            [" ".join(v) for v in reference["ad_copy"]], [" ".join(v) for v in candidate["ad_copy"]],
+        ),
+        "image_difference": image_difference(reference["image_paths"], candidate["image_paths"]),
+        "speedup_vs_fp32": speedup,
+    }
+
+
+def main():
+    args = parse_args()
+    if args.worker:
+        run_worker(args)
+        return 0
+
+    precisions = [p.strip() for p in args.precisions.split(",") if p.strip()]
+    if "fp32" not in precisions:
+        precisions.insert(0, "fp32")
+    workdir = tempfile.mkdtemp(prefix="adgen_precision_")
+
+    runs = {}
+    for precision in precisions:
+        print(f"Running models at {precision}...")
+        env = dict(os.environ)
+        for model in ("CAPTION", "TEXT_GEN", "INPAINTING"):
+            env[f"ADGEN_{model}_PRECISION"] = precision
+        env["ADGEN_RESULT_CACHE"] = "0"
+        command = [
+            sys.executable, "-m", "benchmarks.precision_check", "--worker", precision, "--workdir", workdir,
+            "--images", str(args.images), "--image-size", str(args.image_size),
+        ] + (["--real"] if args.real else [])
+        completed = subprocess.run(command, env=env, capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(completed.stdout[-2000:], completed.stderr[-2000:])
+            print(f"Error: the {precision} run failed.")
+            return 1
+        with open(os.path.join(workdir, precision, "outputs.json"), encoding="utf-8") as f:
+            runs[precision] = json.load(f)
+
+    results = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("worker", "workdir")},
+        "runs": {
+            precision: {"timings": run["timings"], "peak_rss_bytes": run["peak_rss_bytes"]}
+            for precision, run in runs.items()
+        },
+        "quality_vs_fp32": {
+            precision: compare(runs["fp32"], run) for precision, run in runs.items() if precision != "fp32"
+        },
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    print("\n--- PRECISION CHECK ---")
+    for precision, run in runs.items():
+        timings = run["timings"]
+        line = (
+            f"{precision:<5} caption {timings['caption']:.3f}s  ad_copy {timings['ad_copy']:.3f}s  "
+            f"inpainting {timings['inpainting']:.3f}s  peak RSS {run['peak_rss_bytes'] / 2 ** 20:.0f} MB"
+        )
+        quality = results["quality_vs_fp32"].get(precision)
+        if quality:
+            line += (
+                f"  | caption sim {quality['caption_similarity']:.2f}"
+                f"  copy sim {quality['ad_copy_similarity']:.2f}"
+                f"  image MAE {quality['image_difference']['mean_abs_error']:.1f}"
+            )
+        print(line)
+    print(f"Results written to: {args.output}")
+    print("-----------------------")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""
+Offline benchmark for the full ad-package pipeline.
+
+Swaps in tiny stand-in models (see `standins.py`) and drives the real API app
+in-process, so it measures the orchestration code (job queue, batching,
+stage graph, caching, encoding) without checkpoints or network access.
+With --model-dir, the stand-ins are saved there as safetensors checkpoints
+and loaded offline through the real loaders instead, so weight loading,
+memory-mapping and per-worker RSS/PSS are measured too.
+
+Usage:
+    python -m benchmarks.run_benchmark --clients 4 --requests 8 --output bench.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the AdGen pipeline with tiny stand-in models.")
+    parser.add_argument("--clients", type=int, default=4, help="Concurrent clients.")
+    parser.add_argument("--requests", type=int, default=8, help="Total requests across all clients.")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed requests run first (model loading).")
+    parser.add_argument("--workers", type=int, default=None, help="Job worker threads (default: --clients).")
+    parser.add_argument("--variants", type=int, default=1, help="Scene variants per request.")
+    parser.add_argument("--image-size", type=int, default=640, help="Side of the synthetic product photos.")
+    parser.add_argument("--processes", default="", help="Model worker processes, as in ADGEN_WORKER_PROCESSES.")
+    parser.add_argument("--cache", action="store_true", help="Keep the result cache on (off by default).")
+    parser.add_argument(
+        "--model-dir", default="",
+        help="Save the stand-ins here and load them offline with the real loaders (as ADGEN_MODEL_DIR).",
+    )
+    parser.add_argument("--output", default="bench_output.json", help="Where to write the JSON results.")
+    return parser.parse_args()
+
+
+def configure_environment(args) -> None:
+    """Settings must be in the environment before `adgen_studio` is imported."""
+    os.environ["ADGEN_JOB_WORKERS"] = str(args.workers or args.clients)
+    os.environ["ADGEN_JOB_QUEUE_SIZE"] = str(max(16, args.requests))
+    if not args.cache:
+        os.environ["ADGEN_RESULT_CACHE"] = "0"
+    if args.processes:
+        os.environ["ADGEN_WORKER_PROCESSES"] = args.processes
+    if args.model_dir:
+        os.environ["ADGEN_MODEL_DIR"] = args.model_dir
+        os.environ["ADGEN_OFFLINE"] = "1"
+    # Load the stand-ins before serving, so model loading isn't timed
+    os.environ.setdefault("ADGEN_WARMUP", "eager")
+
+
+def make_product_photo(index: int, size: int) -> bytes:
+    """A synthetic, unique product photo, so no two requests share cache keys."""
+    from PIL import Image, ImageDraw
+    image = Image.new("RGB", (size, size), (240 - index % 50, 235, 230))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((size // 3, size // 4, 2 * size // 3, 3 * size // 4), fill=(30 + index % 200, 90, 160))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(values: list) -> dict:
+    return {
+        "count": len(values),
+        "mean": round(statistics.fmean(values), 4) if values else 0.0,
+        "p50": round(percentile(values, 50), 4),
+        "p95": round(percentile(values, 95), 4),
+        "max": round(max(values), 4) if values else 0.0,
+    }
+
+
+def main():
+    args = parse_args()
+    configure_environment(args)
+
+    from fastapi.testclient import TestClient
+    from benchmarks.standins import export_standins, install_segmentation_stub, install_standins
+    from adgen_studio.metrics import peak_rss_bytes, process_memory
+    import main as api
+
+    install = install_standins
+    if args.model_dir:
+        if not os.path.isdir(args.model_dir):
+            export_standins(args.model_dir)
+        install = install_segmentation_stub
+    install()
+    # Worker processes are fresh interpreters, so they need the stand-ins too
+    api.WORKER_POOL.initializer = install
+
+    latencies = []
+    stage_timings: dict = {}
+    errors = []
+    lock = threading.Lock()
+
+    def one_request(client, index: int, record: bool) -> None:
+        files = {"image": (f"product-{index}.jpg", make_product_photo(index, args.image_size), "image/jpeg")}
+        start = time.perf_counter()
+        data = {"prompt": "on a wooden table", "num_variants": str(args.variants)}
+        response = client.post("/generate-ad-package/", data=data, files=files)
+        elapsed = time.perf_counter() - start
+        if not record:
+            return
+        with lock:
+            if response.status_code != 200:
+                errors.append(f"{response.status_code}: {response.text[:200]}")
+                return
+            latencies.append(elapsed)
+            for stage, seconds in response.json().get("timings", {}).items():
+                stage_timings.setdefault(stage, []).append(seconds)
+
+    with TestClient(api.app) as client:
+        print(f"Warming up with {args.warmup} request(s)...")
+        for i in range(args.warmup):
+            one_request(client, -1 - i, record=False)
+
+        print(f"Running {args.requests} request(s) from {args.clients} concurrent client(s)...")
+        counter = iter(range(args.requests))
+        counter_lock = threading.Lock()
+
+        def client_loop():
+            while True:
+                with counter_lock:
+                    index = next(counter, None)
+                if index is None:
+                    return
+                one_request(client, index, record=True)
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=client_loop) for _ in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_seconds = time.perf_counter() - start
+        # While the worker processes are still up, for their memory
+        workers = api.WORKER_POOL.stats()
+
+    import torch
+    results = {
+        "config": vars(args),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "torch": torch.__version__,
+            "torch_threads": torch.get_num_threads(),
+            "cpu_count": os.cpu_count(),
+        },
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_rps": round(len(latencies) / wall_seconds, 4) if wall_seconds else 0.0,
+        "end_to_end_seconds": summarize(latencies),
+        "stage_seconds": {stage: summarize(values) for stage, values in sorted(stage_timings.items())},
+        "peak_rss_bytes": peak_rss_bytes(),
+        "memory": process_memory(),
+        "weights": api.load_reports(),
+        "warmup": api.WARMUP.stats(),
+        "workers": workers,
+        "errors": errors,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    print("\n--- BENCHMARK RESULT ---")
+    print(f"Throughput: {results['throughput_rps']} req/s over {results['wall_seconds']}s")
+    print(f"End-to-end p50/p95: {results['end_to_end_seconds']['p50']}s / {results['end_to_end_seconds']['p95']}s")
+    for stage, summary in results["stage_seconds"].items():
+        print(f"  {stage:<14} mean {summary['mean']:.3f}s  p95 {summary['p95']:.3f}s")
+    processes = [("api", results["memory"])] + [(f"worker {w['index']}", w["memory"]) for w in results["workers"]["workers"]]
+    for process, memory in processes:
+        if memory is not None:
+            print(f"  {process:<14} RSS {memory['rss_bytes'] / 2**20:.0f} MB  PSS {memory['pss_bytes'] / 2**20:.0f} MB")
+    print(f"Results written to: {args.output}")
+    print("------------------------")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
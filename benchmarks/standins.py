@@ -0,0 +1,199 @@
+"""
+Tiny, randomly initialised stand-ins for the production models.
+
+They have the same classes and call signatures as BLIP, SD 1.5 inpainting and
+Gemma, so the real orchestration code runs end-to-end, offline, on CPU in
+seconds. Their outputs are noise: use them to benchmark the pipeline around
+the models, not model quality.
+"""
+import io
+import json
+import os
+import string
+import tempfile
+
+import numpy as np
+import torch
+from PIL import Image, ImageDraw
+
+SEED = 0
+
+# Every token the stand-in tokenizers know about
+_WORDS = [
+    "a", "an", "the", "white", "black", "cup", "mug", "bottle", "shoe", "on",
+    "table", "of", "coffee", "wooden", "product", "is", "great", "new", "your",
+    "Variation", ":", ".", ",", '"', "!",
+]
+
+
+def _tmpdir() -> str:
+    return tempfile.mkdtemp(prefix="adgen_standins_")
+
+
+def build_blip() -> tuple:
+    """A BLIP captioning (processor, model) pair with a ~100-token vocabulary."""
+    from transformers import (
+        BertTokenizer, BlipConfig, BlipForConditionalGeneration,
+        BlipImageProcessor, BlipProcessor,
+    )
+    torch.manual_seed(SEED)
+    vocab_path = os.path.join(_tmpdir(), "vocab.txt")
+    special = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+    with open(vocab_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(dict.fromkeys(special + [w.lower() for w in _WORDS] + list(string.ascii_lowercase))))
+    tokenizer = BertTokenizer(vocab_path)
+    processor = BlipProcessor(
+        image_processor=BlipImageProcessor(size={"height": 64, "width": 64}),
+        tokenizer=tokenizer,
+    )
+    config = BlipConfig(
+        text_config=dict(
+            vocab_size=len(tokenizer), hidden_size=32, num_hidden_layers=1,
+            num_attention_heads=2, intermediate_size=64, max_position_embeddings=64,
+            bos_token_id=tokenizer.cls_token_id, sep_token_id=tokenizer.sep_token_id,
+            pad_token_id=tokenizer.pad_token_id, eos_token_id=tokenizer.sep_token_id,
+        ),
+        vision_config=dict(
+            hidden_size=32, num_hidden_layers=1, num_attention_heads=2,
+            intermediate_size=64, image_size=64, patch_size=16,
+        ),
+    )
+    model = BlipForConditionalGeneration(config).eval()
+    return processor, model
+
+
+def build_sd_inpainting():
+    """An SD-1.5-shaped inpainting pipeline (9-channel UNet, 8x VAE) with tiny widths."""
+    from transformers import CLIPTextConfig, CLIPTextModel, CLIPTokenizer
+    from diffusers import (
+        AutoencoderKL, PNDMScheduler, StableDiffusionInpaintPipeline, UNet2DConditionModel,
+    )
+    torch.manual_seed(SEED)
+    workdir = _tmpdir()
+    chars = string.ascii_lowercase + string.digits + ",."
+    tokens = ["<|startoftext|>", "<|endoftext|>"] + list(chars) + [c + "</w>" for c in chars]
+    with open(os.path.join(workdir, "vocab.json"), "w", encoding="utf-8") as f:
+        json.dump({t: i for i, t in enumerate(tokens)}, f)
+    with open(os.path.join(workdir, "merges.txt"), "w", encoding="utf-8") as f:
+        f.write("#version: 0.2\n")
+    tokenizer = CLIPTokenizer(
+        os.path.join(workdir, "vocab.json"), os.path.join(workdir, "merges.txt"), model_max_length=77,
+    )
+    text_encoder = CLIPTextModel(CLIPTextConfig(
+        vocab_size=len(tokens), hidden_size=32, intermediate_size=64, num_hidden_layers=1,
+        num_attention_heads=2, max_position_embeddings=77, projection_dim=32,
+        bos_token_id=0, eos_token_id=1, pad_token_id=1,
+    )).eval()
+    vae = AutoencoderKL(
+        in_channels=3, out_channels=3, latent_channels=4,
+        down_block_types=("DownEncoderBlock2D",) * 4, up_block_types=("UpDecoderBlock2D",) * 4,
+        block_out_channels=(8, 8, 8, 8), layers_per_block=1, norm_num_groups=4, sample_size=512,
+    ).eval()
+    unet = UNet2DConditionModel(
+        sample_size=64, in_channels=9, out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        block_out_channels=(16, 32), layers_per_block=1, cross_attention_dim=32,
+        norm_num_groups=8, attention_head_dim=4,
+    ).eval()
+    pipe = StableDiffusionInpaintPipeline(
+        vae=vae, text_encoder=text_encoder, tokenizer=tokenizer, unet=unet,
+        scheduler=PNDMScheduler(skip_prk_steps=True, steps_offset=1),
+        safety_checker=None, feature_extractor=None, requires_safety_checker=False,
+    )
+    pipe.set_progress_bar_config(disable=True)
+    return pipe
+
+
+def build_gemma():
+    """A 2-layer Gemma causal LM behind a text-generation pipeline, with a word-level tokenizer."""
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import GemmaConfig, GemmaForCausalLM, PreTrainedTokenizerFast, pipeline
+    torch.manual_seed(SEED)
+    special = ["<pad>", "<eos>", "<bos>", "<unk>", "<start_of_turn>", "<end_of_turn>"]
+    vocab = {w: i for i, w in enumerate(dict.fromkeys(special + _WORDS + list(string.ascii_letters + string.digits)))}
+    backend = Tokenizer(models.WordLevel(vocab=vocab, unk_token="<unk>"))
+    backend.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=backend, bos_token="<bos>", eos_token="<eos>",
+        pad_token="<pad>", unk_token="<unk>",
+        additional_special_tokens=["<start_of_turn>", "<end_of_turn>"],
+    )
+    config = GemmaConfig(
+        vocab_size=len(vocab), hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+        num_attention_heads=4, num_key_value_heads=1, head_dim=16, max_position_embeddings=512,
+        bos_token_id=tokenizer.bos_token_id, eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+    )
+    model = GemmaForCausalLM(config).eval()
+    return pipeline("text-generation", model=model, tokenizer=tokenizer)
+
+
+def stub_remove(data, *args, **kwargs):
+    """
+    Stands in for `rembg.remove`: keeps a centred ellipse as the "product".
+    Accepts and returns the same input types as rembg (bytes, PIL or ndarray).
+    """
+    if isinstance(data, bytes):
+        image = Image.open(io.BytesIO(data))
+    elif isinstance(data, np.ndarray):
+        image = Image.fromarray(data)
+    else:
+        image = data
+    image = image.convert("RGBA")
+    alpha = Image.new("L", image.size, 0)
+    w, h = image.size
+    ImageDraw.Draw(alpha).ellipse((w // 4, h // 4, 3 * w // 4, 3 * h // 4), fill=255)
+    image.putalpha(alpha)
+
+    if isinstance(data, bytes):
+        out = io.BytesIO()
+        image.save(out, format="PNG")
+        return out.getvalue()
+    if isinstance(data, np.ndarray):
+        return np.asarray(image)
+    return image
+
+
+def stub_new_session(model_name: str = "u2net", *args, **kwargs):
+    """Stands in for `rembg.new_session`; `stub_remove` ignores the session."""
+    return {"model_name": model_name}
+
+
+def install_segmentation_stub() -> None:
+    """Replaces rembg (sessions and `remove`) with the stub; the model loaders stay real."""
+    from adgen_studio.vision_core import segmentation
+    segmentation.remove = stub_remove
+    segmentation.new_session = stub_new_session
+
+
+def install_standins() -> None:
+    """
+    Points every model loader at its stand-in and replaces rembg (sessions and
+    `remove`) with the stub.
+    Call this before the first request; the real models are never touched.
+    """
+    from adgen_studio.vision_core import captioning
+    from adgen_studio.gen_core import image_generation, text_generation
+
+    captioning._load_blip = build_blip
+    image_generation._load_sd_inpainting = build_sd_inpainting
+    text_generation._load_gemma = build_gemma
+    install_segmentation_stub()
+
+
+def export_standins(model_dir: str) -> None:
+    """
+    Saves the stand-ins as safetensors checkpoints under their production
+    model ids in `model_dir`, so the real loaders can load them offline from
+    ADGEN_MODEL_DIR (and memory-map their weights).
+    """
+    from adgen_studio.vision_core.captioning import CAPTION_MODEL_ID
+    from adgen_studio.gen_core.image_generation import INPAINTING_MODEL_ID
+    from adgen_studio.gen_core.text_generation import TEXT_GEN_MODEL_ID
+
+    processor, model = build_blip()
+    processor.save_pretrained(os.path.join(model_dir, CAPTION_MODEL_ID))
+    model.save_pretrained(os.path.join(model_dir, CAPTION_MODEL_ID))
+    build_sd_inpainting().save_pretrained(os.path.join(model_dir, INPAINTING_MODEL_ID))
+    build_gemma().save_pretrained(os.path.join(model_dir, TEXT_GEN_MODEL_ID))
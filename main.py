@@ -1,123 +1,705 @@
 import uvicorn
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Depends, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+from typing import Optional
+import asyncio
 import base64
-import io
-import os
-import tempfile
-import shutil
+import json
+import time
+import weakref
 from PIL import Image
-import gc # <-- IMPORT GC
 
 # --- Import Your AI Modules ---
-# Import the main functions AND the new delete functions
-from adgen_studio.vision_core.main import process_image
-from adgen_studio.vision_core.captioning import del_caption_model # <-- IMPORT DEL
-from adgen_studio.gen_core.image_generation import create_mask_and_image, generate_new_image, del_inpainting_model # <-- IMPORT DEL
-from adgen_studio.gen_core.text_generation import generate_ad_copy, del_text_gen_model # <-- IMPORT DEL
+# Models are kept resident in the shared registry between requests; it evicts
+# the least-recently-used model only when the RAM budget would be exceeded.
+# Only lightweight modules are imported here. The pipeline and catalog pull in
+# torch, transformers, diffusers and onnxruntime, so they are imported by the
+# warm-up or by the first job, and health checks answer within a second.
+from adgen_studio.config import (
+    JOB_WORKERS, JOB_QUEUE_SIZE, JOB_RESULT_TTL_SECONDS, JOB_MAX_FINISHED, TIMING_HEADER, MAX_VARIANTS,
+    MAX_OUTPUT_SIZE, RESULT_IMAGE_FORMAT, RESULT_IMAGE_QUALITY, WARMUP_MODE, CATALOG_ROOT, CATALOG_JOB_WORKERS,
+    CATALOG_QUEUE_SIZE,
+)
+from adgen_studio.metrics import collect_trace, process_memory, render_prometheus, server_timing_header, span, traced
+from adgen_studio.encoding import (
+    IMAGE_FORMATS, RESPONSE_KINDS, build_multipart, encode_image, make_thumbnail, negotiate, resolve_format,
+)
+from adgen_studio.ingest import MAX_UPLOAD_BYTES, UploadLimitMiddleware
+from adgen_studio.model_registry import REGISTRY
+from adgen_studio.result_cache import RESULT_CACHE
+from adgen_studio.jobs import JobQueue, QueueFullError, SUCCEEDED, FAILED, CANCELLED, FINISHED_STATES
+from adgen_studio.cancellation import StageTimeoutError
+from adgen_studio.warmup import WARMUP
+from adgen_studio.workers import WORKER_POOL
+from adgen_studio.weights import load_reports
+from adgen_studio.gen_core.speed_profiles import SPEED_PROFILES
+from adgen_studio.gen_core.prompt_embeddings import PROMPT_EMBEDDINGS
+from adgen_studio.vision_core.captioning import CAPTION_BATCHER
+from adgen_studio.gen_core.text_generation import TEXT_GEN_BATCHER, AD_COPY_TEMPLATES
+from adgen_studio.gen_core.prefix_cache import PROMPT_PREFIXES
+
+# --- Startup ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Starts the model worker processes (ADGEN_WORKER_PROCESSES), then warms the
+    models up according to ADGEN_WARMUP: "eager" finishes before the server
+    accepts requests, "background" runs alongside it (see /ready).
+    """
+    WORKER_POOL.start()
+    if WARMUP_MODE == "eager":
+        await asyncio.to_thread(WARMUP.run)
+        while readiness()["status"] == "loading":
+            await asyncio.sleep(0.1)
+    elif WARMUP_MODE == "background":
+        WARMUP.start()
+    yield
+    await asyncio.to_thread(WORKER_POOL.stop)
 
 # --- Initialize FastAPI App ---
-app = FastAPI(title="AdGen Studio API")
+app = FastAPI(title="AdGen Studio API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], allow_credentials=True,
     allow_methods=["*"], allow_headers=["*"],
 )
+# Oversized uploads get a 413 while they stream in, before they are spooled to disk
+app.add_middleware(UploadLimitMiddleware, max_bytes=MAX_UPLOAD_BYTES)
+
+# --- Job Queue ---
+def release_job_images(job) -> None:
+    """
+    Drops the images from a finished job's progress events, and their cached
+    encodings. The result already holds the final images, so a retained job
+    doesn't also keep every preview and scene for the whole result TTL.
+    Clients still streaming the job get those events without the image.
+    """
+    for index, event in enumerate(job.events):
+        if any(isinstance(value, Image.Image) for value in event["data"].values()):
+            data = {key: value for key, value in event["data"].items() if not isinstance(value, Image.Image)}
+            job.events[index] = {**event, "data": data}
+    _ENCODED_EVENTS.pop(job, None)
+
+# The pipeline is minutes of blocking torch work, so it runs on a bounded pool
+# of worker threads instead of the event loop.
+JOBS = JobQueue(
+    num_workers=JOB_WORKERS,
+    max_queued=JOB_QUEUE_SIZE,
+    result_ttl_seconds=JOB_RESULT_TTL_SECONDS,
+    max_finished=JOB_MAX_FINISHED,
+    on_job_finished=release_job_images,
+)
+# Catalog runs can take hours, so they get their own workers and never hold
+# up interactive jobs.
+CATALOG_JOBS = JobQueue(
+    num_workers=CATALOG_JOB_WORKERS,
+    max_queued=CATALOG_QUEUE_SIZE,
+    result_ttl_seconds=JOB_RESULT_TTL_SECONDS,
+    name="adgen-catalog-worker",
+    max_finished=JOB_MAX_FINISHED,
+    on_job_finished=release_job_images,
+)
+
+def find_job(job_id: str):
+    """The job with this id from either queue, and the queue it is on (None, None if unknown)."""
+    for jobs in (JOBS, CATALOG_JOBS):
+        job = jobs.get(job_id)
+        if job is not None:
+            return job, jobs
+    return None, None
 
-def image_to_base64(image: Image.Image) -> str:
-    """Converts a PIL Image to a Base64 encoded string."""
-    buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
+# --- Job Functions ---
+# Import the pipeline on the worker thread, so a job that arrives before the
+# warm-up has imported it never blocks the event loop.
+def ad_package_job(*args, **kwargs):
+    from adgen_studio.pipeline import run_ad_package
+    return run_ad_package(*args, **kwargs)
+
+def refine_package_job(*args, **kwargs):
+    from adgen_studio.pipeline import refine_ad_package
+    return refine_ad_package(*args, **kwargs)
+
+def catalog_job(*args, **kwargs):
+    from adgen_studio.catalog import run_catalog
+    return run_catalog(*args, **kwargs)
+
+@traced("image_to_base64")
+def image_to_base64(image: Image.Image, image_format: str = "png", **options) -> str:
+    """Converts a PIL Image to a Base64 encoded string (PNG unless `image_format` says otherwise)."""
+    image_bytes = encode_image(image, image_format, **options)
+    with span("base64_encode"):
+        img_str = base64.b64encode(image_bytes).decode("utf-8")
     return img_str
 
-# --- Main API Endpoint ---
+def parse_int_list(value: Optional[str], field: str = "seeds") -> Optional[list[int]]:
+    """Parses a comma-separated integer list form field, e.g. "1,2,3"."""
+    if not value:
+        return None
+    try:
+        return [int(item) for item in value.split(",") if item.strip()]
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"{field} must be a comma-separated list of integers.")
+
+def check_profile(profile: Optional[str]) -> None:
+    if profile is not None and profile not in SPEED_PROFILES:
+        raise HTTPException(status_code=422, detail=f"profile must be one of {sorted(SPEED_PROFILES)}.")
+
+def check_copy_template(copy_template: Optional[str]) -> None:
+    if copy_template is not None and copy_template not in AD_COPY_TEMPLATES:
+        raise HTTPException(status_code=422, detail=f"copy_template must be one of {sorted(AD_COPY_TEMPLATES)}.")
+
+def check_output_size(output_size: Optional[int]) -> None:
+    if output_size is not None and not 0 <= output_size <= MAX_OUTPUT_SIZE:
+        raise HTTPException(status_code=422, detail=f"output_size must be between 0 and {MAX_OUTPUT_SIZE}.")
+
+async def submit_ad_package_job(
+    prompt: str, image: UploadFile, num_variants: int = 1,
+    seeds: Optional[str] = None, profile: Optional[str] = None, copy_template: Optional[str] = None,
+    output_size: Optional[int] = None,
+):
+    """Reads the upload into memory and queues the pipeline for it."""
+    if not 1 <= num_variants <= MAX_VARIANTS:
+        raise HTTPException(status_code=422, detail=f"num_variants must be between 1 and {MAX_VARIANTS}.")
+    check_profile(profile)
+    check_copy_template(copy_template)
+    check_output_size(output_size)
+    seed_list = parse_int_list(seeds)
+    image_bytes = await image.read()
+    try:
+        return JOBS.submit(
+            ad_package_job, image_bytes, prompt,
+            num_variants=num_variants, seeds=seed_list, profile=profile, copy_template=copy_template,
+            output_size=output_size,
+        )
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+# --- Result Formats ---
+# Compression level ranges: PNG zlib level, WebP encoder effort
+COMPRESSION_RANGES = {"png": (0, 9), "webp": (0, 6)}
+
+def result_format_options(
+    response: Optional[str] = None,
+    image_format: Optional[str] = None,
+    quality: int = RESULT_IMAGE_QUALITY,
+    compression: Optional[int] = None,
+    thumbnail: Optional[int] = None,
+    variant: int = 0,
+    accept: Optional[str] = Header(None),
+) -> dict:
+    """
+    Resolves how a result is returned, from query parameters or the Accept header.
+
+    `response` ("json", "multipart" or "raw") and `image_format` ("png",
+    "webp" or "jpeg") override what the Accept header asks for. JSON keeps
+    PNG by default; binary responses default to ADGEN_RESULT_IMAGE_FORMAT.
+    """
+    kind, accepted_format = negotiate(accept, RESULT_IMAGE_FORMAT)
+    if response is not None:
+        if response not in RESPONSE_KINDS:
+            raise HTTPException(status_code=422, detail=f"response must be one of {list(RESPONSE_KINDS)}.")
+        kind = response
+    try:
+        image_format = resolve_format(image_format or accepted_format or ("png" if kind == "json" else RESULT_IMAGE_FORMAT))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if not 1 <= quality <= 100:
+        raise HTTPException(status_code=422, detail="quality must be between 1 and 100.")
+    if compression is not None:
+        low, high = COMPRESSION_RANGES.get(image_format, (None, None))
+        if low is None:
+            raise HTTPException(status_code=422, detail=f"compression does not apply to {image_format}.")
+        if not low <= compression <= high:
+            raise HTTPException(status_code=422, detail=f"compression for {image_format} must be between {low} and {high}.")
+    if thumbnail is not None and thumbnail < 1:
+        raise HTTPException(status_code=422, detail="thumbnail must be a positive size in pixels.")
+    return {
+        "kind": kind, "image_format": image_format, "quality": quality,
+        "compression": compression, "thumbnail": thumbnail, "variant": variant,
+    }
+
+DEFAULT_RESULT_OPTIONS = {
+    "kind": "json", "image_format": "png", "quality": RESULT_IMAGE_QUALITY,
+    "compression": None, "thumbnail": None, "variant": 0,
+}
+
+def job_result_response(job, timing: bool = False, options: Optional[dict] = None) -> Response:
+    """
+    Builds the ad package response for a finished job, in the shape chosen
+    by `result_format_options`:
+
+    - "json": the ad package with base64 images (the original format).
+    - "multipart": a `multipart/mixed` body whose first part is the JSON
+      metadata and whose other parts are the encoded images.
+    - "raw": just the encoded image of one variant, with its seed in headers.
+
+    With `thumbnail`, downscaled copies are included as well (JSON and
+    multipart) or returned instead of the full image (raw).
+
+    With `timing` (or ADGEN_TIMING_HEADER=1) the response also carries a
+    Server-Timing header with the stage and function timings of the request,
+    including response encoding.
+    """
+    options = options or DEFAULT_RESULT_OPTIONS
+    result = job.result
+    if "generated_images" not in result:
+        # Catalog jobs return a JSON summary; their images are on disk
+        return JSONResponse(content=result)
+
+    kind, image_format, thumbnail = options["kind"], options["image_format"], options["thumbnail"]
+    encode_options = {"quality": options["quality"], "compression": options["compression"]}
+    media_type = IMAGE_FORMATS[image_format][1]
+    images = result["generated_images"]
+    headers = {}
+    with collect_trace() as encode_trace:
+        if kind == "raw":
+            variant = options["variant"]
+            if not 0 <= variant < len(images):
+                raise HTTPException(status_code=422, detail=f"variant must be between 0 and {len(images) - 1}.")
+            image = make_thumbnail(images[variant], thumbnail) if thumbnail else images[variant]
+            body = encode_image(image, image_format, **encode_options)
+            headers.update({
+                "X-Variant": str(variant),
+                "X-Variant-Count": str(len(images)),
+                "X-Seed": str(result["seeds"][variant]),
+            })
+        elif kind == "multipart":
+            parts, entries = [], []
+            for index, image in enumerate(images):
+                entry = {"variant": index, "seed": result["seeds"][index], "part": f"variant-{index}", "content_type": media_type}
+                parts.append((f"variant-{index}", encode_image(image, image_format, **encode_options)))
+                if thumbnail:
+                    entry["thumbnail_part"] = f"thumbnail-{index}"
+                    parts.append((f"thumbnail-{index}", encode_image(make_thumbnail(image, thumbnail), image_format, **encode_options)))
+                entries.append(entry)
+            metadata = {
+                "ad_copy": result["ad_copy"],
+                "seeds": result["seeds"],
+                "variants": result["variants"],
+                "profile": result["profile"],
+                "timings": result.get("timings", {}),
+                "images": entries,
+            }
+            extension = "jpg" if image_format == "jpeg" else image_format
+            metadata_part = (
+                {"Content-Type": "application/json", "Content-Disposition": 'inline; name="metadata"'},
+                json.dumps(metadata).encode("utf-8"),
+            )
+            image_parts = [
+                ({"Content-Type": media_type, "Content-Disposition": f'attachment; name="{name}"; filename="{name}.{extension}"'}, data)
+                for name, data in parts
+            ]
+            body, media_type = build_multipart([metadata_part] + image_parts)
+        else:
+            images_b64 = [image_to_base64(image, image_format, **encode_options) for image in images]
+            payload = {
+                "ad_copy": result["ad_copy"],
+                "generated_image_b64": images_b64[0],
+                "generated_images_b64": images_b64,
+                "image_format": image_format,
+                "seeds": result["seeds"],
+                "variants": result["variants"],
+                "profile": result["profile"],
+                "timings": result.get("timings", {}),
+            }
+            if thumbnail:
+                payload["thumbnails_b64"] = [
+                    image_to_base64(make_thumbnail(image, thumbnail), image_format, **encode_options)
+                    for image in images
+                ]
+    if timing or TIMING_HEADER:
+        all_timings = {**result.get("timings", {}), **result.get("trace", {}), **encode_trace}
+        headers["Server-Timing"] = server_timing_header(all_timings)
+    if kind == "json":
+        return JSONResponse(content=payload, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+def encode_event(event: dict) -> dict:
+    """Makes a job progress event JSON-safe; PIL images become `<name>_b64` PNG strings."""
+    data = {}
+    for key, value in event["data"].items():
+        if isinstance(value, Image.Image):
+            data[f"{key}_b64"] = image_to_base64(value)
+        else:
+            data[key] = value
+    return {**event, "data": data}
+
+# Job -> {event id: task encoding that event}, shared by every client streaming the job
+_ENCODED_EVENTS: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+async def encoded_event(job, event: dict) -> dict:
+    """
+    `encode_event(event)`, computed once however many clients stream the
+    job. Events carrying images are encoded in a worker thread, so the PNG
+    encoding doesn't block the event loop.
+    """
+    if not any(isinstance(value, Image.Image) for value in event["data"].values()):
+        return encode_event(event)
+    tasks = _ENCODED_EVENTS.setdefault(job, {})
+    if event["id"] not in tasks:
+        tasks[event["id"]] = asyncio.ensure_future(asyncio.to_thread(encode_event, event))
+    # Shielded, so a client that disconnects doesn't cancel the encoding for the others
+    return await asyncio.shield(tasks[event["id"]])
+
+# How often streaming endpoints check a job for new events
+EVENT_POLL_SECONDS = 0.25
+KEEPALIVE_SECONDS = 15
+
+async def iter_job_events(job, since: int = 0):
+    """
+    Yields a job's progress events as they are appended, starting at `since`.
+    Yields None as a keep-alive when nothing happened for a while.
+    Stops after the job's final event (succeeded, failed or cancelled).
+    """
+    cursor = since
+    last_sent = time.monotonic()
+    while True:
+        while cursor < len(job.events):
+            event = job.events[cursor]
+            cursor += 1
+            last_sent = time.monotonic()
+            yield await encoded_event(job, event)
+            if event["event"] in FINISHED_STATES:
+                return
+        if time.monotonic() - last_sent > KEEPALIVE_SECONDS:
+            last_sent = time.monotonic()
+            yield None
+        await asyncio.sleep(EVENT_POLL_SECONDS)
+
+def get_job_or_404(job_id: str):
+    job, _ = find_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
+
+# --- Job API ---
+@app.post("/jobs/", status_code=202)
+async def submit_job(
+    prompt: str = Form(...),
+    image: UploadFile = File(...),
+    num_variants: int = Form(1),
+    seeds: Optional[str] = Form(None),
+    profile: Optional[str] = Form(None),
+    copy_template: Optional[str] = Form(None),
+    output_size: Optional[int] = Form(None),
+):
+    """
+    Queues an ad-package job and returns its id right away.
+    `num_variants` scene variants are generated (optionally with
+    comma-separated `seeds`) at the speed `profile` ("baseline", "preview",
+    "standard" or "final"); the ad copy uses the `copy_template` tone or language.
+    With `output_size` (e.g. 2048) the scenes are upscaled to that long side
+    around the full-resolution product. Responds with 429 when the queue is full.
+    """
+    job = await submit_ad_package_job(prompt, image, num_variants, seeds, profile, copy_template, output_size)
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    """Returns the current status of a job."""
+    return get_job_or_404(job_id).to_dict()
+
+@app.get("/jobs/{job_id}/result")
+def job_result(job_id: str, timing: bool = False, options: dict = Depends(result_format_options)):
+    """
+    Returns the ad package of a finished job (409 while it is still running),
+    as JSON, multipart or a raw image (see `result_format_options`).
+    A job that ran past a stage time budget answers 504.
+    """
+    job = get_job_or_404(job_id)
+    if job.status == SUCCEEDED:
+        return job_result_response(job, timing, options)
+    if job.status == FAILED:
+        timed_out = isinstance(job.future.exception(), StageTimeoutError)
+        raise HTTPException(status_code=504 if timed_out else 500, detail=job.error)
+    if job.status == CANCELLED:
+        raise HTTPException(status_code=410, detail="Job was cancelled.")
+    raise HTTPException(status_code=409, detail=f"Job is {job.status}.")
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, since: int = 0):
+    """
+    Streams a job's progress as Server-Sent Events: caption, mask preview,
+    ad copy, each diffusion step and the final image, as soon as each is ready.
+    """
+    job = get_job_or_404(job_id)
+
+    async def event_stream():
+        async for event in iter_job_events(job, since):
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+
+    return StreamingResponse(
+        event_stream(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.websocket("/jobs/{job_id}/ws")
+async def job_events_ws(websocket: WebSocket, job_id: str, since: int = 0):
+    """Same progress events as `/jobs/{job_id}/events`, as JSON messages over a WebSocket."""
+    await websocket.accept()
+    job, _ = find_job(job_id)
+    if job is None:
+        await websocket.close(code=4404, reason=f"Unknown job: {job_id}")
+        return
+    try:
+        async for event in iter_job_events(job, since):
+            if event is not None:
+                await websocket.send_json(event)
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+@app.post("/jobs/{job_id}/refine", status_code=202)
+def refine_job(
+    job_id: str,
+    profile: str = Form("final"),
+    variants: Optional[str] = Form(None),
+):
+    """
+    Queues a re-render of a finished job's scene variants (comma-separated
+    `variants` indices, all by default) at a higher-quality `profile`.
+    Only inpainting runs again, with the same seeds, so a "preview" draft
+    keeps its composition. Returns the new job's id.
+    """
+    job = get_job_or_404(job_id)
+    if job.status != SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}; only finished jobs can be refined.")
+    if "segmented_image" not in job.result:
+        raise HTTPException(status_code=422, detail="This job has no scene images to refine.")
+    check_profile(profile)
+    indices = parse_int_list(variants, "variants")
+    if indices is not None and any(not 0 <= i < len(job.result["seeds"]) for i in indices):
+        raise HTTPException(status_code=422, detail=f"variants must be indices below {len(job.result['seeds'])}.")
+    try:
+        refined = JOBS.submit(refine_package_job, job.result, profile=profile, variants=indices)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return refined.to_dict()
+
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    """Cancels a queued job, or asks a running job to stop."""
+    get_job_or_404(job_id)
+    _, jobs = find_job(job_id)
+    return jobs.cancel(job_id).to_dict()
+
+# --- Bulk Catalog API ---
+@app.post("/catalog/", status_code=202)
+def submit_catalog(
+    source: str = Form(...),
+    output_dir: str = Form(...),
+    prompt: Optional[str] = Form(None),
+    num_variants: int = Form(1),
+    profile: Optional[str] = Form(None),
+    output_size: Optional[int] = Form(None),
+):
+    """
+    Queues a bulk catalog run over a server-side folder or CSV manifest.
+    `source` and `output_dir` are resolved against ADGEN_CATALOG_ROOT and
+    must stay inside it; without a root the endpoint is disabled.
+    Progress streams as "catalog_item" events on `/jobs/{job_id}/events`;
+    re-submitting the same `output_dir` resumes and skips finished items.
+    """
+    if not CATALOG_ROOT:
+        raise HTTPException(status_code=403, detail="The catalog API is disabled; set ADGEN_CATALOG_ROOT to enable it.")
+    if not 1 <= num_variants <= MAX_VARIANTS:
+        raise HTTPException(status_code=422, detail=f"num_variants must be between 1 and {MAX_VARIANTS}.")
+    check_profile(profile)
+    check_output_size(output_size)
+    from adgen_studio.catalog import CatalogError, load_manifest, resolve_under_root
+    try:
+        resolve_under_root(output_dir, CATALOG_ROOT)
+        num_items = len(load_manifest(resolve_under_root(source, CATALOG_ROOT), prompt, CATALOG_ROOT))
+    except CatalogError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    try:
+        job = CATALOG_JOBS.submit(
+            catalog_job, source, output_dir, prompt=prompt, num_variants=num_variants, profile=profile,
+            output_size=output_size, root=CATALOG_ROOT,
+        )
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {**job.to_dict(), "items": num_items}
+
+# --- Main API Endpoint (Synchronous, Kept for Compatibility) ---
+# How often the synchronous endpoint checks that its client is still connected
+DISCONNECT_POLL_SECONDS = 1.0
+
+async def wait_for_job(request: Request, job) -> None:
+    """
+    Waits for a job to finish and re-raises its error.
+
+    Starlette doesn't cancel a handler when its client disconnects, so the
+    connection is polled while the job runs. A job whose client went away
+    is cancelled, and its worker stops at the next step.
+
+    Raises:
+        HTTPException: 499 when the client disconnected.
+        asyncio.CancelledError: When the job was cancelled.
+    """
+    done = asyncio.wrap_future(job.future)
+    while not done.done():
+        await asyncio.wait({done}, timeout=DISCONNECT_POLL_SECONDS)
+        if not done.done() and await request.is_disconnected():
+            print(f"Client of job {job.id} disconnected; cancelling it.")
+            JOBS.cancel(job.id)
+            raise HTTPException(status_code=499, detail="Client closed the request.")
+    await done
+
 @app.post("/generate-ad-package/")
 async def generate_ad_package(
-    prompt: str = Form(...), 
-    image: UploadFile = File(...)
+    request: Request,
+    prompt: str = Form(...),
+    image: UploadFile = File(...),
+    num_variants: int = Form(1),
+    seeds: Optional[str] = Form(None),
+    profile: Optional[str] = Form(None),
+    copy_template: Optional[str] = Form(None),
+    output_size: Optional[int] = Form(None),
+    timing: bool = False,
+    options: dict = Depends(result_format_options),
 ):
     """
     Main endpoint to generate a full ad package.
     Receives a product image and a scene prompt.
-    Returns ad copy and a new generated image.
-    """
-    
-    temp_dir = tempfile.mkdtemp()
-    temp_image_path = os.path.join(temp_dir, image.filename)
+    Returns ad copy and a new generated image, in the same formats as
+    GET /jobs/{job_id}/result.
 
+    The work runs on the job queue; this endpoint waits for it, and cancels
+    it if the client disconnects first.
+    """
+    job = await submit_ad_package_job(prompt, image, num_variants, seeds, profile, copy_template, output_size)
     try:
-        # 1. Save uploaded image temporarily
-        with open(temp_image_path, "wb") as buffer:
-            shutil.copyfileobj(image.file, buffer)
-
-        print(f"--- API Call Started ---")
-        print(f"Prompt: {prompt}")
-
-        # --- Run Sprint 1: Vision Core ---
-        print("Running Sprint 1: Vision Core...")
-        sprint1_results = process_image(temp_image_path)
-        if "error" in sprint1_results:
-            raise HTTPException(status_code=500, detail=sprint1_results["error"])
-        
-        caption = sprint1_results["caption"]
-        segmented_image_path = sprint1_results["segmented_image_path"]
-        print(f"Sprint 1 Success. Caption: {caption}")
-        
-        # --- UNLOAD SPRINT 1 MODEL ---
-        del_caption_model()
-        gc.collect()
-
-        # --- Run Sprint 2: Generation Core ---
-        
-        # 2a. Image Generation
-        print("Running Sprint 2: Image Generation...")
-        segmented_image = Image.open(segmented_image_path)
-        base_image, mask_image = create_mask_and_image(segmented_image)
-        generated_image = generate_new_image(base_image, mask_image, prompt)
-        print("Sprint 2 Image Gen Success.")
-        
-        # --- UNLOAD SPRINT 2 (IMAGE) MODEL ---
-        del_inpainting_model()
-        del segmented_image, base_image, mask_image # Clear intermediate images
-        gc.collect()
-        
-        # 2b. Text Generation
-        print("Running Sprint 2: Text Generation...")
-        ad_copy = generate_ad_copy(caption)
-        print("Sprint 2 Text Gen Success.")
-        
-        # --- UNLOAD SPRINT 2 (TEXT) MODEL ---
-        del_text_gen_model()
-        gc.collect()
-
-        # --- Prepare Response ---
-        generated_image_b64 = image_to_base64(generated_image)
-        print("--- API Call Successful ---")
-        
-        return JSONResponse(content={
-            "ad_copy": ad_copy,
-            "generated_image_b64": generated_image_b64
-        })
-
+        await wait_for_job(request, job)
+    except asyncio.CancelledError:
+        if job.status == CANCELLED:
+            raise HTTPException(status_code=410, detail="Job was cancelled.")
+        JOBS.cancel(job.id)  # This request itself was cancelled, e.g. at shutdown
+        raise
+    except HTTPException:
+        raise
+    except StageTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         print(f"--- API Call FAILED ---")
         print(f"Error: {e}")
-        return HTTPException(status_code=500, detail=str(e))
-    
-    finally:
-        # Clean up models (as a safety net) and temp files
-        del_caption_model()
-        del_inpainting_model()
-        del_text_gen_model()
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-            print(f"Cleaned up temp directory: {temp_dir}")
-        gc.collect()
+        raise HTTPException(status_code=500, detail=str(e))
+    return await asyncio.to_thread(job_result_response, job, timing, options)
+
+# --- Health and Stats ---
+@app.get("/health")
+def health():
+    """Liveness check; answers immediately even while jobs are running or models are loading."""
+    return {"status": "ok"}
+
+def readiness() -> dict:
+    """Warm-up and worker-process state, with an overall "ready", "loading" or "failed" status."""
+    warmup, workers = WARMUP.stats(), WORKER_POOL.stats()
+    if warmup["ready"] and workers["ready"]:
+        status = "ready"
+    elif any(step["status"] == "failed" for step in warmup["steps"].values()) or any(
+        worker["status"] == "failed" for worker in workers["workers"]
+    ):
+        status = "failed"
+    else:
+        status = "loading"
+    return {"status": status, "mode": WARMUP_MODE, **warmup, "ready": status == "ready", "workers": workers["workers"]}
+
+@app.get("/ready")
+def ready():
+    """
+    Readiness check: 200 once the warm-up (and every worker process) has
+    loaded its models, 503 while they are still loading or if one failed.
+    Always ready with ADGEN_WARMUP=off and no worker processes, since models
+    then load on first use.
+    """
+    state = readiness()
+    return JSONResponse(content=state, status_code=200 if state["ready"] else 503)
+
+@app.get("/jobs/")
+def job_stats():
+    """Reports worker count, queue capacity and job counts by state, for interactive jobs and catalog runs."""
+    return {**JOBS.stats(), "catalog": CATALOG_JOBS.stats()}
+
+@app.get("/models/stats")
+def model_stats():
+    """Reports resident models, the registry's hit/miss/eviction counters and how each model's weights were loaded."""
+    return {**REGISTRY.stats(), "weights": load_reports(), "memory": process_memory()}
+
+@app.get("/workers/stats")
+def worker_stats():
+    """Reports each model worker process: hosted models, cores, status, task counts, weight loads and RSS/PSS."""
+    return WORKER_POOL.stats()
+
+@app.get("/batching/stats")
+def batching_stats():
+    """Reports batch fill ratio and queueing delay for the BLIP and Gemma batchers."""
+    return {
+        "caption": CAPTION_BATCHER.stats(),
+        "ad_copy": TEXT_GEN_BATCHER.stats(),
+    }
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Reports hit/miss counters for the result cache, the prompt-embedding cache and the prompt-prefix KV cache."""
+    return {
+        **RESULT_CACHE.stats(),
+        "prompt_embeddings": PROMPT_EMBEDDINGS.stats(),
+        "prompt_prefixes": PROMPT_PREFIXES.stats(),
+    }
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus-style metrics: step latency and peak-RSS histograms, model load times and service gauges."""
+    registry = REGISTRY.stats()
+    cache = RESULT_CACHE.stats()
+    embeddings = PROMPT_EMBEDDINGS.stats()
+    prefixes = PROMPT_PREFIXES.stats()
+    jobs = JOBS.stats()
+    catalog_jobs = CATALOG_JOBS.stats()
+    workers = WORKER_POOL.stats()
+    gauges = {
+        "adgen_model_registry_used_bytes": registry["used_bytes"],
+        "adgen_model_registry_budget_bytes": registry["budget_bytes"],
+        "adgen_model_registry_hits": registry["hits"],
+        "adgen_model_registry_misses": registry["misses"],
+        "adgen_model_registry_evictions": registry["evictions"],
+        "adgen_result_cache_hits": [
+            ({"tier": "memory"}, cache["memory_hits"]),
+            ({"tier": "disk"}, cache["disk_hits"]),
+        ],
+        "adgen_result_cache_misses": cache["misses"],
+        "adgen_prompt_embedding_cache_hits": embeddings["hits"],
+        "adgen_prompt_embedding_cache_misses": embeddings["misses"],
+        "adgen_prompt_prefix_cache_hits": prefixes["hits"],
+        "adgen_prompt_prefix_cache_misses": prefixes["misses"],
+        "adgen_jobs": [
+            *(({"status": status}, count) for status, count in jobs["jobs"].items()),
+            *(({"status": status, "queue": "catalog"}, count) for status, count in catalog_jobs["jobs"].items()),
+        ],
+    }
+    for worker in workers["workers"]:
+        labels = {"worker": worker["index"], "models": "+".join(worker["models"])}
+        gauges.setdefault("adgen_worker_in_flight", []).append((labels, worker["in_flight"]))
+        gauges.setdefault("adgen_worker_completed", []).append((labels, worker["completed"]))
+    memories = [("api", workers["memory"])] + [(f"worker-{w['index']}", w["memory"]) for w in workers["workers"]]
+    for process, memory in memories:
+        if memory is not None:
+            gauges.setdefault("adgen_process_rss_bytes", []).append(({"process": process}, memory["rss_bytes"]))
+            gauges.setdefault("adgen_process_pss_bytes", []).append(({"process": process}, memory["pss_bytes"]))
+    for name, batcher in (("caption", CAPTION_BATCHER), ("ad_copy", TEXT_GEN_BATCHER)):
+        stats = batcher.stats()
+        gauges.setdefault("adgen_batch_fill_ratio", []).append(({"batcher": name}, stats["fill_ratio"]))
+        gauges.setdefault("adgen_batch_mean_queue_delay_ms", []).append(({"batcher": name}, stats["mean_queue_delay_ms"]))
+    return PlainTextResponse(render_prometheus(gauges), media_type="text/plain; version=0.0.4")
 
 # --- Run the Server ---
 if __name__ == "__main__":
     print("Starting AdGen Studio API server...")
-    uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="127.0.0.1", port=8000)
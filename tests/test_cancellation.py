@@ -0,0 +1,51 @@
+import time
+
+from adgen_studio.cancellation import CancelToken, OperationCancelled, StageTimeoutError
+
+print("--- STARTING CANCEL TOKEN TEST ---")
+
+# 1. A deadline fires lazily, the next time the token is checked
+token = CancelToken(0.2, "caption")
+assert not token.cancelled and 0 < token.remaining() <= 0.2
+time.sleep(0.25)
+try:
+    token.check()
+    raise AssertionError("the deadline didn't fire")
+except StageTimeoutError as e:
+    print(f"Deadline: {e}")
+assert token.timed_out and token.remaining() == 0.0
+
+# 2. No timeout (None or 0) means no deadline
+assert CancelToken().remaining() is None and CancelToken(0).remaining() is None
+
+# 3. A child fires with its parent, and its own shorter budget fires alone
+parent = CancelToken(name="job")
+child = parent.child(0.1, "inpainting")
+sibling = parent.child(name="ad_copy")
+time.sleep(0.15)
+assert child.cancelled and child.timed_out
+assert not parent.cancelled and not sibling.cancelled
+
+fired = []
+sibling.on_cancel(lambda: fired.append("sibling"))
+parent.cancel("Job was cancelled.")
+assert sibling.cancelled and not sibling.timed_out and sibling.reason == "Job was cancelled."
+assert fired == ["sibling"]
+try:
+    sibling.check()
+    raise AssertionError("the parent's cancel didn't reach the child")
+except StageTimeoutError:
+    raise AssertionError("a cancel isn't a timeout")
+except OperationCancelled as e:
+    print(f"Child of a cancelled parent: {e}")
+
+# 4. A child's remaining time is bounded by its parent's deadline
+parent = CancelToken(0.5, "job")
+assert parent.child(10, "stage").remaining() <= 0.5
+# A child of an already cancelled token starts out cancelled
+cancelled = CancelToken()
+cancelled.cancel()
+assert cancelled.child(5).cancelled
+
+print("Cancel token test SUCCESSFUL!")
+print("---------------------")
@@ -0,0 +1,69 @@
+import json
+import os
+import tempfile
+
+from PIL import Image
+
+# Tiny stand-in models, so the catalog runs in seconds without downloads
+from benchmarks.standins import install_standins
+install_standins()
+
+from adgen_studio.catalog import RESULTS_FILENAME, STAGE_TIMEOUTS, CatalogError, run_catalog
+
+print("--- STARTING CATALOG RESUME TEST ---")
+
+root = tempfile.mkdtemp(prefix="adgen_catalog_test_")
+products, output_dir = os.path.join(root, "products"), os.path.join(root, "out")
+os.makedirs(products)
+for name, color in [("mug", "red"), ("lamp", "blue")]:
+    Image.new("RGB", (96, 96), color).save(os.path.join(products, f"{name}.png"))
+
+def records() -> list[dict]:
+    with open(os.path.join(output_dir, RESULTS_FILENAME), encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+# 1. A first run does every item
+summary = run_catalog(products, output_dir, prompt="on a table")
+print(summary)
+assert (summary["total"], summary["skipped"], summary["succeeded"], summary["failed"]) == (2, 0, 2, 0)
+assert sorted(record["id"] for record in records()) == ["lamp", "mug"]
+
+# 2. Re-running skips what succeeded and only does the new item
+Image.new("RGB", (96, 96), "green").save(os.path.join(products, "vase.png"))
+summary = run_catalog(products, output_dir, prompt="on a table")
+print(summary)
+assert (summary["total"], summary["skipped"], summary["succeeded"]) == (3, 2, 1)
+assert [record["id"] for record in records()].count("vase") == 1
+
+# 3. Failed items are retried; a line cut short by a crash is ignored
+with open(os.path.join(output_dir, RESULTS_FILENAME), "a", encoding="utf-8") as f:
+    f.write(json.dumps({"id": "mug", "status": "failed", "error": "simulated"}) + "\n")
+    f.write('{"id": "lamp", "sta')
+summary = run_catalog(products, output_dir, prompt="on a table")
+print(summary)
+assert (summary["skipped"], summary["succeeded"]) == (2, 1)
+
+# 4. The retried record starts on its own line, so the next run finds it
+summary = run_catalog(products, output_dir, prompt="on a table")
+print(summary)
+assert (summary["skipped"], summary["succeeded"]) == (3, 0)
+
+# 5. An unknown profile is rejected before any item runs
+try:
+    run_catalog(products, os.path.join(root, "typo"), prompt="on a table", profile="fianl")
+    raise AssertionError("the unknown profile wasn't rejected")
+except CatalogError as e:
+    print(f"Rejected: {e}")
+assert not os.path.exists(os.path.join(root, "typo"))
+
+# 6. The segmentation time budget applies to each item, which fails on its own
+STAGE_TIMEOUTS["segmentation"] = 1e-6
+try:
+    summary = run_catalog(products, os.path.join(root, "budget"), prompt="on a table")
+finally:
+    STAGE_TIMEOUTS["segmentation"] = 0
+print(summary)
+assert (summary["succeeded"], summary["failed"]) == (0, 3)
+
+print("Catalog resume test SUCCESSFUL!")
+print("---------------------")
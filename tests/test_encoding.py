@@ -0,0 +1,34 @@
+from adgen_studio.encoding import negotiate
+
+print("--- STARTING CONTENT NEGOTIATION TEST ---")
+
+cases = [
+    (None, ("json", "")),
+    ("", ("json", "")),
+    ("*/*", ("json", "")),
+    ("application/json", ("json", "")),
+    ("multipart/mixed", ("multipart", "")),
+    ("image/webp", ("raw", "webp")),
+    ("image/jpeg;q=0.9", ("raw", "jpeg")),
+    ("image/*", ("raw", "png")),
+    # Media ranges with the same q are taken in order; unknown ones are skipped
+    ("text/html, image/png, application/json", ("raw", "png")),
+    ("application/json, image/png", ("json", "")),
+    # A higher q wins regardless of order, and q=0 rules a range out
+    ("image/png;q=0.1, application/json", ("json", "")),
+    ("application/json;q=0.5, image/webp;q=0.8", ("raw", "webp")),
+    ("multipart/mixed;q=0.9, image/*;q=1.0", ("raw", "png")),
+    ("image/png;q=0", ("json", "")),
+    ("image/png;q=oops, multipart/mixed;q=0.2", ("multipart", "")),
+    ("image/gif", ("json", "")),
+]
+for accept, expected in cases:
+    result = negotiate(accept, "png")
+    print(f"Accept: {accept!r} -> {result}")
+    assert result == expected, (accept, result)
+
+# image/* falls back to the configured default format
+assert negotiate("image/*", "webp") == ("raw", "webp")
+
+print("Content negotiation test SUCCESSFUL!")
+print("---------------------")
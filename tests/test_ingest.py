@@ -0,0 +1,64 @@
+import io
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from adgen_studio.ingest import UploadLimitMiddleware, decode_image
+
+print("--- STARTING UPLOAD LIMIT TEST ---")
+
+app = FastAPI()
+app.add_middleware(UploadLimitMiddleware, max_bytes=1000)
+
+@app.post("/upload")
+async def upload(request: Request):
+    return {"size": len(await request.body())}
+
+client = TestClient(app)
+# Within the limit
+response = client.post("/upload", content=b"x" * 1000)
+assert response.status_code == 200 and response.json() == {"size": 1000}
+# Over the limit, declared up front in Content-Length
+response = client.post("/upload", content=b"x" * 1001)
+print(f"Declared oversized body: {response.status_code} {response.json()}")
+assert response.status_code == 413
+# Over the limit, chunked (no Content-Length), so only counted while streaming in
+response = client.post("/upload", content=(b"x" * 400 for _ in range(4)))
+print(f"Chunked oversized body: {response.status_code}")
+assert response.status_code == 413
+
+print("Upload limit test SUCCESSFUL!")
+print("---------------------")
+
+print("--- STARTING IMAGE DECODE TEST ---")
+
+def encode(image: Image.Image, image_format: str, **options) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+# 1. EXIF orientation is applied: a landscape JPEG tagged "rotate 90" decodes as portrait
+exif = Image.Exif()
+exif[0x0112] = 6
+photo = Image.new("RGB", (400, 200), "blue")
+image, original_size = decode_image(encode(photo, "JPEG", exif=exif.tobytes()), max_side=0)
+print(f"Rotated JPEG: stored {original_size}, decoded {image.size} {image.mode}")
+assert original_size == (400, 200) and image.size == (200, 400) and image.mode == "RGB"
+
+# 2. Large uploads are downscaled to the working resolution, aspect kept
+image, original_size = decode_image(encode(Image.new("RGB", (1600, 800)), "JPEG"), max_side=400)
+print(f"Large JPEG: stored {original_size}, decoded {image.size}")
+assert image.size == (400, 200)
+
+# 3. Transparent uploads keep their alpha
+cut_out = Image.new("RGBA", (100, 100), (0, 0, 0, 0))
+cut_out.paste((0, 255, 0, 255), (25, 25, 75, 75))
+for image_format in ("PNG", "WEBP"):
+    image, _ = decode_image(encode(cut_out, image_format), max_side=0)
+    print(f"Transparent {image_format}: decoded as {image.mode}")
+    assert image.mode == "RGBA"
+    assert image.getpixel((0, 0))[3] == 0 and image.getpixel((50, 50))[3] == 255
+
+print("Image decode test SUCCESSFUL!")
+print("---------------------")
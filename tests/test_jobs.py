@@ -0,0 +1,49 @@
+import time
+
+from PIL import Image
+
+from adgen_studio.jobs import FAILED, SUCCEEDED, JobQueue
+from main import release_job_images
+
+print("--- STARTING JOB RETENTION TEST ---")
+
+finished = []
+jobs = JobQueue(num_workers=1, max_queued=8, result_ttl_seconds=0.5, max_finished=2, on_job_finished=finished.append)
+
+def work(value, progress, cancel_token):
+    progress("image", {"payload": value})
+    return value
+
+def fail(progress, cancel_token):
+    raise ValueError("broken")
+
+# 1. Finished jobs are kept until the TTL, but only the `max_finished` most recent ones
+submitted = [jobs.submit(work, i) for i in range(3)] + [jobs.submit(fail)]
+while len(finished) < len(submitted):
+    time.sleep(0.01)
+print(f"Statuses: {[job.status for job in submitted]}")
+assert [job.status for job in submitted] == [SUCCEEDED] * 3 + [FAILED]
+kept = [job for job in submitted if jobs.get(job.id) is not None]
+print(f"Kept {len(kept)} of {len(submitted)} finished jobs")
+assert kept == submitted[-2:]
+
+# 2. The queue's finish hook runs for every job, whatever its outcome,
+# and the API's hook drops the images from a finished job's events, keeping the rest
+assert finished == submitted
+job = jobs.submit(work, Image.new("RGB", (8, 8)))
+while len(finished) < len(submitted) + 1:
+    time.sleep(0.01)
+[image_event] = [event for event in job.events if event["event"] == "image"]
+assert isinstance(image_event["data"]["payload"], Image.Image)
+release_job_images(job)
+print(f"Events after release: {[(event['event'], event['data']) for event in job.events]}")
+assert [event["event"] for event in job.events] == ["queued", "running", "image", "succeeded"]
+assert job.events[2]["data"] == {}
+submitted.append(job)
+
+# 3. Past the TTL, looking a job up prunes it, without waiting for a new submit
+time.sleep(0.6)
+assert jobs.get(submitted[-1].id) is None and not jobs._jobs
+
+print("Job retention test SUCCESSFUL!")
+print("---------------------")
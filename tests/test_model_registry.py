@@ -0,0 +1,57 @@
+from adgen_studio.model_registry import ModelRegistry
+
+print("--- STARTING MODEL REGISTRY TEST ---")
+
+# A budget of 10 "bytes" with stand-in models whose size is the hint
+registry = ModelRegistry(budget_bytes=10)
+
+def fake_loader(name):
+    print(f"  (loading {name})")
+    return name
+
+# 1. Two models fit together
+registry.get("blip", lambda: fake_loader("blip"), size_hint_bytes=4)
+registry.get("sd", lambda: fake_loader("sd"), size_hint_bytes=5)
+registry.get("blip", lambda: fake_loader("blip"), size_hint_bytes=4)  # hit, blip is now MRU
+
+# 2. A third model forces the LRU one ("sd") out
+registry.get("gemma", lambda: fake_loader("gemma"), size_hint_bytes=6)
+
+stats = registry.stats()
+print("\n--- TEST RESULT ---")
+print(stats)
+assert [m["name"] for m in stats["resident"]] == ["blip", "gemma"]
+assert (stats["hits"], stats["misses"], stats["evictions"]) == (1, 3, 1)
+print("Model registry test SUCCESSFUL!")
+print("---------------------")
+
+# 3. A slow load doesn't block hits on resident models, and concurrent misses load once
+import threading
+import time
+
+print("--- STARTING CONCURRENT LOAD TEST ---")
+registry = ModelRegistry(budget_bytes=100)
+registry.get("blip", lambda: fake_loader("blip"), size_hint_bytes=1)
+loads = []
+
+def slow_loader():
+    loads.append("sd")
+    time.sleep(0.5)
+    return "sd"
+
+threads = [threading.Thread(target=registry.get, args=("sd", slow_loader, 1)) for _ in range(3)]
+for thread in threads:
+    thread.start()
+time.sleep(0.1)
+start = time.perf_counter()
+assert registry.get("blip", lambda: fake_loader("blip")) == "blip"
+hit_seconds = time.perf_counter() - start
+for thread in threads:
+    thread.join()
+
+print(f"Hit during a load took {hit_seconds * 1000:.1f} ms; 'sd' loaded {len(loads)} time(s).")
+assert hit_seconds < 0.1
+assert loads == ["sd"]
+assert registry.stats()["misses"] == 2
+print("Concurrent load test SUCCESSFUL!")
+print("---------------------")
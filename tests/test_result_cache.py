@@ -0,0 +1,79 @@
+import os
+import tempfile
+import threading
+import time
+
+from PIL import Image
+
+from adgen_studio.result_cache import ResultCache, make_key
+
+print("--- STARTING RESULT CACHE TEST ---")
+
+disk_dir = tempfile.mkdtemp(prefix="adgen_cache_test_")
+cache = ResultCache(memory_items=2, disk_dir=disk_dir, disk_max_bytes=1024 ** 2)
+
+# 1. Keys depend on the stage, model, input and parameters
+key = make_key("caption", "blip", "abc")
+assert key == make_key("caption", "blip", "abc")
+assert key != make_key("caption", "blip", "abd") != make_key("caption", "blip", "abc", {"n": 2})
+
+# 2. The memory tier is an LRU of `memory_items` entries
+cache.put("a", "caption a")
+cache.put("b", "caption b")
+assert cache.get("a") == "caption a"  # "a" is now most recently used
+cache.put("c", "caption c")  # Evicts "b" from memory
+assert list(cache._memory) == ["a", "c"]
+
+# The memory tier also holds at most `memory_max_bytes`; an entry bigger than that stays on disk only
+tile = Image.new("RGBA", (32, 32))  # 4 KB of pixels
+sized = ResultCache(memory_items=10, disk_dir=None, disk_max_bytes=0, memory_max_bytes=10000)
+for name in ("t1", "t2", "t3"):
+    sized.put(name, tile)
+sized.put("huge", Image.new("RGBA", (64, 64)))
+print(f"Memory tier with a 10 KB budget: {list(sized._memory)}, {sized._memory_bytes} bytes")
+assert list(sized._memory) == ["t2", "t3"] and sized._memory_bytes == 8192
+
+# 3. Evicted entries are still found on disk, and come back into memory
+assert cache.get("b") == "caption b"
+assert (cache.memory_hits, cache.disk_hits, cache.misses) == (1, 1, 0)
+assert cache.get("missing") is None and cache.misses == 1
+
+# 4. Images round-trip through the disk tier as PNG
+image = Image.new("RGBA", (32, 32), (10, 20, 30, 40))
+cache.put("image", image)
+fresh = ResultCache(memory_items=2, disk_dir=disk_dir, disk_max_bytes=1024 ** 2)
+assert fresh.get("image").tobytes() == image.tobytes()
+
+# 5. The disk tier evicts the least recently used files past its size limit
+small_dir = tempfile.mkdtemp(prefix="adgen_cache_test_")
+small = ResultCache(memory_items=1, disk_dir=small_dir, disk_max_bytes=2500)
+for name in ("old", "mid", "new"):
+    small.put(name, "x" * 1000)
+    time.sleep(0.05)  # Distinct modification times
+files = sorted(os.listdir(small_dir))
+print(f"Disk tier after three 1 KB entries with a 2.5 KB limit: {files}")
+assert files == ["mid.json", "new.json"]
+# The size is a running total, and a new instance starts from what is on disk
+assert small._disk_bytes == sum(os.path.getsize(os.path.join(small_dir, f)) for f in files)
+assert ResultCache(memory_items=1, disk_dir=small_dir, disk_max_bytes=2500)._disk_bytes == small._disk_bytes
+
+# Concurrent puts of one key each write their own temp file, so the entry is always whole
+def put_many(value):
+    for _ in range(20):
+        small.put("shared", value)
+
+threads = [threading.Thread(target=put_many, args=([str(i)] * 100,)) for i in range(4)]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+assert ResultCache(memory_items=1, disk_dir=small_dir, disk_max_bytes=2500).get("shared") in [[str(i)] * 100 for i in range(4)]
+assert not [f for f in os.listdir(small_dir) if f.endswith(".tmp")]
+
+# 6. A disabled cache stores nothing
+disabled = ResultCache(memory_items=2, disk_dir=None, disk_max_bytes=0, enabled=False)
+disabled.put("a", "caption a")
+assert disabled.get("a") is None
+
+print("Result cache test SUCCESSFUL!")
+print("---------------------")
@@ -0,0 +1,94 @@
+import threading
+import time
+
+from adgen_studio.cancellation import OperationCancelled, current_token
+from adgen_studio.stage_graph import Stage, run_stage_graph
+
+print("--- STARTING STAGE GRAPH TEST ---")
+
+events = []
+lock = threading.Lock()
+
+def stage(name, seconds=0.1, result=None):
+    def fn(**inputs):
+        with lock:
+            events.append(("start", name, sorted(inputs)))
+        time.sleep(seconds)
+        with lock:
+            events.append(("end", name))
+        return result if result is not None else name
+    return fn
+
+def order(kind):
+    return [event[1] for event in events if event[0] == kind]
+
+# 1. The ad-package shape: caption and segmentation in parallel, then the stages that need them
+stages = [
+    Stage("caption", stage("caption")),
+    Stage("segmentation", stage("segmentation")),
+    Stage("ad_copy", stage("ad_copy"), deps=["caption"]),
+    Stage("inpainting", stage("inpainting"), deps=["segmentation"]),
+]
+outputs, timings = run_stage_graph(stages, max_workers=2)
+print(f"Start order: {order('start')}")
+assert set(order("start")[:2]) == {"caption", "segmentation"}
+position = {event[:2]: i for i, event in enumerate(events)}
+assert position[("start", "ad_copy")] > position[("end", "caption")]
+assert position[("start", "inpainting")] > position[("end", "segmentation")]
+assert ("start", "ad_copy", ["caption"]) in events and ("start", "inpainting", ["segmentation"]) in events
+assert outputs == {name: name for name in ("caption", "segmentation", "ad_copy", "inpainting")}
+assert set(timings) == set(outputs)
+
+# 2. Stages that don't fit the memory budget together run one after the other
+events.clear()
+stages = [Stage("big_a", stage("big_a"), memory_bytes=6), Stage("big_b", stage("big_b"), memory_bytes=6)]
+run_stage_graph(stages, max_workers=2, memory_budget_bytes=10)
+print(f"Over budget: {events}")
+assert [event[:2] for event in events] == [("start", "big_a"), ("end", "big_a"), ("start", "big_b"), ("end", "big_b")]
+
+# ...and a stage bigger than the whole budget still runs, on its own
+events.clear()
+run_stage_graph([Stage("huge", stage("huge"), memory_bytes=50)], memory_budget_bytes=10)
+assert order("end") == ["huge"]
+
+# 3. Within the budget they overlap
+events.clear()
+stages = [Stage("small_a", stage("small_a"), memory_bytes=4), Stage("small_b", stage("small_b"), memory_bytes=4)]
+run_stage_graph(stages, max_workers=2, memory_budget_bytes=10)
+assert [event[0] for event in events] == ["start", "start", "end", "end"]
+
+# 4. A failing stage stops the ones still running at their next check
+def failing():
+    time.sleep(0.05)
+    raise RuntimeError("segmentation failed")
+
+def long_running():
+    for _ in range(100):
+        current_token().check()
+        time.sleep(0.01)
+    return "finished"
+
+start = time.perf_counter()
+try:
+    run_stage_graph([Stage("segmentation", failing), Stage("caption", long_running)], max_workers=2)
+    raise AssertionError("the stage error wasn't raised")
+except RuntimeError as e:
+    print(f"Failed after {time.perf_counter() - start:.2f}s: {e}")
+assert time.perf_counter() - start < 0.5
+
+# 5. A stage past its time budget is cancelled
+try:
+    run_stage_graph([Stage("caption", long_running, timeout=0.1)])
+    raise AssertionError("the time budget didn't fire")
+except OperationCancelled as e:
+    print(f"Timed out: {e}")
+
+# 6. Unknown dependencies are rejected up front
+try:
+    run_stage_graph([Stage("ad_copy", stage("ad_copy"), deps=["caption"])])
+    raise AssertionError("the unknown dependency wasn't rejected")
+except ValueError as e:
+    print(f"Rejected: {e}")
+
+print("Stage graph test SUCCESSFUL!")
+print("---------------------")
@@ -0,0 +1,80 @@
+import torch
+
+# Tiny stand-in models, so streaming runs in seconds without downloads
+from benchmarks.standins import install_standins
+install_standins()
+
+from adgen_studio.cancellation import CancelToken, OperationCancelled
+from adgen_studio.gen_core.text_generation import (
+    VariationStoppingCriteria, generate_ad_copy, parse_variations, stream_ad_copy,
+)
+
+print("--- STARTING AD COPY VARIATIONS TEST ---")
+
+# 1. Parsing: preamble and trailing commentary are dropped, markdown is cleaned
+text = "Here are two ads:\n\nVariation 1: **Fresh** coffee\nVariation 2: Bold taste\n\nHope this helps!"
+assert parse_variations(text) == ["Fresh coffee", "Bold taste"]
+assert parse_variations(text, 1) == ["Fresh coffee"]
+assert parse_variations("Just one ad") == ["Just one ad"]
+# While generating, the last variation only counts once something follows it
+assert parse_variations("Variation 1: a\nVariation 2: b", final=False) == ["a"]
+assert parse_variations("Variation 1: a\nVariation 2: b\n\n", final=False) == ["a", "b"]
+assert parse_variations("Just one", final=False) == []
+print("parse_variations OK")
+
+# 2. Stopping: each row stops once it holds its own number of complete variations
+class FakeTokenizer:
+    """Token i decodes to the i-th piece of text; counts how many tokens it decodes."""
+    pieces = ["", "Variation 1: a\n", "Variation 2: b\n", "Variation 3: c\n", "\n", "Variation 2:", " b\n"]
+    decoded = 0
+
+    def decode(self, ids, skip_special_tokens=True):
+        self.decoded += len(ids)
+        return "".join(self.pieces[i] for i in ids.tolist())
+
+seen = {0: [], 1: []}
+criteria = VariationStoppingCriteria(
+    FakeTokenizer(), prompt_length=1, counts=[1, 2],
+    callbacks=[lambda i, t: seen[0].append((i, t)), lambda i, t: seen[1].append((i, t))],
+)
+steps = [
+    [[0, 1], [0, 1]],
+    [[0, 1, 2], [0, 1, 2]],
+    [[0, 1, 2, 3], [0, 1, 2, 3]],
+]
+done = [criteria(torch.tensor(ids), None).tolist() for ids in steps]
+print(f"Rows done after each step: {done}; callbacks: {seen}")
+assert done == [[False, False], [True, False], [True, True]]
+assert seen == {0: [(0, "a")], 1: [(0, "a"), (1, "b")]}
+
+# 3. Only the line in progress is decoded each step, not the whole text so far
+tokenizer = FakeTokenizer()
+criteria = VariationStoppingCriteria(tokenizer, prompt_length=1, counts=[2], callbacks=[None])
+ids = [0]
+for token in [1, 5, 6, 3]:
+    ids.append(token)
+    done = criteria(torch.tensor([ids]), None).tolist()
+print(f"Decoded {tokenizer.decoded} tokens over {len(ids) - 1} steps; variations: {criteria.emitted}")
+assert done == [True] and criteria.emitted == [2]
+assert tokenizer.decoded == 1 + 1 + 2 + 1
+print("VariationStoppingCriteria OK")
+
+# 4. stream_ad_copy yields the same variations generate_ad_copy returns
+streamed = list(stream_ad_copy("a white mug", num_variations=2))
+print(f"Streamed: {streamed}")
+assert streamed and streamed == generate_ad_copy("a white mug", num_variations=2)
+# Closing the stream early doesn't hang, and a cancelled caller's token is raised
+stream = stream_ad_copy("a black bottle", num_variations=2)
+next(stream)
+stream.close()
+cancelled = CancelToken()
+cancelled.cancel()
+try:
+    list(stream_ad_copy("a wooden table", cancel_token=cancelled))
+    raise AssertionError("a cancelled stream yielded its variations")
+except OperationCancelled as e:
+    print(f"Cancelled stream: {e}")
+print("stream_ad_copy OK")
+
+print("Ad copy variations test SUCCESSFUL!")
+print("---------------------")
@@ -0,0 +1,35 @@
+from adgen_studio import warmup
+from adgen_studio.warmup import FAILED, READY, Warmup
+
+print("--- STARTING WARM-UP TEST ---")
+
+warmed = []
+
+def warm_up_stand_in(forward=True):
+    warmed.append(forward)
+
+# A step whose module can't be imported (e.g. a missing optional dependency)
+# next to one that works; the heavy pipeline imports are skipped here
+warmup.WARMUP_IMPORTS = ()
+warmup.WARMUP_STEPS["broken"] = ("adgen_studio.no_such_module", "warm_up")
+warmup.WARMUP_STEPS["stand_in"] = ("__main__", "warm_up_stand_in")
+
+# 1. The failed import is recorded as that step's failure, and later steps still run
+steps = Warmup(["broken", "stand_in"], forward=False)
+steps.run()
+stats = steps.stats()
+print(stats)
+assert stats["steps"]["broken"]["status"] == FAILED
+assert "no_such_module" in stats["steps"]["broken"]["error"]
+assert stats["steps"]["stand_in"]["status"] == READY and warmed == [False]
+assert not steps.ready
+
+# 2. In background mode the thread finishes and reports the failure too
+steps = Warmup(["broken"])
+steps.start()
+steps._thread.join(timeout=10)
+assert not steps._thread.is_alive()
+assert steps.stats()["steps"]["broken"]["status"] == FAILED
+
+print("Warm-up test SUCCESSFUL!")
+print("---------------------")